@@ -0,0 +1,226 @@
+"""
+This module load tests the asynchronous API of the RAG chatbot against the stubbed Bedrock
+clients. A single event loop serves an increasing number of concurrent conversations, each
+retrieving documents and asking the LLM for several turns, and the throughput and the latency
+percentiles of the turns are reported next to the same load served sequentially.
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from bedrock_stubs import StubRuntimeClient, StubAgentRuntimeClient
+from ns_chatbot_rag import NSChatbotRAG
+
+
+def create_chatbot(retrieval_latency, llm_latency):
+    """
+    Creates a RAG chatbot whose clients are stubs with the given latencies.
+
+    Parameters
+    ----------
+    retrieval_latency : float
+        The seconds needed to retrieve the documents.
+    llm_latency : float
+        The seconds needed to generate an answer.
+
+    Returns
+    -------
+    NSChatbotRAG
+        The chatbot with stubbed clients.
+    """
+
+    return NSChatbotRAG(
+        runtime_client=StubRuntimeClient(first_token_latency=llm_latency, token_latency=0),
+        agent_runtime_client=StubAgentRuntimeClient(retrieval_latency=retrieval_latency),
+    )
+
+
+async def run_conversation(chatbot, conversation_index, turns_no, turn_latencies):
+    """
+    Runs the turns of a conversation, with queries which are never cached.
+
+    Parameters
+    ----------
+    chatbot : NSChatbotRAG
+        The chatbot of the conversation.
+    conversation_index : int
+        The index of the conversation, which makes its queries unique.
+    turns_no : int
+        The number of turns.
+    turn_latencies : list of float
+        The list to which the latency of every turn is appended.
+    """
+
+    for turn_index in range(turns_no):
+        query = f"Question {turn_index} of conversation {conversation_index}"
+        start_time = time.perf_counter()
+
+        retrieved_documents, _ = await chatbot.aretrieve_top_k_documents(query, use_cache=False)
+        await chatbot.aask_chatbot(query, retrieved_documents)
+
+        turn_latencies.append(time.perf_counter() - start_time)
+
+
+async def run_load(conversations_no, turns_no, retrieval_latency, llm_latency):
+    """
+    Runs concurrent conversations on the current event loop.
+
+    Parameters
+    ----------
+    conversations_no : int
+        The number of concurrent conversations.
+    turns_no : int
+        The number of turns of every conversation.
+    retrieval_latency, llm_latency : float
+        The latencies of the stubbed clients, in seconds.
+
+    Returns
+    -------
+    dict
+        The throughput in turns per second and the latency percentiles of the turns.
+    """
+
+    chatbots = [create_chatbot(retrieval_latency, llm_latency) for _ in range(conversations_no)]
+    turn_latencies = []
+
+    start_time = time.perf_counter()
+    await asyncio.gather(
+        *(
+            run_conversation(chatbot, conversation_index, turns_no, turn_latencies)
+            for conversation_index, chatbot in enumerate(chatbots)
+        )
+    )
+    elapsed_time = time.perf_counter() - start_time
+
+    return summarize_load(turn_latencies, elapsed_time)
+
+
+def run_sequential_load(conversations_no, turns_no, retrieval_latency, llm_latency):
+    """
+    Runs the same conversations one after the other with the synchronous API.
+
+    Parameters
+    ----------
+    conversations_no : int
+        The number of conversations.
+    turns_no : int
+        The number of turns of every conversation.
+    retrieval_latency, llm_latency : float
+        The latencies of the stubbed clients, in seconds.
+
+    Returns
+    -------
+    dict
+        The throughput in turns per second and the latency percentiles of the turns.
+    """
+
+    turn_latencies = []
+    start_time = time.perf_counter()
+
+    for conversation_index in range(conversations_no):
+        chatbot = create_chatbot(retrieval_latency, llm_latency)
+
+        for turn_index in range(turns_no):
+            query = f"Question {turn_index} of conversation {conversation_index}"
+            turn_start_time = time.perf_counter()
+
+            retrieved_documents, _ = chatbot.retrieve_top_k_documents(query, use_cache=False)
+            chatbot.ask_chatbot(query, retrieved_documents)
+
+            turn_latencies.append(time.perf_counter() - turn_start_time)
+
+    return summarize_load(turn_latencies, time.perf_counter() - start_time)
+
+
+def summarize_load(turn_latencies, elapsed_time):
+    """
+    Computes the throughput and the latency percentiles of a load test.
+
+    Parameters
+    ----------
+    turn_latencies : list of float
+        The latency of every turn, in seconds.
+    elapsed_time : float
+        The duration of the load test, in seconds.
+
+    Returns
+    -------
+    dict
+        The throughput in turns per second and the latency percentiles in milliseconds.
+    """
+
+    percentiles = statistics.quantiles(turn_latencies, n=100, method="inclusive")
+
+    return {
+        "turns": len(turn_latencies),
+        "throughput_turns_per_s": len(turn_latencies) / elapsed_time,
+        "latency_ms_p50": percentiles[49] * 1000,
+        "latency_ms_p95": percentiles[94] * 1000,
+    }
+
+
+def benchmark(concurrency_levels, turns_no, retrieval_latency, llm_latency):
+    """
+    Load tests the asynchronous API at several concurrency levels.
+
+    Parameters
+    ----------
+    concurrency_levels : list of int
+        The numbers of concurrent conversations.
+    turns_no : int
+        The number of turns of every conversation.
+    retrieval_latency, llm_latency : float
+        The latencies of the stubbed clients, in seconds.
+
+    Returns
+    -------
+    dict
+        The results of the sequential baseline and of every concurrency level.
+    """
+
+    results = {
+        "sequential": run_sequential_load(
+            concurrency_levels[0], turns_no, retrieval_latency, llm_latency
+        )
+    }
+
+    for conversations_no in concurrency_levels:
+        results[f"async_{conversations_no}_conversations"] = asyncio.run(
+            run_load(conversations_no, turns_no, retrieval_latency, llm_latency)
+        )
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--conversations",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16, 64],
+        help="numbers of concurrent conversations",
+    )
+    parser.add_argument("--turns", type=int, default=3, help="number of turns per conversation")
+    parser.add_argument("--retrieval-latency", type=float, default=0.1, help="seconds")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds")
+    arguments = parser.parse_args()
+
+    print(
+        json.dumps(
+            benchmark(
+                arguments.conversations,
+                arguments.turns,
+                arguments.retrieval_latency,
+                arguments.llm_latency,
+            ),
+            indent=4,
+        )
+    )
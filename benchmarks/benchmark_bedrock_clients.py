@@ -0,0 +1,121 @@
+"""
+This module benchmarks the startup of chatbot sessions when every session creates its own
+boto3 session and Bedrock clients, as the chatbots did before, and when the sessions reuse the
+clients of the shared registry. Both strategies are run in a fresh Python process and the
+clients are only created, so no AWS credentials or network access are needed.
+"""
+
+import sys
+import json
+import argparse
+import subprocess
+from pathlib import Path
+
+SOURCE_DIRECTORY = Path(__file__).resolve().parents[1] / "src"
+
+# creates the clients of a number of sessions and keeps them alive, like the Streamlit sessions
+SESSIONS_SCRIPT = """
+import json, os, time, statistics
+import psutil
+
+os.environ.setdefault("AWS_REGION_NAME", "eu-central-1")
+os.environ.setdefault("AWS_DEFAULT_REGION", os.environ["AWS_REGION_NAME"])
+
+from boto3.session import Session
+from bedrock_clients import get_client
+from utils import load_env_variables
+
+
+def create_session_clients():
+    env_variables = load_env_variables()
+    session = Session(
+        profile_name=env_variables["profile_name"], region_name=env_variables["region_name"]
+    )
+    return session.client("bedrock-agent-runtime"), session.client("bedrock-runtime")
+
+
+def reuse_shared_clients():
+    return get_client("bedrock-agent-runtime"), get_client("bedrock-runtime")
+
+
+create_clients = {{"per_session": create_session_clients, "shared": reuse_shared_clients}}[
+    {strategy!r}
+]
+process = psutil.Process()
+rss_before = process.memory_info().rss
+startup_times = []
+sessions = []
+
+for _ in range({sessions_no}):
+    start = time.perf_counter()
+    sessions.append(create_clients())
+    startup_times.append((time.perf_counter() - start) * 1000)
+
+print(json.dumps({{
+    "first_session_ms": startup_times[0],
+    "next_sessions_ms_median": statistics.median(startup_times[1:]),
+    "rss_increase_mb": (process.memory_info().rss - rss_before) / 2**20,
+    "distinct_clients": len({{id(client) for clients in sessions for client in clients}}),
+}}))
+"""
+
+
+def run_sessions(strategy, sessions_no):
+    """
+    Creates the clients of the sessions in a fresh Python process.
+
+    Parameters
+    ----------
+    strategy : str
+        Either 'per_session' or 'shared'.
+    sessions_no : int
+        The number of chatbot sessions.
+
+    Returns
+    -------
+    dict
+        The startup time of the first session, the median startup time of the next sessions,
+        the increase of the resident memory and the number of distinct clients.
+    """
+
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            SESSIONS_SCRIPT.format(strategy=strategy, sessions_no=sessions_no),
+        ],
+        cwd=SOURCE_DIRECTORY,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+    return json.loads(output)
+
+
+def benchmark(sessions_no):
+    """
+    Benchmarks the session startup with clients per session and with shared clients.
+
+    Parameters
+    ----------
+    sessions_no : int
+        The number of chatbot sessions of every strategy.
+
+    Returns
+    -------
+    dict
+        The results of every strategy.
+    """
+
+    return {
+        strategy: run_sessions(strategy, sessions_no) for strategy in ("per_session", "shared")
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=20, help="number of chatbot sessions")
+    arguments = parser.parse_args()
+
+    print(json.dumps(benchmark(arguments.sessions), indent=4))
@@ -0,0 +1,100 @@
+"""
+This module benchmarks the cold start of the disruptions Lambda function when the disruptions
+are compiled from the CSV file and when they are memory-mapped from the binary store. Every
+run is executed in a fresh Python process, to mimic a new Lambda container.
+"""
+
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+LAMBDA_DIRECTORY = Path(__file__).resolve().parents[1] / "src" / "disruptions_lambda"
+
+# measures the time and the resident memory needed to answer the first query
+COLD_START_SCRIPT = """
+import json, os, time
+import psutil
+
+process = psutil.Process()
+rss_before = process.memory_info().rss
+start = time.perf_counter()
+
+from check_disruptions import CheckDisruptions
+
+CheckDisruptions.DISRUPTIONS_STORE_PATH = {store_path!r}
+CheckDisruptions.get_disruption_from_station("Amsterdam")
+
+print(json.dumps({{
+    "cold_start_ms": (time.perf_counter() - start) * 1000,
+    "rss_increase_mb": (process.memory_info().rss - rss_before) / 2**20,
+    "source_path": CheckDisruptions._source_path,
+}}))
+"""
+
+
+def run_cold_start(store_path):
+    """
+    Runs a cold start in a fresh Python process.
+
+    Parameters
+    ----------
+    store_path : str
+        The path of the binary store, which does not exist for the CSV path.
+
+    Returns
+    -------
+    dict
+        The cold start time, the increase of the resident memory and the loaded file.
+    """
+
+    output = subprocess.run(
+        [sys.executable, "-c", COLD_START_SCRIPT.format(store_path=store_path)],
+        cwd=LAMBDA_DIRECTORY,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+    return json.loads(output)
+
+
+def benchmark(runs_no):
+    """
+    Benchmarks the cold start of the CSV and of the binary store paths.
+
+    Parameters
+    ----------
+    runs_no : int
+        The number of cold starts for each path.
+
+    Returns
+    -------
+    dict
+        The median cold start time and resident memory increase of each path.
+    """
+
+    store_path = "./ns_trains_disruptions_2024.nsds"
+    if not (LAMBDA_DIRECTORY / store_path).exists():
+        raise FileNotFoundError("Build the disruptions store first with build_lambda.py.")
+
+    results = {}
+    for path_name, path in (("csv", "./missing.nsds"), ("binary_store", store_path)):
+        runs = [run_cold_start(path) for _ in range(runs_no)]
+        results[path_name] = {
+            "source_path": runs[0]["source_path"],
+            "cold_start_ms_median": statistics.median(run["cold_start_ms"] for run in runs),
+            "rss_increase_mb_median": statistics.median(run["rss_increase_mb"] for run in runs),
+        }
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10, help="number of cold starts per path")
+    arguments = parser.parse_args()
+
+    print(json.dumps(benchmark(arguments.runs), indent=4))
@@ -0,0 +1,499 @@
+"""
+This module benchmarks the chatbots and the disruptions Lambda function offline. The Bedrock
+runtime and agent runtime clients of the RAG and agent chatbots are replaced by the stubs of
+`bedrock_stubs`, whose latencies and streaming behaviour are configurable, and the questions of
+`data/questions.md` are answered at several concurrency levels. The Lambda handler is invoked
+directly with the requests of the Bedrock agent. The latency percentiles, the throughput and
+the resident memory of every scenario are written as JSON, so the results of the releases can
+be compared.
+"""
+
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+ROOT_DIRECTORY = Path(__file__).resolve().parents[1]
+LAMBDA_DIRECTORY = ROOT_DIRECTORY / "src" / "disruptions_lambda"
+QUESTIONS_PATH = ROOT_DIRECTORY / "data" / "questions.md"
+
+sys.path.append(str(ROOT_DIRECTORY / "src"))
+sys.path.append(str(LAMBDA_DIRECTORY))
+
+from bedrock_stubs import StubRuntimeClient, StubAgentRuntimeClient, split_text
+from ns_chatbot_rag import NSChatbotRAG
+from ns_chatbot_agent import NSChatbotAgent
+
+# the requests sent by the Bedrock agent to the Lambda function, one per available function
+LAMBDA_EVENTS = [
+    ("get_disruptions_train_station", {"train_station_name": "Amsterdam"}),
+    ("get_disruptions_train_station", {"train_station_name": "Enschede"}),
+    ("get_disruptions_train_station", {"train_station_name": "London"}),
+    ("get_disruptions_train_stations", {"train_station_names": "Eindhoven, Utrecht, Venlo"}),
+    (
+        "get_disruptions_time_window",
+        {"start_time": "2024-06-01T08:00", "end_time": "2024-06-01T12:00"},
+    ),
+    (
+        "get_disruptions_route",
+        {"departure_station_name": "Amsterdam", "arrival_station_name": "Haarlem"},
+    ),
+    ("get_disruption_stats", {"train_station_name": "Utrecht"}),
+]
+
+
+def load_questions(questions_path=QUESTIONS_PATH):
+    """
+    Loads the questions of the workload, which are the top-level items of the questions file,
+    while their indented items are the expected answers.
+
+    Parameters
+    ----------
+    questions_path : pathlib.Path, optional
+        The path of the questions file (default is `QUESTIONS_PATH`).
+
+    Returns
+    -------
+    list of str
+        The questions.
+    """
+
+    with open(questions_path, encoding="utf-8") as questions_file:
+        return [line[2:].strip() for line in questions_file if line.startswith("- ")]
+
+
+def create_lambda_event(function, parameters):
+    """
+    Creates the event sent by the Bedrock agent to invoke a function of the Lambda.
+
+    Parameters
+    ----------
+    function : str
+        The name of the function.
+    parameters : dict
+        The values of the parameters by their name.
+
+    Returns
+    -------
+    dict
+        The Lambda event.
+    """
+
+    return {
+        "messageVersion": "1.0",
+        "actionGroup": "disruptions",
+        "function": function,
+        "parameters": [
+            {"name": name, "type": "string", "value": value} for name, value in parameters.items()
+        ],
+    }
+
+
+def summarize_latencies(latencies, elapsed_time, requests_no=None):
+    """
+    Computes the throughput and the latency percentiles of a scenario.
+
+    Parameters
+    ----------
+    latencies : list of float
+        The latency of every request, in seconds.
+    elapsed_time : float
+        The duration of the scenario, in seconds.
+    requests_no : int, optional
+        The number of requests, which defaults to the number of latencies (default is None).
+
+    Returns
+    -------
+    dict
+        The throughput in requests per second and the latency percentiles in milliseconds.
+    """
+
+    if requests_no is None:
+        requests_no = len(latencies)
+
+    # the percentiles need at least two samples
+    percentiles = statistics.quantiles(latencies * (2 if len(latencies) == 1 else 1), n=100)
+
+    return {
+        "requests": requests_no,
+        "throughput_per_s": requests_no / elapsed_time,
+        "latency_ms_p50": percentiles[49] * 1000,
+        "latency_ms_p95": percentiles[94] * 1000,
+        "latency_ms_p99": percentiles[98] * 1000,
+    }
+
+
+def run_concurrently(run_request, requests, concurrency):
+    """
+    Runs requests on a number of threads and measures every request.
+
+    Parameters
+    ----------
+    run_request : callable
+        The function which runs a request and returns the seconds until its first part, such
+        as the first token of an answer, or None.
+    requests : list
+        The arguments of the requests.
+    concurrency : int
+        The number of requests served at the same time.
+
+    Returns
+    -------
+    dict
+        The throughput, the latency percentiles, the time to the first part percentiles and
+        the resident memory of the process at the end of the scenario.
+    """
+
+    def measure_request(request):
+        start_time = time.perf_counter()
+        first_part_time = run_request(request)
+
+        return time.perf_counter() - start_time, first_part_time
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        measurements = list(executor.map(measure_request, requests))
+    elapsed_time = time.perf_counter() - start_time
+
+    results = summarize_latencies([latency for latency, _ in measurements], elapsed_time)
+    first_part_times = [
+        first_part_time for _, first_part_time in measurements if first_part_time is not None
+    ]
+
+    if len(first_part_times) != 0:
+        first_part_results = summarize_latencies(first_part_times, elapsed_time)
+        for percentile in ("p50", "p95", "p99"):
+            results[f"first_token_ms_{percentile}"] = first_part_results[
+                f"latency_ms_{percentile}"
+            ]
+
+    results["rss_mb"] = psutil.Process().memory_info().rss / 2**20
+
+    return results
+
+
+def consume_stream(stream, start_time):
+    """
+    Consumes a stream of answer parts, as the UI does.
+
+    Parameters
+    ----------
+    stream : iterator of str
+        The parts of the answer.
+    start_time : float
+        The time at which the request started, from `time.perf_counter`.
+
+    Returns
+    -------
+    float or None
+        The seconds until the first part, or None if the stream was empty.
+    """
+
+    first_part_time = None
+
+    for _ in stream:
+        if first_part_time is None:
+            first_part_time = time.perf_counter() - start_time
+
+    return first_part_time
+
+
+def benchmark_rag(
+    questions, concurrency_levels, repeats_no, latencies, slow_retrieval_rate, stream
+):
+    """
+    Benchmarks the RAG chatbot, where every question starts a new conversation and the caches
+    are bypassed, so every question retrieves documents and asks the LLM.
+
+    Parameters
+    ----------
+    questions : list of str
+        The questions of the workload.
+    concurrency_levels : list of int
+        The numbers of questions answered at the same time.
+    repeats_no : int
+        The number of times the questions are asked at every concurrency level.
+    latencies : dict
+        The latencies of the stubs, in seconds.
+    slow_retrieval_rate : float
+        The share of the retrievals which take the latency of the slow retrievals.
+    stream : bool
+        Whether the answers are streamed or received at once.
+
+    Returns
+    -------
+    dict
+        The results of every concurrency level.
+    """
+
+    runtime_client = StubRuntimeClient(
+        first_token_latency=latencies["first_token"], token_latency=latencies["token"]
+    )
+    agent_runtime_client = StubAgentRuntimeClient(
+        retrieval_latency=latencies["retrieval"],
+        slow_retrieval_rate=slow_retrieval_rate,
+        slow_retrieval_latency=latencies["slow_retrieval"],
+    )
+
+    def answer_question(question):
+        start_time = time.perf_counter()
+        chatbot = NSChatbotRAG(
+            runtime_client=runtime_client, agent_runtime_client=agent_runtime_client
+        )
+
+        if stream:
+            return consume_stream(chatbot.answer_stream(question, use_cache=False), start_time)
+
+        retrieved_documents, _ = chatbot.retrieve_top_k_documents(question, use_cache=False)
+        chatbot.ask_chatbot(question, retrieved_documents)
+
+        return None
+
+    return {
+        f"concurrency_{concurrency}": run_concurrently(
+            answer_question, questions * repeats_no, concurrency
+        )
+        for concurrency in concurrency_levels
+    }
+
+
+def benchmark_agent(questions, concurrency_levels, repeats_no, latencies, stream):
+    """
+    Benchmarks the agent chatbot, where every question starts a new conversation.
+
+    Parameters
+    ----------
+    questions : list of str
+        The questions of the workload.
+    concurrency_levels : list of int
+        The numbers of questions answered at the same time.
+    repeats_no : int
+        The number of times the questions are asked at every concurrency level.
+    latencies : dict
+        The latencies of the stubs, in seconds.
+    stream : bool
+        Whether the final response is streamed or received in a single chunk.
+
+    Returns
+    -------
+    dict
+        The results of every concurrency level.
+    """
+
+    agent_runtime_client = StubAgentRuntimeClient(
+        first_chunk_latency=latencies["agent_first_chunk"],
+        chunk_latency=latencies["agent_chunk"],
+    )
+
+    # without streaming, the agent sends the whole response once all its chunks are generated
+    if not stream:
+        chunks_no = len(split_text(agent_runtime_client.response_text, 5))
+        agent_runtime_client.first_chunk_latency += latencies["agent_chunk"] * (chunks_no - 1)
+        agent_runtime_client.words_per_chunk = sys.maxsize
+
+    def answer_question(question):
+        start_time = time.perf_counter()
+        chatbot = NSChatbotAgent(agent_runtime_client=agent_runtime_client)
+
+        return consume_stream(chatbot.ask_chatbot_stream(question), start_time)
+
+    return {
+        f"concurrency_{concurrency}": run_concurrently(
+            answer_question, questions * repeats_no, concurrency
+        )
+        for concurrency in concurrency_levels
+    }
+
+
+def benchmark_lambda(concurrency_levels, invocations_no):
+    """
+    Benchmarks the Lambda handler invoked directly, with the events of all its functions.
+
+    Parameters
+    ----------
+    concurrency_levels : list of int
+        The numbers of invocations served at the same time.
+    invocations_no : int
+        The number of invocations at every concurrency level.
+
+    Returns
+    -------
+    dict
+        The duration and memory of the first invocation, which loads the disruptions, and the
+        results of every concurrency level.
+    """
+
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    start_time = time.perf_counter()
+
+    from check_disruptions import CheckDisruptions
+    from disruptions_lambda import lambda_handler
+
+    # the paths of the disruptions are relative to the directory of the Lambda
+    for path_attribute in (
+        "DISRUPTIONS_FILE_PATH",
+        "DISRUPTIONS_STORE_PATH",
+        "DISRUPTIONS_MANIFEST_PATH",
+    ):
+        setattr(
+            CheckDisruptions,
+            path_attribute,
+            str(LAMBDA_DIRECTORY / getattr(CheckDisruptions, path_attribute)),
+        )
+
+    events = [create_lambda_event(function, parameters) for function, parameters in LAMBDA_EVENTS]
+    lambda_handler(events[0], None)
+
+    results = {
+        "first_invocation": {
+            "latency_ms": (time.perf_counter() - start_time) * 1000,
+            "rss_increase_mb": (process.memory_info().rss - rss_before) / 2**20,
+            "source_path": CheckDisruptions._source_path,
+        }
+    }
+
+    def invoke_handler(event):
+        lambda_handler(event, None)
+
+    requests = [events[index % len(events)] for index in range(invocations_no)]
+    for concurrency in concurrency_levels:
+        results[f"concurrency_{concurrency}"] = run_concurrently(
+            invoke_handler, requests, concurrency
+        )
+
+    return results
+
+
+def get_git_commit():
+    """Returns the current commit of the repository, or None outside of a git checkout."""
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT_DIRECTORY,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(arguments):
+    """
+    Runs the benchmarks of the RAG chatbot, of the agent chatbot and of the Lambda handler.
+
+    Parameters
+    ----------
+    arguments : argparse.Namespace
+        The parsed command line arguments.
+
+    Returns
+    -------
+    dict
+        The environment, the configuration and the results of every benchmark.
+    """
+
+    questions = load_questions()
+    latencies = {
+        "retrieval": arguments.retrieval_latency,
+        "slow_retrieval": arguments.slow_retrieval_latency,
+        "first_token": arguments.first_token_latency,
+        "token": arguments.token_latency,
+        "agent_first_chunk": arguments.agent_first_chunk_latency,
+        "agent_chunk": arguments.agent_chunk_latency,
+    }
+
+    results = {
+        "environment": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": get_git_commit(),
+            "python_version": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "configuration": {
+            "questions": len(questions),
+            "concurrency_levels": arguments.concurrency,
+            "repeats": arguments.repeats,
+            "stream": arguments.stream,
+            "latencies_s": latencies,
+            "slow_retrieval_rate": arguments.slow_retrieval_rate,
+            "lambda_invocations": arguments.lambda_invocations,
+        },
+    }
+
+    if "rag" in arguments.targets:
+        results["rag"] = benchmark_rag(
+            questions,
+            arguments.concurrency,
+            arguments.repeats,
+            latencies,
+            arguments.slow_retrieval_rate,
+            arguments.stream,
+        )
+    if "agent" in arguments.targets:
+        results["agent"] = benchmark_agent(
+            questions, arguments.concurrency, arguments.repeats, latencies, arguments.stream
+        )
+    if "lambda" in arguments.targets:
+        results["lambda"] = benchmark_lambda(arguments.concurrency, arguments.lambda_invocations)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--targets",
+        nargs="+",
+        choices=["rag", "agent", "lambda"],
+        default=["rag", "agent", "lambda"],
+        help="components to benchmark",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16],
+        help="numbers of requests served at the same time",
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=3, help="number of times the questions are asked"
+    )
+    parser.add_argument(
+        "--no-stream",
+        dest="stream",
+        action="store_false",
+        help="receive the answers at once instead of streaming them",
+    )
+    parser.add_argument("--retrieval-latency", type=float, default=0.2, help="seconds")
+    parser.add_argument(
+        "--slow-retrieval-rate", type=float, default=0.0, help="share of slow retrievals"
+    )
+    parser.add_argument("--slow-retrieval-latency", type=float, default=2.0, help="seconds")
+    parser.add_argument("--first-token-latency", type=float, default=0.5, help="seconds")
+    parser.add_argument("--token-latency", type=float, default=0.02, help="seconds")
+    parser.add_argument("--agent-first-chunk-latency", type=float, default=2.0, help="seconds")
+    parser.add_argument("--agent-chunk-latency", type=float, default=0.05, help="seconds")
+    parser.add_argument(
+        "--lambda-invocations", type=int, default=700, help="number of Lambda invocations"
+    )
+    parser.add_argument("--output", type=Path, help="path of the JSON file with the results")
+    arguments = parser.parse_args()
+
+    results = json.dumps(benchmark(arguments), indent=4)
+
+    if arguments.output is not None:
+        arguments.output.parent.mkdir(parents=True, exist_ok=True)
+        arguments.output.write_text(results + "\n", encoding="utf-8")
+
+    print(results)
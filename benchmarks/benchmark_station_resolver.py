@@ -0,0 +1,127 @@
+"""
+This module benchmarks the resolution of station names on the full station set of the
+disruptions store. Every station is queried with its exact name and with lowercase, misspelled
+and suffixed variants, and the accuracy and latency percentiles are reported.
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+from pathlib import Path
+
+LAMBDA_DIRECTORY = Path(__file__).resolve().parents[1] / "src" / "disruptions_lambda"
+sys.path.append(str(LAMBDA_DIRECTORY))
+
+from disruptions_store import DisruptionsStore
+from station_resolver import StationResolver, normalize_station_name
+
+
+def get_variants(station_name, random_generator):
+    """
+    Generates the query variants of a station name.
+
+    Parameters
+    ----------
+    station_name : str
+        The canonical station name.
+    random_generator : random.Random
+        The generator used to choose the misspelled characters.
+
+    Returns
+    -------
+    dict of str
+        The variants of the name, keyed by the kind of variant.
+    """
+
+    variants = {
+        "exact": station_name,
+        "lowercase": station_name.lower(),
+        "suffixed": f"{station_name} station",
+    }
+
+    # misspellings are only expected to be resolved for names long enough to allow an edit
+    if len(station_name) >= 10:
+        position = random_generator.randrange(1, len(station_name) - 1)
+        variants["deleted_character"] = station_name[:position] + station_name[position + 1 :]
+        variants["swapped_characters"] = (
+            station_name[: position - 1]
+            + station_name[position]
+            + station_name[position - 1]
+            + station_name[position + 1 :]
+        )
+
+    return variants
+
+
+def percentile(values, fraction):
+    """Returns the value at a given fraction of the sorted values."""
+
+    sorted_values = sorted(values)
+
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def benchmark(repetitions):
+    """
+    Benchmarks the station resolver on every station of the disruptions store.
+
+    Parameters
+    ----------
+    repetitions : int
+        The number of times each query is timed.
+
+    Returns
+    -------
+    dict
+        The build time, the accuracy per kind of variant and the latency percentiles.
+    """
+
+    store = DisruptionsStore.from_csv(str(LAMBDA_DIRECTORY / "ns_trains_disruptions_2024.csv"))
+    station_names = list(dict.fromkeys(store.affected_stations + store.stations))
+
+    start = time.perf_counter()
+    resolver = StationResolver(station_names, store.station_codes)
+    build_time_ms = (time.perf_counter() - start) * 1000
+
+    random_generator = random.Random(0)
+    latencies_us = []
+    correct = {}
+    total = {}
+
+    for station_name in station_names:
+        for kind, variant in get_variants(station_name, random_generator).items():
+            for _ in range(repetitions):
+                start = time.perf_counter()
+                resolved_station_name = resolver.resolve(variant)
+                latencies_us.append((time.perf_counter() - start) * 1e6)
+
+            total[kind] = total.get(kind, 0) + 1
+            # names which only differ in punctuation, such as 'Almelo.', share a canonical name
+            correct[kind] = correct.get(kind, 0) + (
+                resolved_station_name is not None
+                and normalize_station_name(resolved_station_name)
+                == normalize_station_name(station_name)
+            )
+
+    return {
+        "stations_no": len(station_names),
+        "build_time_ms": build_time_ms,
+        "accuracy": {kind: correct[kind] / total[kind] for kind in total},
+        "latency_us": {
+            "p50": statistics.median(latencies_us),
+            "p95": percentile(latencies_us, 0.95),
+            "p99": percentile(latencies_us, 0.99),
+            "max": max(latencies_us),
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repetitions", type=int, default=5, help="timings per query")
+    arguments = parser.parse_args()
+
+    print(json.dumps(benchmark(arguments.repetitions), indent=4))
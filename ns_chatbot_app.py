@@ -4,43 +4,172 @@ an UI designed with Streamlit.
 """
 
 import sys
+import time
 import streamlit as st
 
 sys.path.append("./src/")
 
 from src.ns_chatbot_rag import NSChatbotRAG
 from src.ns_chatbot_agent import NSChatbotAgent
+from src.bedrock_stubs import StubRuntimeClient, StubAgentRuntimeClient
+from src.utils import load_env_variables
+from src.config import QUERY_ROUTING
+
+# imported like in the chatbots, so the app reads the histograms to which they record
+from tracing import span, is_enabled as is_tracing_enabled, get_histograms
+from query_router import route_query, ROUTE_REUSE, ROUTE_AGENT
 
 
 def generate_response(query):
+    """Generates a response from the chatbot based on the given query, traced as a turn. The
+    time spent by the UI between the parts of the response is traced as the rendering stage.
+
+    Parameters
+    ----------
+    query : str
+        The user's input query to the chatbot.
+
+    Yields
+    ------
+    str
+        The parts of the response from the chatbot, formatted for display.
+    """
+
+    with span("turn", mode=st.session_state.current_mode) as turn_span:
+        start_time = time.perf_counter()
+        render_seconds = 0.0
+        is_first_part = True
+
+        for response_part in generate_chatbot_response(query):
+            if is_first_part:
+                turn_span.record_duration(
+                    "turn.time_to_first_token", time.perf_counter() - start_time
+                )
+                is_first_part = False
+
+            render_start_time = time.perf_counter()
+            yield response_part
+            render_seconds += time.perf_counter() - render_start_time
+
+        turn_span.record_duration("ui_render", render_seconds)
+
+
+def render_tracing_panel():
+    """Displays the histograms of the traced stages in the sidebar, if tracing is enabled."""
+
+    if not is_tracing_enabled():
+        return
+
+    histograms = get_histograms()
+
+    with st.sidebar:
+        st.header("Tracing")
+        st.dataframe(
+            [{"metric": name, **summary} for name, summary in histograms.items()],
+            hide_index=True,
+        )
+
+        # every turn routed away from the retrieval saves a retrieval of the mean latency
+        retrieve_histogram = histograms.get("retrieve.duration_ms")
+        skipped_retrievals_no = sum(
+            histograms[f"route.{route}"]["count"]
+            for route in (ROUTE_REUSE, ROUTE_AGENT)
+            if f"route.{route}" in histograms
+        )
+        if retrieve_histogram is not None and skipped_retrievals_no != 0:
+            st.caption(
+                f"The router skipped {skipped_retrievals_no} retrievals, about "
+                f"{skipped_retrievals_no * retrieve_histogram['mean']:.0f} ms."
+            )
+
+
+def generate_chatbot_response(query):
     """Generates a response from the chatbot based on the given query. It dynamically handles
-    the interaction with the RAG-based chatbot or with the agent-based chatbot.
+    the interaction with the RAG-based chatbot, whose answer is streamed as it is generated
+    or reused from the cache of first-turn answers,
+    or with the agent-based chatbot, whose answer is streamed as it arrives.
+    The turns of the RAG-based chatbot are routed first: a follow-up reuses the documents of
+    the previous turn and a question about disruptions is answered by the agent-based chatbot,
+    whose answer is then added to the history of the RAG-based chatbot.
 
     Parameters
     ----------
     query : str
         The user's input query to the chatbot.
 
-    Returns
-    -------
+    Yields
+    ------
     str
-        The complete response from the chatbot, potentially including
+        The parts of the response from the chatbot, potentially followed by the
         retrieved document metadata or citations, formatted for display.
     """
 
-    if hasattr(st.session_state.chatbot, "retrieve_top_k_documents"):
-        retrieved_docs, docs_metadata = st.session_state.chatbot.retrieve_top_k_documents(query)
-        response = st.session_state.chatbot.ask_chatbot(query, retrieved_docs)
-        complete_response = f"{response.strip()}\n\n---\n\n{docs_metadata.strip()}"
+    chatbot = st.session_state.chatbot
+    is_rag_chatbot = hasattr(chatbot, "retrieve_top_k_documents")
+    route = None
+
+    if is_rag_chatbot and QUERY_ROUTING:
+        route = route_query(query, previous_documents=chatbot.last_documents)
+
+    if route == ROUTE_AGENT:
+        # the agent-based chatbot of the session is created on its first disruption question
+        if "disruptions_chatbot" not in st.session_state:
+            st.session_state.disruptions_chatbot = create_chatbot("Agent-based chatbot")
+        chatbot = st.session_state.disruptions_chatbot
+        is_rag_chatbot = False
+
+    if is_rag_chatbot:
+        yield from chatbot.answer_stream(query, reuse_documents=route == ROUTE_REUSE)
+
+        # the separator is shown only above an actual list of documents
+        documents_metadata = chatbot.documents_metadata.strip()
+        if len(documents_metadata) != 0:
+            yield f"\n\n---\n\n{documents_metadata}"
     else:
-        response, citations = st.session_state.chatbot.ask_chatbot(query)
+        response_chunks = []
+        for response_chunk in chatbot.ask_chatbot_stream(query):
+            response_chunks.append(response_chunk)
+            yield response_chunk
+
+        # a follow-up of the RAG-based chatbot can then refer to the answer of the agent
+        if route == ROUTE_AGENT:
+            st.session_state.chatbot.add_turn(query, "".join(response_chunks))
 
+        # the citations are known only once the whole answer was received
+        citations = chatbot.citations_text
         if len(citations) != 0:
-            complete_response = f"{response.strip()}\n\n---\n\n{citations.strip()}"
-        else:
-            complete_response = response.strip()
+            yield f"\n\n---\n\n{citations.strip()}"
 
-    return complete_response
+
+def create_chatbot(chatbot_mode):
+    """Creates the chatbot of the given mode, which uses the stubbed Bedrock clients if the
+    `USE_BEDROCK_STUBS` environment variable is set to true, so the UI can be tested offline.
+
+    Parameters
+    ----------
+    chatbot_mode : str
+        The mode of the chatbot, either 'RAG-based chatbot' or 'Agent-based chatbot'.
+
+    Returns
+    -------
+    NSChatbotRAG or NSChatbotAgent
+        The chatbot of the given mode.
+    """
+
+    use_bedrock_stubs = load_env_variables()["use_bedrock_stubs"]
+
+    if chatbot_mode == "RAG-based chatbot":
+        if use_bedrock_stubs:
+            return NSChatbotRAG(
+                runtime_client=StubRuntimeClient(), agent_runtime_client=StubAgentRuntimeClient()
+            )
+
+        return NSChatbotRAG()
+
+    if use_bedrock_stubs:
+        return NSChatbotAgent(agent_runtime_client=StubAgentRuntimeClient())
+
+    return NSChatbotAgent()
 
 
 # define general aspects of the page
@@ -63,18 +192,16 @@ with st.sidebar:
 
     # switch chatbot when mode changes and clear the chat history
     if "current_mode" not in st.session_state or st.session_state.current_mode != chatbot_mode:
-        if chatbot_mode == "RAG-based chatbot":
-            st.session_state.chatbot = NSChatbotRAG()
-        else:
-            st.session_state.chatbot = NSChatbotAgent()
+        st.session_state.chatbot = create_chatbot(chatbot_mode)
 
         st.session_state.messages = []
+        st.session_state.pop("disruptions_chatbot", None)
         st.session_state.current_mode = chatbot_mode
         st.success(f"Switched to {chatbot_mode} and cleared chat history.")
 
 
 if "chatbot" not in st.session_state:
-    st.session_state.chatbot = NSChatbotRAG()
+    st.session_state.chatbot = create_chatbot("RAG-based chatbot")
     st.session_state.current_mode = "RAG-based chatbot"
     st.session_state.messages = []
 
@@ -91,12 +218,11 @@ if prompt := st.chat_input("Please enter your message here..."):
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    # get response from the chatbot
-    chatbot_response = generate_response(prompt)
-
-    # display assistant response in chat message container
+    # display assistant response in chat message container while it is generated
     with st.chat_message("assistant"):
-        st.markdown(chatbot_response)
+        chatbot_response = st.write_stream(generate_response(prompt))
 
     # add assistant response to chat history
     st.session_state.messages.append({"role": "assistant", "content": chatbot_response})
+
+render_tracing_panel()
@@ -0,0 +1,78 @@
+"""
+This module lets the chatbots be used from an asyncio event loop. The boto3 clients are
+blocking, so their calls run in a bounded pool of threads shared by all conversations, while
+the event loop serves any number of conversations without a thread per user. The context
+variables of the caller, such as the current span of the tracing, are seen by the blocking
+calls, which do not leak their own changes to other conversations served by the same thread.
+"""
+
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from config import ASYNC_WORKERS_NO
+
+# the blocking network calls of all conversations share these threads
+_executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS_NO, thread_name_prefix="bedrock_io")
+# marks the end of an iterator, as StopIteration cannot be raised through a future
+_END_OF_ITERATION = object()
+
+
+async def run_blocking(function, *args, **kwargs):
+    """
+    Runs a blocking function in the shared thread pool without blocking the event loop, in a
+    copy of the context of the caller.
+
+    Parameters
+    ----------
+    function : callable
+        The blocking function.
+    *args, **kwargs
+        The arguments of the function.
+
+    Returns
+    -------
+    object
+        The result of the function.
+    """
+
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+
+    return await loop.run_in_executor(
+        _executor, functools.partial(context.run, function, *args, **kwargs)
+    )
+
+
+async def iterate_blocking(iterator):
+    """
+    Iterates over a blocking iterator, such as a stream of Bedrock events, fetching every item
+    in the shared thread pool. All items are fetched in the same copy of the context of the
+    caller, so a span opened by a generator is the parent of the spans of its next items, even
+    though they are fetched by other threads, and is never seen by other conversations.
+
+    Parameters
+    ----------
+    iterator : iterator
+        The blocking iterator.
+
+    Yields
+    ------
+    object
+        The items of the iterator.
+    """
+
+    iterator = iter(iterator)
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+
+    while True:
+        item = await loop.run_in_executor(
+            _executor, context.run, next, iterator, _END_OF_ITERATION
+        )
+
+        if item is _END_OF_ITERATION:
+            return
+
+        yield item
@@ -0,0 +1,114 @@
+"""
+This module keeps a process-wide registry of the AWS clients used by the chatbots. Creating a
+boto3 session and a client is slow and every client has its own connection pool, so a single
+client of every service is shared by all chatbot instances and Streamlit sessions.
+"""
+
+import threading
+
+from boto3.session import Session
+from botocore.config import Config
+
+from config import (
+    CLIENT_MAX_POOL_CONNECTIONS,
+    CLIENT_CONNECT_TIMEOUT,
+    CLIENT_READ_TIMEOUT,
+    CLIENT_TCP_KEEPALIVE,
+    CLIENT_MAX_ATTEMPTS,
+)
+from utils import load_env_variables
+
+# the sessions and clients are created once and reused, which boto3 allows as the clients are
+# thread-safe, while the creation itself is guarded by a lock as the sessions are not
+_lock = threading.Lock()
+_sessions = {}
+_clients = {}
+
+
+def get_client_config():
+    """
+    Builds the configuration of the clients from the connection settings.
+
+    Returns
+    -------
+    botocore.config.Config
+        The configuration with the connection pool size, the keep-alive, the timeouts and the
+        retries of the clients.
+    """
+
+    return Config(
+        max_pool_connections=CLIENT_MAX_POOL_CONNECTIONS,
+        connect_timeout=CLIENT_CONNECT_TIMEOUT,
+        read_timeout=CLIENT_READ_TIMEOUT,
+        tcp_keepalive=CLIENT_TCP_KEEPALIVE,
+        retries={"max_attempts": CLIENT_MAX_ATTEMPTS, "mode": "standard"},
+    )
+
+
+def get_session(profile_name=None, region_name=None):
+    """
+    Returns the shared session of an AWS profile and region.
+
+    Parameters
+    ----------
+    profile_name, region_name : str, optional
+        The AWS profile and region, which default to the ones of the .env file
+        (default is None).
+
+    Returns
+    -------
+    boto3.session.Session
+        The shared session.
+    """
+
+    if profile_name is None and region_name is None:
+        env_variables = load_env_variables()
+        profile_name, region_name = env_variables["profile_name"], env_variables["region_name"]
+
+    with _lock:
+        session = _sessions.get((profile_name, region_name))
+
+        if session is None:
+            session = Session(profile_name=profile_name, region_name=region_name)
+            _sessions[(profile_name, region_name)] = session
+
+    return session
+
+
+def get_client(service_name, profile_name=None, region_name=None):
+    """
+    Returns the shared client of an AWS service, which is created on the first call.
+
+    Parameters
+    ----------
+    service_name : str
+        The name of the service, such as 'bedrock-runtime'.
+    profile_name, region_name : str, optional
+        The AWS profile and region, which default to the ones of the .env file
+        (default is None).
+
+    Returns
+    -------
+    botocore.client.BaseClient
+        The shared client of the service.
+    """
+
+    session = get_session(profile_name, region_name)
+    key = (service_name, session.profile_name, session.region_name)
+
+    with _lock:
+        client = _clients.get(key)
+
+        if client is None:
+            client = session.client(service_name, config=get_client_config())
+            _clients[key] = client
+
+    return client
+
+
+def clear_clients():
+    """Drops the shared sessions and clients, such as after the credentials change."""
+
+    with _lock:
+        _sessions.clear()
+        _clients.clear()
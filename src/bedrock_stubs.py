@@ -0,0 +1,390 @@
+"""
+This module provides stubs of the AWS Bedrock clients which return canned answers with a
+configurable latency, so the chatbots can be tested offline and without costs.
+"""
+
+import io
+import json
+import time
+import random
+
+from botocore.exceptions import ClientError
+
+from utils import estimate_tokens
+
+STUB_RESPONSE_TEXT = (
+    "NS (Nederlandse Spoorwegen) is the main passenger railway operator in the Netherlands. "
+    "You can check your journey and buy tickets in the NS app or at the ticket machines."
+)
+
+
+def split_text(text, words_per_part):
+    """
+    Splits a text into parts with a given number of words, keeping its whitespace.
+
+    Parameters
+    ----------
+    text : str
+        The text to split.
+    words_per_part : int
+        The number of words in each part.
+
+    Returns
+    -------
+    list of str
+        The parts, which are equal to the text when joined.
+    """
+
+    words = text.split(" ")
+
+    return [
+        " ".join(words[index : index + words_per_part])
+        + (" " if index + words_per_part < len(words) else "")
+        for index in range(0, len(words), words_per_part)
+    ]
+
+
+def create_client_error(code, status_code, operation_name):
+    """
+    Creates the error raised by a Bedrock client when the service rejects a request.
+
+    Parameters
+    ----------
+    code : str
+        The error code, such as 'ThrottlingException'.
+    status_code : int
+        The HTTP status code of the response.
+    operation_name : str
+        The name of the API, such as 'Retrieve'.
+
+    Returns
+    -------
+    botocore.exceptions.ClientError
+        The error.
+    """
+
+    return ClientError(
+        {
+            "Error": {"Code": code, "Message": f"The stubbed service raised {code}."},
+            "ResponseMetadata": {"HTTPStatusCode": status_code},
+        },
+        operation_name,
+    )
+
+
+class StubRuntimeClient:
+    """
+    A stub of the Bedrock Runtime client which answers every request with the same text,
+    either at once or as a stream of Anthropic message events.
+    """
+
+    def __init__(
+        self,
+        response_text=STUB_RESPONSE_TEXT,
+        first_token_latency=0.5,
+        token_latency=0.02,
+        words_per_delta=2,
+        fail=False,
+    ):
+        """
+        Initialize the StubRuntimeClient instance.
+
+        Parameters
+        ----------
+        response_text : str, optional
+            The answer of the stubbed LLM (default is `STUB_RESPONSE_TEXT`).
+        first_token_latency : float, optional
+            The seconds waited before the first text delta (default is 0.5).
+        token_latency : float, optional
+            The seconds waited before every following text delta (default is 0.02).
+        words_per_delta : int, optional
+            The number of words in each text delta (default is 2).
+        fail : bool, optional
+            Whether every call raises a service unavailable error, to test the fallback
+            (default is False).
+        """
+
+        self.response_text = response_text
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.words_per_delta = words_per_delta
+        self.fail = fail
+        # the bodies of the received requests, which can be inspected by tests
+        self.requests = []
+
+    def _get_deltas(self):
+        """Splits the answer into text deltas, keeping the whitespace of the answer."""
+
+        return split_text(self.response_text, self.words_per_delta)
+
+    def _receive_request(self, body):
+        """Records a request and raises an exception if the stub is configured to fail."""
+
+        self.requests.append(json.loads(body))
+
+        if self.fail:
+            raise create_client_error("ServiceUnavailableException", 503, "InvokeModel")
+
+    def invoke_model(self, body, modelId, accept, contentType):
+        """
+        Returns the full answer once all tokens would have been generated.
+
+        Parameters
+        ----------
+        body : str
+            The JSON body of the request.
+        modelId, accept, contentType : str
+            The model and content types, ignored by the stub.
+
+        Returns
+        -------
+        dict
+            A response with a readable body, like the one of the Bedrock Runtime client.
+        """
+
+        self._receive_request(body)
+        time.sleep(self.first_token_latency + self.token_latency * (len(self._get_deltas()) - 1))
+
+        response_body = {
+            "type": "message",
+            "role": "assistant",
+            "content": [{"type": "text", "text": self.response_text}],
+            "stop_reason": "end_turn",
+            "usage": {
+                "input_tokens": estimate_tokens(body),
+                "output_tokens": estimate_tokens(self.response_text),
+            },
+        }
+
+        return {"body": io.BytesIO(json.dumps(response_body).encode("utf-8"))}
+
+    def invoke_model_with_response_stream(self, body, modelId, accept, contentType):
+        """
+        Returns the answer as a stream of message events, generated lazily with the latency
+        of every text delta.
+
+        Parameters
+        ----------
+        body : str
+            The JSON body of the request.
+        modelId, accept, contentType : str
+            The model and content types, ignored by the stub.
+
+        Returns
+        -------
+        dict
+            A response whose body is an iterable of events, like the one of the Bedrock Runtime
+            client.
+        """
+
+        self._receive_request(body)
+
+        return {"body": self._generate_events(estimate_tokens(body))}
+
+    def _generate_events(self, input_tokens):
+        """Yields the events of a streamed Anthropic message, with its token usage."""
+
+        def encode_event(message_event):
+            return {"chunk": {"bytes": json.dumps(message_event).encode("utf-8")}}
+
+        yield encode_event(
+            {
+                "type": "message_start",
+                "message": {
+                    "role": "assistant",
+                    "usage": {"input_tokens": input_tokens, "output_tokens": 1},
+                },
+            }
+        )
+        yield encode_event(
+            {"type": "content_block_start", "index": 0, "content_block": {"type": "text"}}
+        )
+
+        for delta_index, delta in enumerate(self._get_deltas()):
+            time.sleep(self.first_token_latency if delta_index == 0 else self.token_latency)
+            yield encode_event(
+                {
+                    "type": "content_block_delta",
+                    "index": 0,
+                    "delta": {"type": "text_delta", "text": delta},
+                }
+            )
+
+        yield encode_event({"type": "content_block_stop", "index": 0})
+        yield encode_event(
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": "end_turn"},
+                "usage": {"output_tokens": estimate_tokens(self.response_text)},
+            }
+        )
+        yield encode_event({"type": "message_stop"})
+
+
+class StubAgentRuntimeClient:
+    """
+    A stub of the Bedrock Agent Runtime client whose knowledge base always retrieves the same
+    documents and whose agent always gives the same answer with citations.
+    """
+
+    def __init__(
+        self,
+        retrieval_latency=0.2,
+        documents_no=5,
+        response_text=STUB_RESPONSE_TEXT,
+        first_chunk_latency=2.0,
+        chunk_latency=0.05,
+        words_per_chunk=5,
+        slow_retrieval_rate=0.0,
+        slow_retrieval_latency=2.0,
+        throttling_rate=0.0,
+    ):
+        """
+        Initialize the StubAgentRuntimeClient instance.
+
+        Parameters
+        ----------
+        retrieval_latency : float, optional
+            The seconds waited before the documents are returned (default is 0.2).
+        documents_no : int, optional
+            The number of retrieved documents (default is 5).
+        response_text : str, optional
+            The answer of the stubbed agent (default is `STUB_RESPONSE_TEXT`).
+        first_chunk_latency : float, optional
+            The seconds waited before the first chunk, spent by the agent on its tools
+            (default is 2.0).
+        chunk_latency : float, optional
+            The seconds waited before every following chunk (default is 0.05).
+        words_per_chunk : int, optional
+            The number of words in each chunk (default is 5).
+        slow_retrieval_rate : float, optional
+            The share of the retrievals which take `slow_retrieval_latency` seconds, to test
+            the tail latency (default is 0.0).
+        slow_retrieval_latency : float, optional
+            The seconds waited by the slow retrievals (default is 2.0).
+        throttling_rate : float, optional
+            The share of the retrievals which are throttled (default is 0.0).
+        """
+
+        self.retrieval_latency = retrieval_latency
+        self.documents_no = documents_no
+        self.response_text = response_text
+        self.first_chunk_latency = first_chunk_latency
+        self.chunk_latency = chunk_latency
+        self.words_per_chunk = words_per_chunk
+        self.slow_retrieval_rate = slow_retrieval_rate
+        self.slow_retrieval_latency = slow_retrieval_latency
+        self.throttling_rate = throttling_rate
+
+    def retrieve(self, knowledgeBaseId, retrievalQuery, retrievalConfiguration):
+        """
+        Returns the stubbed documents, like the retrieve API of the knowledge base.
+
+        Parameters
+        ----------
+        knowledgeBaseId : str
+            The identifier of the knowledge base, ignored by the stub.
+        retrievalQuery : dict
+            The query, with its text keyed by 'text'.
+        retrievalConfiguration : dict
+            The retrieval configuration, ignored by the stub.
+
+        Returns
+        -------
+        dict
+            The retrieval results, like the ones of the Bedrock Agent Runtime client.
+        """
+
+        if random.random() < self.throttling_rate:
+            raise create_client_error("ThrottlingException", 429, "Retrieve")
+
+        if random.random() < self.slow_retrieval_rate:
+            time.sleep(self.slow_retrieval_latency)
+        else:
+            time.sleep(self.retrieval_latency)
+
+        return {
+            "retrievalResults": [
+                {
+                    "content": {"text": f"Stubbed passage {index + 1} about NS."},
+                    "metadata": {
+                        "x-amz-bedrock-kb-source-uri": "s3://ns-documents/stubbed_document.pdf",
+                        "x-amz-bedrock-kb-document-page-number": float(index + 1),
+                    },
+                }
+                for index in range(self.documents_no)
+            ]
+        }
+
+    def invoke_agent(self, agentId, agentAliasId, sessionId, inputText, **kwargs):
+        """
+        Returns the answer of the agent as a stream of chunks, the last of which has the
+        citations of the knowledge base.
+
+        Parameters
+        ----------
+        agentId, agentAliasId, sessionId : str
+            The identifiers of the agent and of the session, ignored by the stub.
+        inputText : str
+            The query sent to the agent.
+        **kwargs
+            The other arguments of the API, ignored by the stub.
+
+        Returns
+        -------
+        dict
+            A response whose completion is an iterable of events, like the one of the Bedrock
+            Agent Runtime client.
+        """
+
+        return {"completion": self._generate_events()}
+
+    def _generate_events(self):
+        """Yields the chunks of the answer of the agent."""
+
+        chunks = split_text(self.response_text, self.words_per_chunk)
+        citations = [
+            {
+                "retrievedReferences": [
+                    {
+                        "metadata": {
+                            "x-amz-bedrock-kb-source-uri": "s3://ns-documents/stubbed_document.pdf",
+                            "x-amz-bedrock-kb-document-page-number": 1.0,
+                        }
+                    }
+                ]
+            }
+        ]
+
+        for chunk_index, chunk in enumerate(chunks):
+            time.sleep(self.first_chunk_latency if chunk_index == 0 else self.chunk_latency)
+            event = {"chunk": {"bytes": chunk.encode("utf-8")}}
+
+            if chunk_index == len(chunks) - 1:
+                event["chunk"]["attribution"] = {"citations": citations}
+
+            yield event
+
+
+if __name__ == "__main__":
+    from ns_chatbot_rag import NSChatbotRAG
+
+    ns_chatbot_rag = NSChatbotRAG(
+        runtime_client=StubRuntimeClient(), agent_runtime_client=StubAgentRuntimeClient()
+    )
+
+    QUERY = "What is NS?"
+    retrieved_docs, _ = ns_chatbot_rag.retrieve_top_k_documents(QUERY)
+
+    # compare the time to the first token with the time to the full answer
+    start_time = time.perf_counter()
+    for delta_index, response_delta in enumerate(
+        ns_chatbot_rag.ask_chatbot_stream(QUERY, retrieved_docs)
+    ):
+        if delta_index == 0:
+            first_token_time = time.perf_counter() - start_time
+        print(response_delta, end="", flush=True)
+
+    print(f"\n\nFirst token after {first_token_time:.2f} s.")
+    print(f"Full answer after {time.perf_counter() - start_time:.2f} s.")
+    print(f"Messages in the conversation history: {len(ns_chatbot_rag.conversation_history)}")
@@ -0,0 +1,693 @@
+"""
+This module implements the caches of the chatbot, which are shared by all sessions of the
+Streamlit app. The answers of first-turn queries are cached by their normalized text, and
+optionally by their similarity to previous queries, so repeated questions do not pay for a
+retrieval and an LLM generation. The retrieved documents are cached on every turn, as they do
+not depend on the conversation.
+"""
+
+import os
+import re
+import math
+import time
+import hashlib
+import threading
+import weakref
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict, defaultdict
+
+NON_ALPHANUMERIC = re.compile(r"[^0-9a-z]+")
+# the words which change the meaning of otherwise similar queries, such as 'with' and 'without'
+KEY_WORDS = frozenset(
+    "after before during first from inside into no none not outside second to with without".split()
+)
+NUMBER_PATTERN = re.compile(r"\d+")
+# the capitalized words after the first one of the query, such as the names of the stations
+PROPER_NOUN_PATTERN = re.compile(r"(?<=\s)[^\W\d_][^\W_]+")
+
+# the caches whose entries depend on the documents, which `invalidate_caches` clears
+_documents_caches = weakref.WeakSet()
+_documents_caches_lock = threading.Lock()
+
+
+def normalize_query(query):
+    """
+    Normalizes a query by removing accents, case, punctuation and repeated whitespace.
+
+    Parameters
+    ----------
+    query : str
+        The query to normalize.
+
+    Returns
+    -------
+    str
+        The normalized query, such as 'can i take my bike' for 'Can I take my bike?'.
+    """
+
+    decomposed_query = unicodedata.normalize("NFKD", query)
+    ascii_query = "".join(
+        character for character in decomposed_query if not unicodedata.combining(character)
+    )
+
+    return " ".join(NON_ALPHANUMERIC.sub(" ", ascii_query.casefold()).split())
+
+
+def get_query_features(normalized_query):
+    """
+    Computes the unit-length sparse vector of a normalized query, made of its words and of its
+    character trigrams, which is used to find similar queries.
+
+    Parameters
+    ----------
+    normalized_query : str
+        The normalized query.
+
+    Returns
+    -------
+    dict of float
+        The weight of every word and trigram of the query.
+    """
+
+    padded_query = f" {normalized_query} "
+    feature_counts = Counter(f"w:{word}" for word in normalized_query.split())
+    feature_counts.update(padded_query[index : index + 3] for index in range(len(padded_query) - 2))
+
+    norm = math.sqrt(sum(count * count for count in feature_counts.values()))
+
+    return {feature: count / norm for feature, count in feature_counts.items()}
+
+
+def get_key_terms(query):
+    """
+    Extracts the terms of a query which have to be equal for the answer of a similar query to
+    be reused: its numbers, its proper nouns and the words which change its meaning, in order.
+
+    Parameters
+    ----------
+    query : str
+        The query.
+
+    Returns
+    -------
+    tuple of str
+        The key terms, such as ('without',) for 'Can I travel without a ticket?' and
+        ('from', 'utrecht', 'to', 'amsterdam') for 'How long is the trip from Utrecht to
+        Amsterdam?'.
+    """
+
+    proper_nouns = {
+        normalize_query(word) for word in PROPER_NOUN_PATTERN.findall(query) if word[0].isupper()
+    }
+
+    return tuple(
+        word
+        for word in normalize_query(query).split()
+        if word in KEY_WORDS or word in proper_nouns or NUMBER_PATTERN.fullmatch(word)
+    )
+
+
+def compute_directory_fingerprint(directory_path, excluded_names=()):
+    """
+    Computes a fingerprint of the files of a directory from their names, sizes and
+    modification times, which changes whenever a file is added, removed or modified.
+
+    Parameters
+    ----------
+    directory_path : str
+        The path of the directory.
+    excluded_names : iterable of str, optional
+        The names of the files which are not part of the fingerprint, such as the metadata
+        file of an index which stores it (default is ()).
+
+    Returns
+    -------
+    str
+        The hexadecimal fingerprint, which is empty if the directory does not exist.
+    """
+
+    if not os.path.isdir(directory_path):
+        return ""
+
+    fingerprint = hashlib.sha256()
+    excluded_names = set(excluded_names)
+
+    for entry in sorted(os.scandir(directory_path), key=lambda entry: entry.name):
+        if entry.is_file() and entry.name not in excluded_names:
+            file_stat = entry.stat()
+            fingerprint.update(
+                f"{entry.name}:{file_stat.st_size}:{file_stat.st_mtime_ns}\n".encode("utf-8")
+            )
+
+    return fingerprint.hexdigest()
+
+
+class LRUCache:
+    """
+    A thread-safe cache which evicts the least recently used entries once it holds too many
+    entries or once their total cost is too large, and which expires entries after a TTL.
+    """
+
+    def __init__(self, max_entries, max_cost=None, ttl=None, on_remove=None):
+        """
+        Initialize the LRUCache instance.
+
+        Parameters
+        ----------
+        max_entries : int
+            The maximum number of entries.
+        max_cost : int, optional
+            The maximum total cost of the entries, such as their size in bytes. If None, the
+            cost is not bounded (default is None).
+        ttl : float, optional
+            The number of seconds after which an entry expires. If None, the entries do not
+            expire (default is None).
+        on_remove : callable, optional
+            A function called with the key of every evicted, expired or removed entry, while
+            the lock of the cache is held (default is None).
+        """
+
+        self.max_entries = max_entries
+        self.max_cost = max_cost
+        self.ttl = ttl
+        self.on_remove = on_remove
+
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.total_cost = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        """Removes an entry, which has to exist, while the lock is held."""
+
+        _, cost, _ = self._entries.pop(key)
+        self.total_cost -= cost
+
+        if self.on_remove is not None:
+            self.on_remove(key)
+
+    def _is_expired(self, expiration_time):
+        """Checks whether an entry with a given expiration time is expired."""
+
+        return expiration_time is not None and time.monotonic() >= expiration_time
+
+    def get(self, key, default=None):
+        """
+        Returns the value of an entry and marks it as the most recently used.
+
+        Parameters
+        ----------
+        key : hashable
+            The key of the entry.
+        default : object, optional
+            The value returned if there is no such entry or if it is expired
+            (default is None).
+
+        Returns
+        -------
+        object
+            The value of the entry or the default value.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and self._is_expired(entry[2]):
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[0]
+
+    def put(self, key, value, cost=1):
+        """
+        Adds or replaces an entry and evicts the least recently used entries if the cache
+        becomes too large.
+
+        Parameters
+        ----------
+        key : hashable
+            The key of the entry.
+        value : object
+            The value of the entry.
+        cost : int, optional
+            The cost of the entry, such as its size in bytes (default is 1).
+
+        Returns
+        -------
+        bool
+            True if the entry was added, False if its cost alone exceeds the maximum cost.
+        """
+
+        if self.max_cost is not None and cost > self.max_cost:
+            return False
+
+        expiration_time = None if self.ttl is None else time.monotonic() + self.ttl
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, cost, expiration_time)
+            self.total_cost += cost
+
+            while len(self._entries) > self.max_entries or (
+                self.max_cost is not None and self.total_cost > self.max_cost
+            ):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+        return True
+
+    def pop(self, key):
+        """
+        Removes an entry if it exists.
+
+        Parameters
+        ----------
+        key : hashable
+            The key of the entry.
+        """
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def invalidate(self):
+        """Removes all entries, keeping the counters."""
+
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def get_stats(self):
+        """
+        Returns the counters of the cache.
+
+        Returns
+        -------
+        dict
+            The number of entries, their total cost, the hits, misses, evictions, expirations
+            and the hit rate.
+        """
+
+        with self._lock:
+            lookups_no = self.hits + self.misses
+
+            return {
+                "entries": len(self._entries),
+                "total_cost": self.total_cost,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups_no if lookups_no != 0 else 0.0,
+            }
+
+
+def invalidate_caches():
+    """
+    Drops all entries of the caches which depend on the documents of the knowledge base, such
+    as the answers and retrievals shared by all sessions, after the knowledge base is
+    synchronized or its index is rebuilt.
+    """
+
+    with _documents_caches_lock:
+        documents_caches = list(_documents_caches)
+
+    for documents_cache in documents_caches:
+        documents_cache.invalidate()
+
+
+class DocumentsCache(ABC):
+    """
+    The base class of the caches whose entries depend on the documents of the knowledge base,
+    which drops all entries when the document set changes. Every instance is registered, so
+    `invalidate_caches` clears them all.
+    """
+
+    def __init__(self, documents_path=None):
+        """
+        Initialize the DocumentsCache instance.
+
+        Parameters
+        ----------
+        documents_path : str, optional
+            The directory of the documents of the knowledge base, whose changes invalidate the
+            cache (default is None).
+        """
+
+        self.documents_path = documents_path
+        self._documents_fingerprint = self._get_documents_fingerprint()
+
+        with _documents_caches_lock:
+            _documents_caches.add(self)
+
+    def _get_documents_fingerprint(self):
+        """Returns the fingerprint of the documents, or None if they are not tracked."""
+
+        if self.documents_path is None:
+            return None
+
+        return compute_directory_fingerprint(self.documents_path)
+
+    def _check_documents(self):
+        """Drops all entries if the documents changed since they were cached."""
+
+        documents_fingerprint = self._get_documents_fingerprint()
+
+        if documents_fingerprint != self._documents_fingerprint:
+            self.invalidate()
+            self._documents_fingerprint = documents_fingerprint
+
+    @abstractmethod
+    def invalidate(self):
+        """Drops all entries."""
+
+
+class ResponseCache(DocumentsCache):
+    """
+    A cache of the answers given to first-turn queries, with an exact tier keyed by the
+    normalized query and an optional similarity tier which reuses the answer of the most similar
+    cached query above a threshold. The similarity of the words and trigrams cannot tell
+    'with a ticket' from 'without a ticket', so a similar query is only reused if their key
+    terms are equal, and the tier is disabled by default. All entries are dropped when the
+    document set changes.
+    """
+
+    def __init__(
+        self, max_entries, max_bytes, ttl, similarity_threshold, documents_path=None
+    ):
+        """
+        Initialize the ResponseCache instance.
+
+        Parameters
+        ----------
+        max_entries : int
+            The maximum number of cached answers.
+        max_bytes : int
+            The maximum approximate size of the cached answers and documents, in bytes.
+        ttl : float
+            The number of seconds after which an answer expires.
+        similarity_threshold : float
+            The minimum cosine similarity between a query and a cached query whose answer is
+            reused, where 1 disables the similarity tier.
+        documents_path : str, optional
+            The directory of the documents of the knowledge base, whose changes invalidate the
+            cache (default is None).
+        """
+
+        self.similarity_threshold = similarity_threshold
+        self.entries = LRUCache(max_entries, max_bytes, ttl, on_remove=self._unindex)
+        self._lock = threading.RLock()
+
+        # the cached queries which contain every feature, used to find similar queries
+        self._query_features = {}
+        self._feature_index = defaultdict(set)
+        # the key terms of every cached query, which a similar query has to share
+        self._key_terms = {}
+        super().__init__(documents_path)
+
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def _unindex(self, normalized_query):
+        """Removes a cached query from the feature index."""
+
+        self._key_terms.pop(normalized_query, None)
+
+        for feature in self._query_features.pop(normalized_query, ()):
+            feature_queries = self._feature_index[feature]
+            feature_queries.discard(normalized_query)
+
+            if len(feature_queries) == 0:
+                del self._feature_index[feature]
+
+    def _find_similar_query(self, normalized_query, key_terms):
+        """Returns the most similar cached query with the same key terms above the threshold."""
+
+        query_features = get_query_features(normalized_query)
+        similarities = defaultdict(float)
+
+        # only the cached queries which share a feature can have a positive similarity
+        for feature, weight in query_features.items():
+            for cached_query in self._feature_index.get(feature, ()):
+                if self._key_terms[cached_query] == key_terms:
+                    similarities[cached_query] += (
+                        weight * self._query_features[cached_query][feature]
+                    )
+
+        if len(similarities) == 0:
+            return None
+
+        best_query = max(similarities, key=similarities.get)
+
+        return best_query if similarities[best_query] >= self.similarity_threshold else None
+
+    def get(self, query):
+        """
+        Returns the cached answer of a query or, if the similarity tier is enabled, of the most
+        similar cached query with the same key terms.
+
+        Parameters
+        ----------
+        query : str
+            The first-turn query of the user.
+
+        Returns
+        -------
+        dict or None
+            The cached 'response_text', 'retrieved_documents' and 'documents_metadata', or
+            None if no cached query is close enough.
+        """
+
+        normalized_query = normalize_query(query)
+
+        with self._lock:
+            self._check_documents()
+
+            cached_response = self.entries.get(normalized_query)
+            if cached_response is not None:
+                self.exact_hits += 1
+                return cached_response
+
+            if self.similarity_threshold < 1:
+                similar_query = self._find_similar_query(normalized_query, get_key_terms(query))
+
+                if similar_query is not None:
+                    cached_response = self.entries.get(similar_query)
+
+                    if cached_response is not None:
+                        self.similar_hits += 1
+                        return cached_response
+
+            self.misses += 1
+
+        return None
+
+    def put(self, query, response_text, retrieved_documents, documents_metadata):
+        """
+        Caches the answer of a first-turn query.
+
+        Parameters
+        ----------
+        query : str
+            The first-turn query of the user.
+        response_text : str
+            The answer of the LLM.
+        retrieved_documents : list of dict
+            The documents retrieved for the query.
+        documents_metadata : str
+            The names and pages of the retrieved documents, displayed to the user.
+        """
+
+        normalized_query = normalize_query(query)
+        if len(normalized_query) == 0:
+            return
+
+        cached_response = {
+            "response_text": response_text,
+            "retrieved_documents": retrieved_documents,
+            "documents_metadata": documents_metadata,
+        }
+        # the size of the strings is a good approximation of the size of the entry
+        size = (
+            len(normalized_query)
+            + len(response_text)
+            + len(documents_metadata)
+            + sum(len(document["content"]) for document in retrieved_documents)
+        )
+
+        with self._lock:
+            if not self.entries.put(normalized_query, cached_response, size):
+                return
+
+            query_features = get_query_features(normalized_query)
+            self._query_features[normalized_query] = query_features
+            self._key_terms[normalized_query] = get_key_terms(query)
+            for feature in query_features:
+                self._feature_index[feature].add(normalized_query)
+
+    def invalidate(self):
+        """Drops all cached answers, such as after the knowledge base is synchronized."""
+
+        with self._lock:
+            self.entries.invalidate()
+
+    def get_stats(self):
+        """
+        Returns the counters of the cache.
+
+        Returns
+        -------
+        dict
+            The counters of the underlying LRU cache, the exact and similar hits and the
+            misses of the queries.
+        """
+
+        with self._lock:
+            lookups_no = self.exact_hits + self.similar_hits + self.misses
+
+            return {
+                **self.entries.get_stats(),
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "query_misses": self.misses,
+                "query_hit_rate": (
+                    (self.exact_hits + self.similar_hits) / lookups_no if lookups_no != 0 else 0.0
+                ),
+            }
+
+
+class RetrievalCache(DocumentsCache):
+    """
+    A cache of the documents retrieved from the knowledge base, keyed by the normalized query
+    and the retrieval parameters. Unlike the answers, the retrieved documents do not depend on
+    the conversation, so they are reused on every turn until the document set changes.
+    """
+
+    def __init__(self, max_entries, max_bytes, ttl, documents_path=None):
+        """
+        Initialize the RetrievalCache instance.
+
+        Parameters
+        ----------
+        max_entries : int
+            The maximum number of cached retrievals.
+        max_bytes : int
+            The maximum approximate size of the cached documents, in bytes.
+        ttl : float
+            The number of seconds after which a retrieval expires.
+        documents_path : str, optional
+            The directory of the documents of the knowledge base, whose changes invalidate the
+            cache (default is None).
+        """
+
+        self.entries = LRUCache(max_entries, max_bytes, ttl)
+        self._lock = threading.RLock()
+        # the retrieval time of every hit entry, which was saved by the cache
+        self.saved_seconds = 0.0
+        super().__init__(documents_path)
+
+    def get(self, query, parameters=()):
+        """
+        Returns the cached retrieval of a query.
+
+        Parameters
+        ----------
+        query : str
+            The query used to search the knowledge base.
+        parameters : tuple, optional
+            The other parameters of the retrieval, such as the number of documents
+            (default is ()).
+
+        Returns
+        -------
+        tuple or None
+            The retrieved documents and their metadata string, or None if the query is not
+            cached.
+        """
+
+        key = (normalize_query(query), *parameters)
+
+        with self._lock:
+            self._check_documents()
+            cached_retrieval = self.entries.get(key)
+
+            if cached_retrieval is None:
+                return None
+
+            self.saved_seconds += cached_retrieval[2]
+
+        # the list is copied, so the callers cannot change the cached entry
+        return list(cached_retrieval[0]), cached_retrieval[1]
+
+    def put(self, query, retrieved_documents, documents_metadata, retrieval_seconds, parameters=()):
+        """
+        Caches the retrieval of a query.
+
+        Parameters
+        ----------
+        query : str
+            The query used to search the knowledge base.
+        retrieved_documents : list of dict
+            The retrieved documents.
+        documents_metadata : str
+            The names and pages of the retrieved documents, displayed to the user.
+        retrieval_seconds : float
+            The duration of the retrieval, saved by every hit of the entry.
+        parameters : tuple, optional
+            The other parameters of the retrieval, such as the number of documents
+            (default is ()).
+        """
+
+        key = (normalize_query(query), *parameters)
+        # the cost of an entry is the approximate size of its strings
+        size = (
+            len(key[0])
+            + len(documents_metadata)
+            + sum(
+                len(document["content"]) + len(document["document_name"])
+                for document in retrieved_documents
+            )
+        )
+
+        with self._lock:
+            self.entries.put(
+                key, (list(retrieved_documents), documents_metadata, retrieval_seconds), size
+            )
+
+    def invalidate(self):
+        """Drops all cached retrievals, such as after the knowledge base is synchronized."""
+
+        with self._lock:
+            self.entries.invalidate()
+
+    def get_stats(self):
+        """
+        Returns the counters of the cache.
+
+        Returns
+        -------
+        dict
+            The counters of the underlying LRU cache and the retrieval seconds saved by the
+            hits.
+        """
+
+        with self._lock:
+            return {**self.entries.get_stats(), "saved_seconds": self.saved_seconds}
@@ -2,12 +2,45 @@
 This module stores the configuration parameters for the NS chatbot.
 """
 
+import os
+
+# configuration for the AWS clients shared by all sessions
+CLIENT_MAX_POOL_CONNECTIONS = 50
+CLIENT_CONNECT_TIMEOUT = 5
+CLIENT_READ_TIMEOUT = 60
+CLIENT_TCP_KEEPALIVE = True
+# the clients do not retry by themselves, as the calls are retried within their deadlines
+CLIENT_MAX_ATTEMPTS = 0
+# the threads which run the blocking client calls of the asynchronous API, shared by all sessions
+ASYNC_WORKERS_NO = 50
+
+# configuration for the resilience of the Bedrock calls, whose deadlines include the retries
+RETRIEVE_DEADLINE = 5
+# the deadlines of the streamed answers cover the time to their first event
+INVOKE_MODEL_DEADLINE = 30
+INVOKE_AGENT_DEADLINE = 60
+RETRY_MAX_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.2
+RETRY_MAX_DELAY = 4
+# a duplicate retrieval is sent once a retrieval is slower than this percentile of recent ones
+HEDGED_RETRIEVAL = True
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DEFAULT_DELAY = 1.0
+LATENCY_WINDOW_SIZE = 1000
+# the number of consecutive failures which open a circuit and the seconds it stays open
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30
+RESILIENCE_WORKERS_NO = 50
+
 # configuration for the retrieval-augmented generation
 LLM_ID = "us.anthropic.claude-3-5-haiku-20241022-v1:0"
 MAX_OUTPUT_TOKENS = 1024
 LLM_TEMPERATURE = 0.7
 RETRIEVED_DOCUMENTS_NO = 5
-CONVERSATION_HISTORY_LENGTH = 100
+# the maximum estimated number of input tokens, including the conversation history and documents
+MAX_INPUT_TOKENS = 16000
+CHARACTERS_PER_TOKEN = 4
 SYSTEM_PROMPT = """You are a specialized AI assistant for NS (Dutch Railways) passengers. Your primary goal is to provide accurate, up-to-date information regarding train travel in the Netherlands.
 
 **Instructions:**
@@ -21,8 +54,91 @@ SYSTEM_PROMPT = """You are a specialized AI assistant for NS (Dutch Railways) pa
 * "What is the refund policy for SNCF" -> **ACTION:** Politely refuse to answer to this question, as it is not related to NS.
 """
 
+# configuration for the retrieval of compound queries, split into sub-queries
+MULTI_QUERY_RETRIEVAL = True
+MAX_SUB_QUERIES = 4
+RETRIEVAL_WORKERS_NO = 16
+# the constant of the reciprocal rank fusion which merges the retrieved documents
+RRF_K = 60
+
+# configuration for the packing of the retrieved documents into the context of the prompt
+CONTEXT_PACKING = True
+# the estimated tokens of a chunk of 500 words of the knowledge base, with its source
+CONTEXT_CHUNK_TOKENS = 800
+# the budget fits all retrieved chunks, so only the duplicates and the oversized ones are dropped
+CONTEXT_TOKENS_BUDGET = RETRIEVED_DOCUMENTS_NO * CONTEXT_CHUNK_TOKENS
+# the number of consecutive words of the shingles compared to find near-duplicate documents
+CONTEXT_SHINGLE_WORDS = 5
+CONTEXT_MINHASH_PERMUTATIONS = 64
+# the estimated Jaccard similarity of the shingles above which a document is a near duplicate
+CONTEXT_DUPLICATE_THRESHOLD = 0.7
+# the weight of the relevance against the novelty in maximal marginal relevance
+CONTEXT_MMR_LAMBDA = 0.7
+
+# configuration for the routing of the turns of the RAG chatbot in the UI
+QUERY_ROUTING = True
+# the maximum number of words of a follow-up query answered with the previous documents
+ROUTER_FOLLOW_UP_MAX_WORDS = 8
+# the minimum margin of the classifier between its two best routes, below which it retrieves,
+# which is well above the margins of the ambiguous queries such as 'What is NS?' (about 0.04)
+ROUTER_MIN_MARGIN = 0.1
+
+# configuration for the running summary of long conversations, computed in the background
+SUMMARY_TRIGGER_TOKENS = 4000
+# the number of most recent turns which are always sent verbatim
+RECENT_TURNS_NO = 3
+SUMMARY_MAX_OUTPUT_TOKENS = 400
+SUMMARY_WORKERS_NO = 2
+SUMMARY_PROMPT = """You summarize conversations between an NS (Dutch Railways) passenger and an AI assistant.
+
+Write a concise summary of the conversation below in at most 200 words, which extends the previous summary if it is given. Keep the facts that may be needed to answer follow-up questions, such as the stations, tickets, dates, and the answers given by the assistant. Answer only with the summary.
+"""
+
 # configuration for the knowledge base
 KNOWLEDGE_BASE_ID = "TZNEERBITU"
+# the retriever of the RAG chatbot, either the knowledge base or the local vector index
+RETRIEVER_BACKEND = "knowledge_base"
+LOCAL_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "index")
+# the embedder of the local index, either 'bedrock' (like the knowledge base) or 'hashing'
+LOCAL_INDEX_EMBEDDER = "bedrock"
+# whether the embeddings of the local index are stored as int8 instead of float32
+LOCAL_INDEX_QUANTIZE = False
+EMBEDDING_MODEL_ID = "cohere.embed-english-v3"
+EMBEDDING_DEADLINE = 10
+HASHING_EMBEDDING_DIMENSIONS = 384
+# whether the results of the retriever are fused with those of the BM25 index, once it is built
+HYBRID_RETRIEVAL = True
+LEXICAL_INDEX_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "data", "index", "lexical"
+)
+BM25_K1 = 1.2
+BM25_B = 0.75
+# the number of chunks retrieved by each of the retriever and the BM25 index before the fusion
+HYBRID_CANDIDATES_NO = 10
+# the local copy of the documents of the knowledge base, whose changes invalidate the caches
+DOCUMENTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "documents")
+
+# configuration for the ingestion of the documents into chunks, which are indexed locally
+CHUNKS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "chunks")
+CHUNK_WORDS = 300
+CHUNK_OVERLAP_WORDS = 60
+# the number of pages extracted by a task of a worker process
+INGESTION_PAGES_PER_TASK = 8
+INGESTION_WORKERS_NO = os.cpu_count() or 1
+
+# configuration for the cache of the answers to first-turn queries, shared by all sessions
+RESPONSE_CACHE_MAX_ENTRIES = 1000
+RESPONSE_CACHE_MAX_BYTES = 50 * 1024 * 1024
+RESPONSE_CACHE_TTL = 24 * 60 * 60
+# the minimum cosine similarity of a query with a cached query with the same key terms whose
+# answer is reused, where 1 keeps the exact hits only: the words and trigrams of a query do not
+# capture its meaning, so the similar queries with different answers are not safely told apart
+RESPONSE_CACHE_SIMILARITY_THRESHOLD = 1
+
+# configuration for the cache of the retrieved documents, shared by all sessions
+RETRIEVAL_CACHE_MAX_ENTRIES = 5000
+RETRIEVAL_CACHE_MAX_BYTES = 100 * 1024 * 1024
+RETRIEVAL_CACHE_TTL = 24 * 60 * 60
 
 # configuration for uploading the zip file of the Lambda function
 BUCKET_NAME = "ns-trains-disruptions"
@@ -32,6 +148,8 @@ ZIP_PATH = "disruptions_lambda/disruptions_lambda.zip"
 # configuration for the agent (the prompt below is used to configure the agent in AWS Bedrock)
 AGENT_ID = "DIJ48CDXDP"
 AGENT_ALIAS_ID = "EVYEURSTQ0"
+# whether the final response of the agent is streamed in chunks instead of sent at once
+AGENT_STREAM_FINAL_RESPONSE = True
 SYSTEM_PROMPT_AGENT = """
 You are a specialized AI assistant for NS (Dutch Railways) passengers. Your primary goal is to provide accurate, up-to-date information regarding train travel in the Netherlands.
 
@@ -46,9 +164,14 @@ To achieve this, you have two main capabilities:
 * If you cannot find the answer to a question or if the information is unclear, politely state that you cannot provide the answer and suggest the user consult official NS channels (e.g., the NS website or app).
 * Politely refuse to answer questions that are not related to train disruptions in the Netherlands or related to travelling with NS trains.
 * When reporting disruptions, include details such as the duration and cause.
+* When the user asks about disruptions at a specific date, time or period, use the disruption tool with that time window.
+* When the user asks about disruptions between two stations, use the disruption tool for the route.
+* When the user asks about disruptions at several stations, check all of them with a single call of the disruption tool for multiple stations.
+* When the user asks how reliable a station, line or route is, use the disruption statistics tool.
 
 **Example User Queries and Expected Agent Behavior:**
 * "Are there any train disruptions in Utrecht?" -> **ACTION:** Use disruption tool.
+* "Was there a disruption at Utrecht at 08:15 yesterday?" -> **ACTION:** Use the disruption tool with the time window.
 * "How do I buy a ticket for NS?" -> **ACTION:** Use the knowledge base.
 * "Are there any train disruptions in Utrecht? If so, how can I refund my money?" -> **ACTION:** Use the disruption tool first, then the knowledge base.
 """
@@ -0,0 +1,237 @@
+"""
+This module packs the retrieved documents into the context of the prompt. Chunks which overlap
+heavily, such as the chunks of the same page retrieved by several sub-queries or the
+overlapping chunks of a page, are detected with MinHash signatures of their word shingles and
+only the best ranked one is kept. The remaining chunks are reordered with maximal marginal
+relevance, whose redundancy is the cosine similarity of their term vectors, so every chunk adds
+new information, and are added until the token budget of the context is filled, which removes
+the redundant input tokens of every turn.
+"""
+
+import zlib
+import math
+from collections import Counter
+
+import numpy as np
+
+from utils import estimate_tokens
+from caching import normalize_query
+from lexical_index import tokenize
+from config import (
+    CONTEXT_TOKENS_BUDGET,
+    CONTEXT_SHINGLE_WORDS,
+    CONTEXT_MINHASH_PERMUTATIONS,
+    CONTEXT_DUPLICATE_THRESHOLD,
+    CONTEXT_MMR_LAMBDA,
+)
+
+# the Mersenne prime modulo of the hash permutations, larger than the 32-bit shingle hashes
+MINHASH_PRIME = (1 << 61) - 1
+
+# the coefficients of the permutations are fixed, so the signatures are deterministic, and
+# small enough for their products with the 32-bit hashes to fit in 64 bits
+_permutations_generator = np.random.default_rng(0)
+_PERMUTATION_MULTIPLIERS = _permutations_generator.integers(
+    1, 1 << 31, CONTEXT_MINHASH_PERMUTATIONS, dtype=np.uint64
+)
+_PERMUTATION_INCREMENTS = _permutations_generator.integers(
+    0, 1 << 31, CONTEXT_MINHASH_PERMUTATIONS, dtype=np.uint64
+)
+
+
+def get_shingle_hashes(text, shingle_words=CONTEXT_SHINGLE_WORDS):
+    """
+    Hashes the shingles of a text, which are its sequences of consecutive normalized words.
+
+    Parameters
+    ----------
+    text : str
+        The text.
+    shingle_words : int, optional
+        The number of words of a shingle (default is `CONTEXT_SHINGLE_WORDS`).
+
+    Returns
+    -------
+    numpy.ndarray
+        The uint64 hashes of the unique shingles, with a single shingle for shorter texts.
+    """
+
+    words = normalize_query(text).split()
+    shingles = {
+        " ".join(words[index : index + shingle_words])
+        for index in range(max(len(words) - shingle_words + 1, 1))
+    }
+
+    return np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+
+
+def compute_minhash_signature(shingle_hashes):
+    """
+    Computes the MinHash signature of a set of shingles, whose fraction of equal values with
+    another signature estimates the Jaccard similarity of their sets.
+
+    Parameters
+    ----------
+    shingle_hashes : numpy.ndarray
+        The uint64 hashes of the shingles.
+
+    Returns
+    -------
+    numpy.ndarray
+        The minimum of every permutation of the hashes.
+    """
+
+    permuted_hashes = (
+        shingle_hashes[:, np.newaxis] * _PERMUTATION_MULTIPLIERS + _PERMUTATION_INCREMENTS
+    ) % MINHASH_PRIME
+
+    return permuted_hashes.min(axis=0)
+
+
+def get_term_vector(text):
+    """
+    Computes the unit-length vector of the term frequencies of a text, without its stop words.
+
+    Parameters
+    ----------
+    text : str
+        The text.
+
+    Returns
+    -------
+    dict of float
+        The weight of every term of the text.
+    """
+
+    term_counts = Counter(tokenize(text))
+    norm = math.sqrt(sum(count * count for count in term_counts.values()))
+
+    return {term: count / norm for term, count in term_counts.items()}
+
+
+def compute_cosine_similarity(term_vector, other_term_vector):
+    """Computes the cosine similarity of two unit-length term vectors."""
+
+    if len(term_vector) > len(other_term_vector):
+        term_vector, other_term_vector = other_term_vector, term_vector
+
+    return sum(
+        weight * other_term_vector.get(term, 0.0) for term, weight in term_vector.items()
+    )
+
+
+def get_document_tokens(document):
+    """Estimates the tokens taken by a document in the context of the prompt."""
+
+    return estimate_tokens(f"{document['document_name']} page {document['page_number']}") + (
+        estimate_tokens(document["content"])
+    )
+
+
+def pack_context(
+    documents,
+    tokens_budget=CONTEXT_TOKENS_BUDGET,
+    duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD,
+    mmr_lambda=CONTEXT_MMR_LAMBDA,
+):
+    """
+    Removes the near-duplicate documents, reorders the others with maximal marginal relevance
+    and keeps those which fit in the token budget.
+
+    Parameters
+    ----------
+    documents : list of dict
+        The retrieved documents, from the most relevant one.
+    tokens_budget : int, optional
+        The maximum number of tokens of the documents (default is `CONTEXT_TOKENS_BUDGET`).
+    duplicate_threshold : float, optional
+        The estimated Jaccard similarity above which a document is a near duplicate of a better
+        ranked one (default is `CONTEXT_DUPLICATE_THRESHOLD`).
+    mmr_lambda : float, optional
+        The weight of the relevance against the novelty, where 1 keeps the retrieval order
+        (default is `CONTEXT_MMR_LAMBDA`).
+
+    Returns
+    -------
+    list of dict
+        The packed documents, in the order of their selection.
+    dict
+        The statistics of the packing: the number of removed duplicates, the number of
+        documents over the budget and the tokens of the retrieved and of the packed documents.
+    """
+
+    statistics = {
+        "duplicates_no": 0,
+        "over_budget_no": 0,
+        "retrieved_tokens": sum(get_document_tokens(document) for document in documents),
+        "packed_tokens": 0,
+    }
+
+    if len(documents) == 0:
+        return [], statistics
+
+    signatures = np.stack(
+        [
+            compute_minhash_signature(get_shingle_hashes(document["content"]))
+            for document in documents
+        ]
+    )
+    similarities = (signatures[:, np.newaxis, :] == signatures[np.newaxis, :, :]).mean(axis=2)
+
+    # a document is dropped if it nearly duplicates a better ranked document which is kept
+    kept_indexes = []
+    for document_index in range(len(documents)):
+        if any(
+            similarities[document_index, kept_index] >= duplicate_threshold
+            for kept_index in kept_indexes
+        ):
+            statistics["duplicates_no"] += 1
+        else:
+            kept_indexes.append(document_index)
+
+    # the relevance decreases linearly with the rank of the retrieval
+    relevances = {
+        document_index: 1 - rank / len(kept_indexes)
+        for rank, document_index in enumerate(kept_indexes)
+    }
+    # the shingles of chunks about the same topic rarely match, unlike their terms
+    term_vectors = {
+        document_index: get_term_vector(documents[document_index]["content"])
+        for document_index in kept_indexes
+    }
+
+    packed_indexes = []
+    remaining_tokens = tokens_budget
+
+    # the redundancy of a document is the highest cosine similarity of its terms with those of a
+    # packed document
+    def get_marginal_relevance(document_index):
+        redundancy = max(
+            (
+                compute_cosine_similarity(term_vectors[document_index], term_vectors[packed_index])
+                for packed_index in packed_indexes
+            ),
+            default=0.0,
+        )
+        return mmr_lambda * relevances[document_index] - (1 - mmr_lambda) * redundancy
+
+    while len(relevances) != 0:
+        best_index = max(relevances, key=get_marginal_relevance)
+        del relevances[best_index]
+
+        # a document which does not fit is skipped, so a smaller one may still fit
+        document_tokens = get_document_tokens(documents[best_index])
+        if document_tokens > remaining_tokens:
+            statistics["over_budget_no"] += 1
+            continue
+
+        remaining_tokens -= document_tokens
+        packed_indexes.append(best_index)
+
+    statistics["packed_tokens"] = tokens_budget - remaining_tokens
+
+    return [documents[packed_index] for packed_index in packed_indexes], statistics
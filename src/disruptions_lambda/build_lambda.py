@@ -0,0 +1,40 @@
+"""
+This module builds the zip file of the Lambda function. The disruptions CSV file is compiled
+into the binary disruptions store, which is shipped in the zip file instead of the CSV file.
+"""
+
+import zipfile
+
+from disruptions_store import write_store
+
+LAMBDA_SOURCE_FILES = (
+    "check_disruptions.py",
+    "disruptions_lambda.py",
+    "disruptions_segments.py",
+    "disruptions_store.py",
+    "station_resolver.py",
+)
+DISRUPTIONS_FILE_PATH = "./ns_trains_disruptions_2024.csv"
+DISRUPTIONS_STORE_PATH = "./ns_trains_disruptions_2024.nsds"
+ZIP_PATH = "./disruptions_lambda.zip"
+
+
+def build_lambda_zip():
+    """
+    Compiles the disruptions store and packages it together with the source files of the
+    Lambda function.
+    """
+
+    store_hash = write_store(DISRUPTIONS_FILE_PATH, DISRUPTIONS_STORE_PATH)
+    print(f"The disruptions store was compiled with the hash {store_hash}.")
+
+    with zipfile.ZipFile(ZIP_PATH, "w", compression=zipfile.ZIP_DEFLATED) as lambda_zip:
+        for source_file in LAMBDA_SOURCE_FILES:
+            lambda_zip.write(source_file)
+        lambda_zip.write(DISRUPTIONS_STORE_PATH)
+
+    print(f"The zip of the Lambda function is now built at {ZIP_PATH}.")
+
+
+if __name__ == "__main__":
+    build_lambda_zip()
@@ -2,78 +2,258 @@
 This module is used by the Lambda function which gives details about train disruptions.
 """
 
-import csv
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from disruptions_segments import DisruptionsIndex, create_manifest, ingest_disruptions
+from disruptions_store import DisruptionsStore, get_line_stations, parse_time, write_store
+from station_resolver import StationResolver
+
+
+def get_segments_directory():
+    """
+    Returns the directory of the ingested segments and of their manifest, which is given by the
+    `DISRUPTIONS_SEGMENTS_PATH` environment variable, such as a mounted EFS directory. It
+    defaults to `/tmp` in Lambda, whose package directory is read-only, and to the current
+    directory elsewhere.
+    """
+
+    if "AWS_LAMBDA_FUNCTION_NAME" in os.environ:
+        default_directory = "/tmp/disruptions_segments"
+    else:
+        default_directory = "./disruptions_segments"
+
+    return os.environ.get("DISRUPTIONS_SEGMENTS_PATH", default_directory)
 
 
 class CheckDisruptions:
     """
-    A class to check for train disruptions from a CSV file which stores
-    the all train disruptions in the Netherlands from 2024. This class reads
-    disruption data from a specified CSV file, processes it, and provides
-    methods to retrieve disruption information for a given station.
+    A class to check for train disruptions from the train disruptions in the Netherlands
+    from 2024. Every station on a disrupted line can be queried by name, station code or
+    alias, and the names are resolved even if they are misspelled. The disruptions are read
+    from a precompiled binary store which is memory-mapped, or compiled in memory from the CSV
+    file when the store has not been built, and this class provides methods to retrieve
+    disruption information for a given station.
+
+    New disruptions are ingested as additional segments listed by a manifest, which is
+    preferred over the single store once it exists. The store is kept at class level, so it
+    is opened only once per Lambda container and reused by all warm invocations until the
+    underlying file changes, in which case only the new segments are opened.
     """
 
     DISRUPTIONS_FILE_PATH = "./ns_trains_disruptions_2024.csv"
+    DISRUPTIONS_STORE_PATH = "./ns_trains_disruptions_2024.nsds"
+    DISRUPTIONS_MANIFEST_PATH = os.path.join(get_segments_directory(), "manifest.json")
+    # train stations that are always reported without disruptions from them
+    STATIONS_WITHOUT_DISRUPTIONS = ("Enschede",)
+    # the disruption times are wall-clock times in the Netherlands
+    TIME_ZONE = "Europe/Amsterdam"
+    MAX_LISTED_DISRUPTIONS = 10
+    MAX_BATCH_STATIONS = 20
+
+    # process-level cache of the disruptions store and the state of the file it was built from
+    _store = None
+    _station_resolver = None
+    _source_path = None
+    _file_signature = None
+    _file_hash = None
 
     @classmethod
-    def get_disruptions(cls):
+    def _compute_file_hash(cls, file_path):
         """
-        Retrieves and processes train disruption data from a CSV file. It parses
-        each row and stores for each train station the first existent disruption.
+        Computes the SHA-256 hash of a file.
+
+        Parameters
+        ----------
+        file_path : str
+            The path of the file.
 
         Returns
         -------
-        dict
-            A dictionary where keys are the starting station names and values
-            are a list containing:
-            - The destination station
-            - The cause of the disruption
-            - The duration of the disruption in minutes
-            Returns an empty dictionary if the file is not found.
+        str
+            The hexadecimal digest of the file content.
         """
 
-        # load the data
-        try:
-            with open(cls.DISRUPTIONS_FILE_PATH, newline="", encoding="utf-8") as csvfile:
-                reader = csv.DictReader(csvfile)
-                all_disruptions = list(reader)
-        except FileNotFoundError:
-            return {}
-
-        # get the first existent disruption for each train station
-        disruptions_from_station = {}
-        seen_start_stations = set()
-
-        for row in all_disruptions:
-            line = row["ns_lines"]
-
-            if line.count(" - ") == 1:
-                start_station, destination_station = line.split(" - ")
-            elif line.count("-") == 1:
-                start_station, destination_station = line.split("-")
-            else:
-                # skip malformed lines
+        file_hash = hashlib.sha256()
+
+        with open(file_path, "rb") as disruptions_file:
+            for block in iter(lambda: disruptions_file.read(1 << 20), b""):
+                file_hash.update(block)
+
+        return file_hash.hexdigest()
+
+    @classmethod
+    def _load_store(cls, source_path, previous_store=None):
+        """
+        Opens the segments of the manifest or the binary store, or compiles the CSV file into
+        an in-memory store.
+
+        Parameters
+        ----------
+        source_path : str
+            The path of the manifest, of the binary store or of the CSV file.
+        previous_store : DisruptionsIndex, optional
+            The index loaded from the same manifest, whose segments are reused
+            (default is None).
+
+        Returns
+        -------
+        DisruptionsIndex
+            The loaded disruptions index.
+        """
+
+        if source_path == cls.DISRUPTIONS_MANIFEST_PATH:
+            return DisruptionsIndex.from_manifest(source_path, previous_store)
+
+        if source_path == cls.DISRUPTIONS_STORE_PATH:
+            return DisruptionsIndex([DisruptionsStore.open(source_path)])
+
+        return DisruptionsIndex([DisruptionsStore.from_csv(source_path)])
+
+    @classmethod
+    def invalidate(cls):
+        """
+        Drops the cached store, forcing the next lookup to load it again.
+        """
+
+        if cls._store is not None:
+            cls._store.close()
+
+        cls._store = None
+        cls._station_resolver = None
+        cls._source_path = None
+        cls._file_signature = None
+        cls._file_hash = None
+
+    @classmethod
+    def get_store(cls):
+        """
+        Retrieves the disruptions store. The manifest of the segments is preferred over the
+        binary store, which is preferred over the CSV file. The result is cached and loaded
+        again only if the modification time or size of its file changed and its content hash
+        is different.
+
+        Returns
+        -------
+        DisruptionsIndex or None
+            The disruptions index, or None if no manifest, store or CSV file is found.
+        """
+
+        for source_path in (
+            cls.DISRUPTIONS_MANIFEST_PATH,
+            cls.DISRUPTIONS_STORE_PATH,
+            cls.DISRUPTIONS_FILE_PATH,
+        ):
+            try:
+                file_stat = os.stat(source_path)
+                break
+            except FileNotFoundError:
                 continue
+        else:
+            cls.invalidate()
+            return None
+
+        file_signature = (source_path, file_stat.st_mtime_ns, file_stat.st_size)
+
+        if cls._store is not None and file_signature == cls._file_signature:
+            return cls._store
+
+        # the file was touched, but it is loaded again only if its content changed
+        file_hash = cls._compute_file_hash(source_path)
+
+        if cls._store is None or source_path != cls._source_path or file_hash != cls._file_hash:
+            if source_path == cls.DISRUPTIONS_MANIFEST_PATH == cls._source_path:
+                # the segments which are still listed are reused and the other ones are closed
+                store = cls._load_store(source_path, cls._store)
+                cls._store = None
+            else:
+                store = cls._load_store(source_path)
+
+            cls.invalidate()
+            cls._store = store
+            cls._source_path = source_path
+            cls._file_hash = file_hash
+
+        cls._file_signature = file_signature
+
+        return cls._store
+
+    @classmethod
+    def ingest(cls, file_path):
+        """
+        Appends the disruptions of a CSV file which are not known yet as a new segment, so
+        the existing disruptions are neither parsed nor indexed again. The manifest is created
+        on the first ingestion, from the binary store or from the CSV file.
+
+        Parameters
+        ----------
+        file_path : str
+            The path of the CSV file with the new disruptions.
 
-            # normalize spacing
-            start_station = start_station.strip()
-            destination_station = destination_station.strip()
+        Returns
+        -------
+        int
+            The number of ingested disruptions.
+        """
+
+        if not os.path.exists(cls.DISRUPTIONS_MANIFEST_PATH):
+            base_store_path = cls.DISRUPTIONS_STORE_PATH
+            if not os.path.exists(base_store_path):
+                base_store_path = os.path.join(
+                    os.path.dirname(cls.DISRUPTIONS_MANIFEST_PATH), "segment_000000.nsds"
+                )
+                os.makedirs(os.path.dirname(base_store_path), exist_ok=True)
+                write_store(cls.DISRUPTIONS_FILE_PATH, base_store_path)
+
+            create_manifest(cls.DISRUPTIONS_MANIFEST_PATH, base_store_path)
+
+        # the cached index is reused for the deduplication when it was loaded from the manifest
+        store = cls.get_store()
+
+        with open(file_path, newline="", encoding="utf-8") as disruptions_file:
+            ingested_no = ingest_disruptions(
+                disruptions_file, cls.DISRUPTIONS_MANIFEST_PATH, store
+            )
+
+        return ingested_no
+
+    @classmethod
+    def resolve_station_name(cls, station_name):
+        """
+        Resolves a station name which can differ in case, accents or spelling, a station code
+        or an alias such as 'Den Bosch' to the canonical name of the station.
+
+        Parameters
+        ----------
+        station_name : str
+            The name of the train station passed by the agent.
+
+        Returns
+        -------
+        str
+            The canonical name of the station, or the passed name if no station matches it.
+        """
 
-            # add the start station only if it has not been seen
-            if start_station not in seen_start_stations:
-                seen_start_stations.add(start_station)
-                disruptions_from_station[start_station] = [
-                    destination_station,
-                    row["statistical_cause_en"],
-                    row["duration_minutes"],
-                ]
+        store = cls.get_store()
+        if store is None:
+            return station_name
+
+        if cls._station_resolver is None:
+            cls._station_resolver = StationResolver(
+                dict.fromkeys(store.affected_stations + store.stations), store.station_codes
+            )
 
-        return disruptions_from_station
+        resolved_station_name = cls._station_resolver.resolve(station_name)
+
+        return station_name if resolved_station_name is None else resolved_station_name
 
     @classmethod
     def get_disruption_from_station(cls, station_name):
         """
-        Retrieves disruption information for a specified train station.
+        Retrieves the first existent disruption which starts from a specified train station.
 
         Parameters
         ----------
@@ -86,21 +266,431 @@ class CheckDisruptions:
             A formatted string indicating the disruption status.
         """
 
-        disruptions = cls.get_disruptions()
-        all_stations = list(disruptions.keys()) + ["Enschede"]
+        station_name = cls.resolve_station_name(station_name)
+        store = cls.get_store()
+        if store is None:
+            records = affected_records = ()
+        else:
+            records = store.records_from_station(station_name)
+            affected_records = store.records_at_station(station_name)
 
-        if station_name not in all_stations:
-            return f"There is no train station in {station_name}."
+        if len(records) != 0:
+            disruption = store.record(records[0])
 
-        try:
-            destination_station, cause, duration = disruptions[station_name]
             return (
-                f"There is a disruption from {station_name} to {destination_station}"
-                + f" of around {duration} minutes with the cause '{cause}'."
+                f"There is a disruption from {station_name} to {disruption['destination_station']}"
+                + f" of around {disruption['duration_minutes']} minutes with the cause"
+                + f" '{disruption['cause']}'."
             )
-        except KeyError:
+
+        if station_name in cls.STATIONS_WITHOUT_DISRUPTIONS:
             return f"You are lucky. There are no disruptions from {station_name}."
 
+        # the station can still be an intermediate station of a disrupted line
+        if len(affected_records) != 0:
+            disruption = store.record(affected_records[0])
+
+            return (
+                f"There is a disruption on the line {disruption['line']} which passes through"
+                + f" {station_name} of around {disruption['duration_minutes']} minutes with the"
+                + f" cause '{disruption['cause']}'."
+            )
+
+        return f"There is no train station in {station_name}."
+
+    @classmethod
+    def get_disruptions_on_route(cls, departure_station_name, arrival_station_name):
+        """
+        Retrieves the disruptions which affect both the departure and the arrival station of
+        a route.
+
+        Parameters
+        ----------
+        departure_station_name : str
+            The name of the train station where the route starts.
+        arrival_station_name : str
+            The name of the train station where the route ends.
+
+        Returns
+        -------
+        str
+            A formatted string listing the disruptions on the route.
+        """
+
+        departure_station_name = cls.resolve_station_name(departure_station_name)
+        arrival_station_name = cls.resolve_station_name(arrival_station_name)
+        store = cls.get_store()
+
+        for station_name in (departure_station_name, arrival_station_name):
+            if (store is None or store.resolve_station(station_name) is None) and (
+                station_name not in cls.STATIONS_WITHOUT_DISRUPTIONS
+            ):
+                return f"There is no train station in {station_name}."
+
+        route = f"between {departure_station_name} and {arrival_station_name}"
+        if store is None:
+            return f"You are lucky. There are no disruptions {route}."
+
+        records = store.records_on_route(departure_station_name, arrival_station_name)
+
+        return cls._format_disruptions(store, records, route)
+
+    @classmethod
+    def parse_station_queries(cls, value):
+        """
+        Parses the list of stations passed by the agent to a batch lookup. The list can be a
+        JSON array of names or of objects with the keys 'train_station_name', 'start_time' and
+        'end_time', or a comma-separated string of names.
+
+        Parameters
+        ----------
+        value : str or list
+            The stations to look up.
+
+        Returns
+        -------
+        list of dict
+            The unique station queries, each with the station name and optional time window.
+
+        Raises
+        ------
+        ValueError
+            If a station name is not a string, such as a JSON null or number, or if a time is
+            neither a string nor missing.
+        """
+
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except json.JSONDecodeError:
+                value = value.strip().strip("[]").split(",")
+
+        if not isinstance(value, list):
+            value = [value]
+
+        station_queries = []
+        seen_station_queries = set()
+
+        for item in value:
+            if isinstance(item, dict):
+                station_name = item.get("train_station_name", "")
+                start_time, end_time = item.get("start_time"), item.get("end_time")
+            else:
+                station_name, start_time, end_time = item, None, None
+
+            # a null or a number is not coerced into a station such as 'None' or '1'
+            if not isinstance(station_name, str):
+                raise ValueError(f"Invalid station name: {station_name!r}")
+            for time_value in (start_time, end_time):
+                if time_value is not None and not isinstance(time_value, str):
+                    raise ValueError(f"Invalid time: {time_value!r}")
+
+            station_query = {
+                "train_station_name": station_name.strip().strip("'\""),
+                "start_time": start_time,
+                "end_time": end_time,
+            }
+
+            key = tuple(station_query.values())
+            if station_query["train_station_name"] != "" and key not in seen_station_queries:
+                seen_station_queries.add(key)
+                station_queries.append(station_query)
+
+        return station_queries
+
+    @classmethod
+    def get_disruptions_from_stations(cls, station_queries, start_time=None, end_time=None):
+        """
+        Retrieves the disruption status of several train stations in a single call, using the
+        same store for all of them.
+
+        Parameters
+        ----------
+        station_queries : list of dict
+            The station queries returned by `parse_station_queries`.
+        start_time : str, optional
+            The start of the time window used by the stations without their own window
+            (default is None).
+        end_time : str, optional
+            The end of the time window used by the stations without their own window
+            (default is None).
+
+        Returns
+        -------
+        dict
+            The disruption status of each station, keyed by 'stations', and a note if the
+            list was truncated.
+        """
+
+        results = {"stations": []}
+
+        if len(station_queries) > cls.MAX_BATCH_STATIONS:
+            results["note"] = f"Only the first {cls.MAX_BATCH_STATIONS} stations were checked."
+            station_queries = station_queries[: cls.MAX_BATCH_STATIONS]
+
+        for station_query in station_queries:
+            station_name = station_query["train_station_name"]
+            station_start_time = station_query["start_time"] or start_time
+            station_end_time = station_query["end_time"] or end_time
+
+            # the current status is returned if no time window is passed
+            if station_start_time is None and station_end_time is None:
+                disruptions_status = cls.get_disruption_from_station(station_name)
+            else:
+                disruptions_status = cls.get_disruptions_in_window(
+                    station_start_time, station_end_time, station_name
+                )
+
+            results["stations"].append(
+                {
+                    "train_station_name": station_name,
+                    "resolved_station_name": cls.resolve_station_name(station_name),
+                    "start_time": station_start_time,
+                    "end_time": station_end_time,
+                    "disruptions_status": disruptions_status,
+                }
+            )
+
+        return results
+
+    @classmethod
+    def get_disruption_stats(cls, station_name=None, line=None):
+        """
+        Retrieves the precomputed disruption statistics of a train station or of a line,
+        which describe how reliable the station or the route is.
+
+        Parameters
+        ----------
+        station_name : str, optional
+            The name of the train station (default is None).
+        line : str, optional
+            The line given by its stations, such as 'Zwolle - Kampen' (default is None).
+
+        Returns
+        -------
+        str
+            A formatted string with the disruption statistics.
+        """
+
+        store = cls.get_store()
+
+        if station_name is not None:
+            station_name = cls.resolve_station_name(station_name)
+            stats = None if store is None else store.get_station_stats(station_name)
+
+            if stats is None:
+                return f"There is no train station in {station_name}."
+
+            return cls._format_disruption_stats(stats, f"at {station_name}")
+
+        line_stations = [
+            cls.resolve_station_name(line_station) for line_station in get_line_stations(line)
+        ]
+        if len(line_stations) < 2:
+            return "The line should contain at least two stations, such as 'Zwolle - Kampen'."
+
+        description = f"on the line {' - '.join(line_stations)}"
+        stats = None if store is None else store.get_line_stats(line_stations)
+
+        # a route which is not an NS line is described by the disruptions of both its ends
+        if stats is None and store is not None and len(line_stations) == 2:
+            records = store.records_on_route(*line_stations)
+            if len(records) != 0:
+                stats = store.compute_stats(records)
+                description = f"between {line_stations[0]} and {line_stations[1]}"
+
+        if stats is None:
+            return f"You are lucky. There were no disruptions {description}."
+
+        return cls._format_disruption_stats(stats, description)
+
+    @classmethod
+    def _format_disruption_stats(cls, stats, description):
+        """
+        Formats the disruption statistics of a station or a line.
+
+        Parameters
+        ----------
+        stats : dict
+            The statistics returned by `compute_disruption_stats`.
+        description : str
+            The station or the line, such as 'at Utrecht'.
+
+        Returns
+        -------
+        str
+            A formatted string with the disruption statistics.
+        """
+
+        def format_counts(counts, unit=""):
+            return ", ".join(f"{value}{unit} ({count} times)" for value, count in counts)
+
+        return (
+            f"In 2024, there were {stats['disruptions_no']} disruptions {description}.\n"
+            + f"- median duration: {stats['median_duration_minutes']} minutes\n"
+            + f"- 90th percentile of the duration: {stats['p90_duration_minutes']} minutes\n"
+            + f"- most frequent causes: {format_counts(stats['top_causes'])}\n"
+            + f"- most frequent cause groups: {format_counts(stats['top_cause_groups'])}\n"
+            + f"- busiest hours: {format_counts(stats['busiest_hours'], ':00')}"
+        )
+
+    @classmethod
+    def _format_disruptions(cls, store, records, description):
+        """
+        Formats a list of disruptions, limited to `MAX_LISTED_DISRUPTIONS` entries.
+
+        Parameters
+        ----------
+        store : DisruptionsStore
+            The store which contains the records.
+        records : list of int
+            The identifiers of the records to list.
+        description : str
+            The location or the period of the disruptions, such as 'at Utrecht'.
+
+        Returns
+        -------
+        str
+            A formatted string listing the disruptions.
+        """
+
+        if len(records) == 0:
+            return f"You are lucky. There were no disruptions {description}."
+
+        if len(records) == 1:
+            disruptions_status = f"There was 1 disruption {description}:\n"
+        else:
+            disruptions_status = f"There were {len(records)} disruptions {description}:\n"
+
+        for record in records[: cls.MAX_LISTED_DISRUPTIONS]:
+            disruption = store.record(record)
+            disruptions_status += (
+                f"- {disruption['line']} from {disruption['start_time']}"
+                + f" to {disruption['end_time'] or 'an unknown time'}"
+                + f" of around {disruption['duration_minutes']} minutes"
+                + f" with the cause '{disruption['cause']}'\n"
+            )
+
+        if len(records) > cls.MAX_LISTED_DISRUPTIONS:
+            disruptions_status += (
+                f"Only the first {cls.MAX_LISTED_DISRUPTIONS} disruptions are listed.\n"
+            )
+
+        return disruptions_status.strip()
+
+    @classmethod
+    def parse_query_time(cls, value, end_of_day=False):
+        """
+        Converts a time passed by the agent to wall-clock seconds since the epoch.
+
+        Parameters
+        ----------
+        value : str or None
+            The time formatted as 'YYYY-MM-DD HH:MM[:SS]' or 'YYYY-MM-DD', or None, an empty
+            string or 'now' for the current time in the Netherlands. A time with an offset,
+            such as '2024-03-12T08:00+01:00', is converted to the time in the Netherlands,
+            while a time without one is already the time in the Netherlands.
+        end_of_day : bool, optional
+            Whether a date without a time refers to the end of that day (default is False).
+
+        Returns
+        -------
+        int
+            The number of seconds since the epoch.
+
+        Raises
+        ------
+        ValueError
+            If the value is not a valid time, such as a number.
+        """
+
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"Invalid time: {value!r}")
+
+        try:
+            time_zone = ZoneInfo(cls.TIME_ZONE)
+        except ZoneInfoNotFoundError:
+            time_zone = timezone.utc
+
+        if value is None or value.strip().lower() in ("", "now"):
+            return parse_time(datetime.now(time_zone).strftime("%Y-%m-%d %H:%M:%S"))
+
+        value = value.strip()
+        if end_of_day and len(value) == len("YYYY-MM-DD"):
+            value += " 23:59:59"
+
+        query_time = datetime.fromisoformat(value)
+        # the disruptions are stored in wall-clock time, so an explicit offset is converted
+        if query_time.tzinfo is not None:
+            query_time = query_time.astimezone(time_zone)
+
+        return parse_time(query_time.strftime("%Y-%m-%d %H:%M:%S"))
+
+    @classmethod
+    def get_disruptions_in_window(cls, start_time=None, end_time=None, station_name=None):
+        """
+        Retrieves the disruptions which were ongoing at a point in time or during a time window,
+        optionally only the ones affecting a specified train station.
+
+        Parameters
+        ----------
+        start_time : str, optional
+            The start of the time window, or the point in time if `end_time` is not passed.
+            Defaults to the current time.
+        end_time : str, optional
+            The end of the time window (default is None).
+        station_name : str, optional
+            The name of the train station to check for disruptions (default is None).
+
+        Returns
+        -------
+        str
+            A formatted string listing the disruptions in the time window.
+        """
+
+        try:
+            window_start = cls.parse_query_time(start_time)
+            if end_time is None or (isinstance(end_time, str) and end_time.strip() == ""):
+                # a date without a time covers the whole day
+                window_end = cls.parse_query_time(start_time, end_of_day=True)
+            else:
+                window_end = cls.parse_query_time(end_time, end_of_day=True)
+        except ValueError:
+            return "The times should be formatted as 'YYYY-MM-DD HH:MM' or 'YYYY-MM-DD'."
+
+        if window_end < window_start:
+            return "The end of the time window should be after its start."
+
+        if station_name is not None:
+            station_name = cls.resolve_station_name(station_name)
+
+        store = cls.get_store()
+        location = "" if station_name is None else f" at {station_name}"
+        period = (
+            f"at {format_window_time(window_start)}"
+            if window_start == window_end
+            else f"between {format_window_time(window_start)} and {format_window_time(window_end)}"
+        )
+
+        if store is None:
+            records = []
+        else:
+            if station_name is not None and store.resolve_station(station_name) is None:
+                if station_name not in cls.STATIONS_WITHOUT_DISRUPTIONS:
+                    return f"There is no train station in {station_name}."
+            records = store.records_in_window(window_start, window_end, station_name)
+
+        return cls._format_disruptions(store, records, f"{location} {period}".strip())
+
+
+def format_window_time(seconds):
+    """Formats wall-clock seconds since the epoch as 'YYYY-MM-DD HH:MM'."""
+
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).strftime("%Y-%m-%d %H:%M")
+
 
 if __name__ == "__main__":
     print(CheckDisruptions.get_disruption_from_station("Enschede"))
+    print(CheckDisruptions.get_disruptions_in_window("2024-01-05 11:30", station_name="Amsterdam"))
+    print(CheckDisruptions.get_disruptions_on_route("Utrecht Centraal", "Den Haag Centraal"))
+    print(CheckDisruptions.get_disruption_stats(line="Zwolle - Kampen"))
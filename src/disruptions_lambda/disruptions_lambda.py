@@ -1,3 +1,4 @@
+import json
 import logging
 from typing import Dict, Any
 from http import HTTPStatus
@@ -29,12 +30,11 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         message_version = event.get("messageVersion", 1)
         parameters = event.get("parameters", [])
 
-        # get the train station name parameter
-        train_station_name = None
-
-        for parameter in parameters:
-            if parameter["name"].lower() == "train_station_name":
-                train_station_name = parameter["value"]
+        # get the parameters by their name
+        parameter_values = {
+            parameter["name"].lower(): parameter["value"] for parameter in parameters
+        }
+        train_station_name = parameter_values.get("train_station_name")
 
         if function == "get_disruptions_train_station":
             # get disruptions status
@@ -45,9 +45,64 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             # treat the case when the train station name has not been passed
             else:
                 disruptions_status = "Please pass the 'train_station_name' parameter."
+        elif function == "get_disruptions_time_window":
+            # the station is optional, and a missing start time means the current time
+            disruptions_status = CheckDisruptions.get_disruptions_in_window(
+                parameter_values.get("start_time"),
+                parameter_values.get("end_time"),
+                train_station_name,
+            )
+        elif function == "get_disruptions_route":
+            departure_station_name = parameter_values.get("departure_station_name")
+            arrival_station_name = parameter_values.get("arrival_station_name")
+
+            if departure_station_name is not None and arrival_station_name is not None:
+                disruptions_status = CheckDisruptions.get_disruptions_on_route(
+                    departure_station_name, arrival_station_name
+                )
+            else:
+                disruptions_status = (
+                    "Please pass the 'departure_station_name' and 'arrival_station_name'"
+                    " parameters."
+                )
+        elif function == "get_disruptions_train_stations":
+            # check all stations in one invocation and return a combined JSON body
+            try:
+                station_queries = CheckDisruptions.parse_station_queries(
+                    parameter_values.get("train_station_names", "")
+                )
+            except ValueError:
+                # invalid entries get the same answer as a missing parameter
+                station_queries = []
+
+            if len(station_queries) != 0:
+                disruptions_status = json.dumps(
+                    CheckDisruptions.get_disruptions_from_stations(
+                        station_queries,
+                        parameter_values.get("start_time"),
+                        parameter_values.get("end_time"),
+                    ),
+                    ensure_ascii=False,
+                )
+            else:
+                disruptions_status = "Please pass the 'train_station_names' parameter."
+        elif function == "get_disruption_stats":
+            line = parameter_values.get("line")
+
+            if train_station_name is not None or line is not None:
+                disruptions_status = CheckDisruptions.get_disruption_stats(
+                    train_station_name, line
+                )
+            else:
+                disruptions_status = "Please pass the 'train_station_name' or 'line' parameter."
         # treat the case when the function name has not been passed correctly
         else:
-            disruptions_status = "The available function name 'get_disruptions_train_station' has not been passed correctly."
+            disruptions_status = (
+                "The available function names 'get_disruptions_train_station',"
+                " 'get_disruptions_train_stations', 'get_disruptions_time_window',"
+                " 'get_disruptions_route' and 'get_disruption_stats' have not been"
+                " passed correctly."
+            )
 
         response_body = {"TEXT": {"body": disruptions_status}}
 
@@ -0,0 +1,484 @@
+"""
+This module combines the base disruptions store with the segments produced by incremental
+ingestion. New disruption exports are streamed, deduplicated by `rdt_id` and compiled into a
+new segment, so the cost of an update depends on the size of the delta and not on the size of
+the history. The segments are listed in a manifest and are periodically compacted into one.
+"""
+
+import os
+import csv
+import json
+import heapq
+import bisect
+from itertools import chain
+
+from disruptions_store import (
+    DisruptionsStore,
+    compile_rows,
+    compute_disruption_stats,
+    get_line_key,
+    get_line_stations,
+)
+
+# the number of segments above which they are compacted into a single one
+MAX_SEGMENTS = 8
+
+
+class DisruptionsIndex:
+    """
+    A read-only view over a sequence of disruption stores, where the records of each segment
+    follow the records of the previous ones. It exposes the same queries as a single store.
+    """
+
+    def __init__(self, segments, segment_paths=None):
+        """
+        Initialize the DisruptionsIndex instance.
+
+        Parameters
+        ----------
+        segments : list of DisruptionsStore
+            The segments, from the oldest to the newest.
+        segment_paths : list of str, optional
+            The paths of the segment files, needed to reuse them after an update
+            (default is None).
+        """
+
+        self.segments = segments
+        self.segment_paths = segment_paths or [None] * len(segments)
+
+        # the global identifier of a record is its position across all segments
+        self._offsets = [0]
+        for segment in segments:
+            self._offsets.append(self._offsets[-1] + segment.records_no)
+        self.records_no = self._offsets[-1]
+
+        self.stations = list(dict.fromkeys(chain.from_iterable(s.stations for s in segments)))
+        self.affected_stations = list(
+            dict.fromkeys(chain.from_iterable(s.affected_stations for s in segments))
+        )
+        self.station_codes = {}
+        for segment in segments:
+            self.station_codes.update(segment.station_codes)
+
+    @classmethod
+    def from_manifest(cls, manifest_path, previous_index=None):
+        """
+        Opens the segments listed in a manifest.
+
+        Parameters
+        ----------
+        manifest_path : str
+            The path of the manifest.
+        previous_index : DisruptionsIndex, optional
+            An index whose already opened segments are reused, while the segments which are
+            no longer listed are closed (default is None).
+
+        Returns
+        -------
+        DisruptionsIndex
+            The index over the listed segments.
+        """
+
+        with open(manifest_path, encoding="utf-8") as manifest_file:
+            segment_paths = json.load(manifest_file)["segments"]
+
+        opened_segments = {}
+        if previous_index is not None:
+            opened_segments = dict(zip(previous_index.segment_paths, previous_index.segments))
+
+        segments = []
+        for segment_path in segment_paths:
+            segment = opened_segments.pop(segment_path, None)
+            segments.append(segment if segment is not None else DisruptionsStore.open(segment_path))
+
+        for segment in opened_segments.values():
+            segment.close()
+
+        return cls(segments, segment_paths)
+
+    def close(self):
+        """Closes all segments."""
+
+        for segment in self.segments:
+            segment.close()
+
+    def _to_global(self, segment_index, records):
+        """Converts the record identifiers of a segment to global identifiers."""
+
+        offset = self._offsets[segment_index]
+
+        return [offset + record for record in records]
+
+    def _locate(self, record):
+        """Returns the segment and the local identifier of a global record identifier."""
+
+        segment_index = bisect.bisect_right(self._offsets, record) - 1
+
+        return self.segments[segment_index], record - self._offsets[segment_index]
+
+    def record(self, record):
+        """
+        Decodes a single disruption record.
+
+        Parameters
+        ----------
+        record : int
+            The global identifier of the record.
+
+        Returns
+        -------
+        dict
+            The decoded fields of the record.
+        """
+
+        segment, local_record = self._locate(record)
+
+        return segment.record(local_record)
+
+    def resolve_station(self, station_name):
+        """
+        Checks whether a station name or code is known by any segment.
+
+        Parameters
+        ----------
+        station_name : str
+            The exact name of the station or its code.
+
+        Returns
+        -------
+        str or None
+            The canonical name of the station, or None if it is unknown.
+        """
+
+        for segment in self.segments:
+            resolved_station_name = segment.resolve_station(station_name)
+            if resolved_station_name is not None:
+                return resolved_station_name
+
+        return None
+
+    def contains_rdt_id(self, rdt_id):
+        """Checks whether any segment contains a disruption, by binary search."""
+
+        return any(segment.contains_rdt_id(rdt_id) for segment in reversed(self.segments))
+
+    def records_from_station(self, station_name):
+        """Returns the records of the disruptions which start from a station, in file order."""
+
+        return [
+            record
+            for segment_index, segment in enumerate(self.segments)
+            for record in self._to_global(
+                segment_index, segment.records_from_station(station_name)
+            )
+        ]
+
+    def records_at_station(self, station_name):
+        """Returns the sorted records of the disruptions which affect a station."""
+
+        return [
+            record
+            for segment_index, segment in enumerate(self.segments)
+            for record in self._to_global(segment_index, segment.records_at_station(station_name))
+        ]
+
+    def records_on_route(self, first_station_name, second_station_name):
+        """Returns the sorted records of the disruptions which affect both stations."""
+
+        return [
+            record
+            for segment_index, segment in enumerate(self.segments)
+            for record in self._to_global(
+                segment_index, segment.records_on_route(first_station_name, second_station_name)
+            )
+        ]
+
+    def records_in_window(self, window_start, window_end, station_name=None):
+        """
+        Returns the records of the disruptions which overlap a time window, merging the
+        results of the segments by start time.
+
+        Parameters
+        ----------
+        window_start : int
+            The start of the window, in wall-clock seconds since the epoch.
+        window_end : int
+            The end of the window, equal to the start for a point-in-time query.
+        station_name : str, optional
+            The exact name or code of an affected station (default is None).
+
+        Returns
+        -------
+        list of int
+            The global identifiers of the records, sorted by start time.
+        """
+
+        segment_results = []
+        for segment_index, segment in enumerate(self.segments):
+            start_times = segment.column("start_time")
+            records = segment.records_in_window(window_start, window_end, station_name)
+            segment_results.append(
+                [
+                    (start_times[record], self._offsets[segment_index] + record)
+                    for record in records
+                ]
+            )
+
+        return [record for _, record in heapq.merge(*segment_results)]
+
+    def compute_stats(self, records):
+        """
+        Computes the disruption statistics of a group of records.
+
+        Parameters
+        ----------
+        records : iterable of int
+            The global identifiers of the records.
+
+        Returns
+        -------
+        dict
+            The statistics returned by `compute_disruption_stats`.
+        """
+
+        return compute_disruption_stats(
+            chain.from_iterable(
+                segment.get_stats_rows([local_record])
+                for segment, local_record in map(self._locate, records)
+            )
+        )
+
+    def get_station_stats(self, station_name):
+        """
+        Returns the disruption statistics of a station. The precomputed statistics are used
+        when a single segment contains the station, otherwise they are computed from the
+        records of the station only.
+
+        Parameters
+        ----------
+        station_name : str
+            The exact name or code of the station.
+
+        Returns
+        -------
+        dict or None
+            The statistics of the station, or None if the station is unknown.
+        """
+
+        segments = [
+            segment for segment in self.segments if segment.resolve_station(station_name) is not None
+        ]
+
+        if len(segments) <= 1:
+            return segments[0].get_station_stats(station_name) if segments else None
+
+        return compute_disruption_stats(
+            chain.from_iterable(
+                segment.get_stats_rows(segment.records_at_station(station_name))
+                for segment in segments
+            )
+        )
+
+    def get_line_stats(self, line_stations):
+        """
+        Returns the disruption statistics of a line. The precomputed statistics are used when
+        a single segment contains the line, otherwise they are computed from the records
+        which affect its first two stations.
+
+        Parameters
+        ----------
+        line_stations : list of str
+            The exact names of the stations of the line, in any order.
+
+        Returns
+        -------
+        dict or None
+            The statistics of the line, or None if there is no such line.
+        """
+
+        segments = [
+            segment for segment in self.segments if segment.get_line_stats(line_stations) is not None
+        ]
+
+        if len(segments) <= 1:
+            return segments[0].get_line_stats(line_stations) if segments else None
+
+        line_key = get_line_key(line_stations)
+
+        def get_line_records(segment):
+            line_column = segment.column("line")
+            return [
+                record
+                for record in segment.records_on_route(line_stations[0], line_stations[1])
+                if get_line_key(get_line_stations(segment.lines[line_column[record]])) == line_key
+            ]
+
+        return compute_disruption_stats(
+            chain.from_iterable(
+                segment.get_stats_rows(get_line_records(segment)) for segment in segments
+            )
+        )
+
+    def iter_rows(self):
+        """Rebuilds the rows of all records, from the oldest segment to the newest one."""
+
+        return chain.from_iterable(segment.iter_rows() for segment in self.segments)
+
+
+def read_manifest(manifest_path):
+    """
+    Reads a segments manifest.
+
+    Parameters
+    ----------
+    manifest_path : str
+        The path of the manifest.
+
+    Returns
+    -------
+    dict
+        The segment paths, keyed by 'segments', and the number of the next segment.
+    """
+
+    with open(manifest_path, encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
+
+
+def write_manifest(manifest_path, manifest):
+    """
+    Replaces a segments manifest atomically, so readers never see a partial file.
+
+    Parameters
+    ----------
+    manifest_path : str
+        The path of the manifest.
+    manifest : dict
+        The content of the manifest.
+    """
+
+    temporary_path = f"{manifest_path}.tmp"
+
+    with open(temporary_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+
+    os.replace(temporary_path, manifest_path)
+
+
+def create_manifest(manifest_path, base_store_path):
+    """
+    Creates a manifest whose only segment is the base disruptions store.
+
+    Parameters
+    ----------
+    manifest_path : str
+        The path of the manifest.
+    base_store_path : str
+        The path of the base disruptions store.
+    """
+
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    write_manifest(manifest_path, {"segments": [base_store_path], "next_segment": 1})
+
+
+def ingest_disruptions(csv_file, manifest_path, index=None):
+    """
+    Streams the rows of a disruptions export, keeps the ones whose `rdt_id` is not known yet
+    and stores them as a new segment. The segments are compacted when there are too many.
+
+    Parameters
+    ----------
+    csv_file : file object
+        A text file opened with newline="" which contains the new disruptions.
+    manifest_path : str
+        The path of an existing manifest, whose directory stores the new segments.
+    index : DisruptionsIndex, optional
+        The index over the segments of the manifest, opened if not passed (default is None).
+
+    Returns
+    -------
+    int
+        The number of ingested disruptions.
+    """
+
+    manifest = read_manifest(manifest_path)
+    owns_index = index is None
+    if owns_index:
+        index = DisruptionsIndex.from_manifest(manifest_path)
+
+    try:
+        new_rows = []
+        new_rdt_ids = set()
+
+        # every row is checked with a binary search per segment, not against the full history
+        for row in csv.DictReader(csv_file):
+            rdt_id = int(row["rdt_id"])
+            if rdt_id in new_rdt_ids or index.contains_rdt_id(rdt_id):
+                continue
+
+            new_rdt_ids.add(rdt_id)
+            new_rows.append(row)
+    finally:
+        if owns_index:
+            index.close()
+
+    if len(new_rows) == 0:
+        return 0
+
+    segment_path = os.path.join(
+        os.path.dirname(manifest_path), f"segment_{manifest['next_segment']:06d}.nsds"
+    )
+    with open(segment_path, "wb") as segment_file:
+        segment_file.write(compile_rows(new_rows))
+
+    manifest["segments"].append(segment_path)
+    manifest["next_segment"] += 1
+    write_manifest(manifest_path, manifest)
+
+    if len(manifest["segments"]) > MAX_SEGMENTS:
+        compact_segments(manifest_path)
+
+    return len(new_rows)
+
+
+def compact_segments(manifest_path):
+    """
+    Compiles all segments of a manifest into a single segment and removes the compacted
+    segments from the manifest directory.
+
+    Parameters
+    ----------
+    manifest_path : str
+        The path of the manifest.
+
+    Returns
+    -------
+    str
+        The path of the compacted segment.
+    """
+
+    manifest = read_manifest(manifest_path)
+    index = DisruptionsIndex.from_manifest(manifest_path)
+
+    try:
+        content = compile_rows(index.iter_rows())
+    finally:
+        index.close()
+
+    segments_directory = os.path.dirname(manifest_path)
+    compacted_path = os.path.join(
+        segments_directory, f"segment_{manifest['next_segment']:06d}.nsds"
+    )
+    with open(compacted_path, "wb") as segment_file:
+        segment_file.write(content)
+
+    old_segment_paths = manifest["segments"]
+    manifest["segments"] = [compacted_path]
+    manifest["next_segment"] += 1
+    write_manifest(manifest_path, manifest)
+
+    # only the segments created by ingestion are removed, the shipped base store is kept
+    for segment_path in old_segment_paths:
+        if os.path.dirname(os.path.abspath(segment_path)) == os.path.abspath(segments_directory):
+            os.remove(segment_path)
+
+    return compacted_path
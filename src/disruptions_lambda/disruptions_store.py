@@ -0,0 +1,1113 @@
+"""
+This module compiles the train disruptions CSV file into a compact columnar binary store and
+reads it back through a memory map. The store keeps interned string tables for stations and
+causes, integer columns for times and durations, an index from each start station to its
+records, an inverted index from every affected station to its records and interval indexes
+over the disruption times, so queries never materialise a dictionary per row. The disruption
+statistics of every station and line are also computed once, when the store is compiled.
+"""
+
+import re
+import csv
+import sys
+import json
+import mmap
+import struct
+import bisect
+import hashlib
+from array import array
+from collections import Counter
+from datetime import datetime, timezone
+
+MAGIC = b"NSDS"
+VERSION = 5
+# magic bytes, format version and size of the table of contents
+HEADER = struct.Struct("<4sII")
+ALIGNMENT = 8
+# marker for missing integer values and for lines without a parsable start station
+MISSING = -1
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# hyphens separate the stations of a line, except the one in names such as 's-Hertogenbosch
+LINE_STATIONS_SEPARATOR = re.compile(r"\s*(?<!'s)-\s*")
+LINE_ANNOTATION = re.compile(r"\(.*?\)")
+# the number of most frequent causes and hours included in the statistics
+TOP_VALUES_NO = 3
+
+
+def parse_time(value):
+    """
+    Converts a timestamp from the disruptions file to wall-clock seconds since the epoch.
+
+    Parameters
+    ----------
+    value : str
+        The timestamp formatted as 'YYYY-MM-DD HH:MM:SS'.
+
+    Returns
+    -------
+    int
+        The number of seconds since the epoch, or `MISSING` if the value is empty.
+    """
+
+    if not value:
+        return MISSING
+
+    return int(datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp())
+
+
+def format_time(seconds):
+    """
+    Converts wall-clock seconds since the epoch back to the format of the disruptions file.
+
+    Parameters
+    ----------
+    seconds : int
+        The number of seconds since the epoch.
+
+    Returns
+    -------
+    str
+        The formatted timestamp, or an empty string if the value is missing.
+    """
+
+    if seconds == MISSING:
+        return ""
+
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).strftime(TIME_FORMAT)
+
+
+def split_line(line):
+    """
+    Splits an NS line such as 'Zwolle-Kampen' into its start and destination stations.
+
+    Parameters
+    ----------
+    line : str
+        The value of the 'ns_lines' column.
+
+    Returns
+    -------
+    tuple of str or None
+        The start and the destination station, or None if the line is malformed.
+    """
+
+    if line.count(" - ") == 1:
+        start_station, destination_station = line.split(" - ")
+    elif line.count("-") == 1:
+        start_station, destination_station = line.split("-")
+    else:
+        return None
+
+    return start_station.strip(), destination_station.strip()
+
+
+def get_line_stations(line):
+    """
+    Extracts every station mentioned by an NS line, including malformed lines such as
+    'Amsterdam-Schiphol-Rotterdam (HSL)' or 'Den Haag-Rotterdam; Leiden-Rotterdam'.
+
+    Parameters
+    ----------
+    line : str
+        The value of the 'ns_lines' column.
+
+    Returns
+    -------
+    list of str
+        The stations of the line, in order of appearance.
+    """
+
+    stations = []
+
+    for route in LINE_ANNOTATION.sub("", line).split(";"):
+        for station in LINE_STATIONS_SEPARATOR.split(route):
+            station = station.strip().rstrip(".")
+            if station != "" and station not in stations:
+                stations.append(station)
+
+    return stations
+
+
+def get_line_key(stations):
+    """
+    Builds the key of a line from its stations, independent of their order and spelling.
+
+    Parameters
+    ----------
+    stations : list of str
+        The stations of the line.
+
+    Returns
+    -------
+    str
+        The sorted and lowercase station names joined by ' | '.
+    """
+
+    return " | ".join(sorted({station.casefold() for station in stations}))
+
+
+def compute_disruption_stats(disruptions):
+    """
+    Computes the disruption statistics of a group of disruptions.
+
+    Parameters
+    ----------
+    disruptions : iterable of tuple
+        The cause, cause group, start time and duration in minutes of each disruption.
+
+    Returns
+    -------
+    dict
+        The number of disruptions, the median and 90th percentile of the durations in minutes,
+        the most frequent causes and cause groups and the busiest hours of the day.
+    """
+
+    disruptions_no = 0
+    durations = []
+    cause_counts = Counter()
+    cause_group_counts = Counter()
+    hour_counts = Counter()
+
+    for cause, cause_group, start_time, duration in disruptions:
+        disruptions_no += 1
+        cause_counts[cause] += 1
+        hour_counts[start_time // 3600 % 24] += 1
+
+        if cause_group != "":
+            cause_group_counts[cause_group] += 1
+        if duration != MISSING:
+            durations.append(duration)
+
+    durations.sort()
+
+    def get_percentile(fraction):
+        if len(durations) == 0:
+            return None
+        return durations[min(len(durations) - 1, int(fraction * len(durations)))]
+
+    return {
+        "disruptions_no": disruptions_no,
+        "median_duration_minutes": get_percentile(0.5),
+        "p90_duration_minutes": get_percentile(0.9),
+        "top_causes": cause_counts.most_common(TOP_VALUES_NO),
+        "top_cause_groups": cause_group_counts.most_common(TOP_VALUES_NO),
+        "busiest_hours": hour_counts.most_common(TOP_VALUES_NO),
+    }
+
+
+class StringTable:
+    """
+    Interns strings into consecutive integer identifiers.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.identifiers = {}
+
+    def intern(self, value):
+        """
+        Returns the identifier of a string, adding the string to the table if needed.
+
+        Parameters
+        ----------
+        value : str
+            The string to intern.
+
+        Returns
+        -------
+        int
+            The identifier of the string.
+        """
+
+        identifier = self.identifiers.get(value)
+
+        if identifier is None:
+            identifier = len(self.values)
+            self.identifiers[value] = identifier
+            self.values.append(value)
+
+        return identifier
+
+
+def _build_postings_index(record_keys, keys_no):
+    """
+    Builds a CSR index which groups record identifiers by key, keeping the records order.
+
+    Parameters
+    ----------
+    record_keys : list of iterable of int
+        The keys of each record, where a record can have any number of keys.
+    keys_no : int
+        The number of distinct keys.
+
+    Returns
+    -------
+    array
+        The offsets of each key in the records array, of length `keys_no` + 1.
+    array
+        The record identifiers grouped by key, sorted within each key.
+    """
+
+    counts = [0] * (keys_no + 1)
+    for keys in record_keys:
+        for key in keys:
+            counts[key + 1] += 1
+
+    for key in range(keys_no):
+        counts[key + 1] += counts[key]
+
+    offsets = array("i", counts)
+    positions = list(counts[:-1])
+    records = array("i", bytes(offsets[-1] * offsets.itemsize))
+
+    for record, keys in enumerate(record_keys):
+        for key in keys:
+            records[positions[key]] = record
+            positions[key] += 1
+
+    return offsets, records
+
+
+def _build_interval_index(records, start_times, end_times):
+    """
+    Builds an interval index over a group of records. The records are sorted by start time
+    and each position stores the latest end time of the records up to it, which is a
+    non-decreasing sequence that can be searched with bisection.
+
+    Parameters
+    ----------
+    records : iterable of int
+        The identifiers of the records in the group.
+    start_times : array
+        The start time of each record.
+    end_times : array
+        The end time of each record, where a missing end time is replaced by the start time.
+
+    Returns
+    -------
+    list of int
+        The identifiers of the records sorted by start time.
+    list of int
+        The sorted start times.
+    list of int
+        The running maximum of the end times.
+    """
+
+    sorted_records = sorted(records, key=lambda record: (start_times[record], record))
+    sorted_start_times = [start_times[record] for record in sorted_records]
+    max_end_times = []
+
+    max_end_time = MISSING
+    for record in sorted_records:
+        max_end_time = max(max_end_time, end_times[record])
+        max_end_times.append(max_end_time)
+
+    return sorted_records, sorted_start_times, max_end_times
+
+
+def _search_interval_index(records, start_times, max_end_times, lo, hi, window):
+    """
+    Finds the records of an interval index that overlap a time window.
+
+    Parameters
+    ----------
+    records, start_times, max_end_times : memoryview
+        The sections of the interval index.
+    lo, hi : int
+        The bounds of the searched group inside the sections.
+    window : tuple of int
+        The start and the end of the time window, in seconds since the epoch.
+
+    Returns
+    -------
+    list of int
+        The candidates which start before the end of the window and which may end after its
+        start, sorted by start time.
+    """
+
+    window_start, window_end = window
+    # the records before `first` have all ended before the window starts
+    first = bisect.bisect_left(max_end_times, window_start, lo, hi)
+    # the records from `last` onwards start after the window ends
+    last = bisect.bisect_right(start_times, window_end, first, hi)
+
+    return records[first:last]
+
+
+def compile_disruptions(csv_file):
+    """
+    Compiles the rows of a disruptions CSV file into the binary store format.
+
+    Parameters
+    ----------
+    csv_file : file object
+        A text file opened with newline="" which contains the disruptions.
+
+    Returns
+    -------
+    bytes
+        The content of the binary store.
+    """
+
+    return compile_rows(csv.DictReader(csv_file))
+
+
+def compile_rows(rows):
+    """
+    Compiles disruption rows into the binary store format.
+
+    Parameters
+    ----------
+    rows : iterable of dict
+        The disruptions, with the columns of the disruptions CSV file.
+
+    Returns
+    -------
+    bytes
+        The content of the binary store.
+    """
+
+    stations = StringTable()
+    affected_stations = StringTable()
+    causes = StringTable()
+    cause_groups = StringTable()
+    lines = StringTable()
+    station_codes = {}
+    record_affected_stations = []
+
+    columns = {
+        "rdt_id": array("q"),
+        "line": array("i"),
+        "start_station": array("i"),
+        "destination_station": array("i"),
+        "cause": array("i"),
+        "cause_group": array("i"),
+        "start_time": array("q"),
+        "end_time": array("q"),
+        "duration_minutes": array("i"),
+    }
+
+    for row in rows:
+        line = row["ns_lines"]
+        line_stations = split_line(line)
+
+        if line_stations is None:
+            start_station = destination_station = MISSING
+        else:
+            start_station = stations.intern(line_stations[0])
+            destination_station = stations.intern(line_stations[1])
+
+        # the affected stations are listed by name and code, with the same order
+        station_names = [name.strip() for name in row["rdt_station_names"].split(",")]
+        codes = [code.strip() for code in row["rdt_station_codes"].split(",")]
+        for station_name, code in zip(station_names, codes):
+            if station_name != "" and code != "":
+                station_codes[code] = station_name
+
+        record_affected_stations.append(
+            {
+                affected_stations.intern(station_name)
+                for station_name in station_names + get_line_stations(line)
+                if station_name != ""
+            }
+        )
+
+        duration = row["duration_minutes"]
+
+        columns["rdt_id"].append(int(row["rdt_id"]))
+        columns["line"].append(lines.intern(line))
+        columns["start_station"].append(start_station)
+        columns["destination_station"].append(destination_station)
+        columns["cause"].append(causes.intern(row["statistical_cause_en"]))
+        columns["cause_group"].append(cause_groups.intern(row["cause_group"]))
+        columns["start_time"].append(parse_time(row["start_time"]))
+        columns["end_time"].append(parse_time(row["end_time"]))
+        columns["duration_minutes"].append(int(duration) if duration else MISSING)
+
+    station_offsets, station_records = _build_postings_index(
+        [() if station == MISSING else (station,) for station in columns["start_station"]],
+        len(stations.values),
+    )
+    columns["station_offsets"] = station_offsets
+    columns["station_records"] = station_records
+    # the sorted identifiers allow checking for known disruptions without loading them all
+    columns["sorted_rdt_ids"] = array("q", sorted(columns["rdt_id"]))
+
+    affected_offsets, affected_records = _build_postings_index(
+        [sorted(keys) for keys in record_affected_stations], len(affected_stations.values)
+    )
+    columns["affected_offsets"] = affected_offsets
+    columns["affected_records"] = affected_records
+
+    # a missing end time means the disruption only has a known start
+    end_times = array(
+        "q",
+        (
+            start_time if end_time == MISSING else end_time
+            for start_time, end_time in zip(columns["start_time"], columns["end_time"])
+        ),
+    )
+
+    interval_index = _build_interval_index(
+        range(len(columns["rdt_id"])), columns["start_time"], end_times
+    )
+    columns["interval_records"] = array("i", interval_index[0])
+    columns["interval_start_times"] = array("q", interval_index[1])
+    columns["interval_max_end_times"] = array("q", interval_index[2])
+
+    # the interval index of each affected station follows the offsets of the inverted index
+    station_intervals = (array("i"), array("q"), array("q"))
+    for station in range(len(affected_stations.values)):
+        interval_index = _build_interval_index(
+            affected_records[affected_offsets[station] : affected_offsets[station + 1]],
+            columns["start_time"],
+            end_times,
+        )
+        for section, values in zip(station_intervals, interval_index):
+            section.extend(values)
+
+    columns["affected_interval_records"] = station_intervals[0]
+    columns["affected_interval_start_times"] = station_intervals[1]
+    columns["affected_interval_max_end_times"] = station_intervals[2]
+
+    def get_stats_rows(records):
+        return (
+            (
+                causes.values[columns["cause"][record]],
+                cause_groups.values[columns["cause_group"][record]],
+                columns["start_time"][record],
+                columns["duration_minutes"][record],
+            )
+            for record in records
+        )
+
+    # the statistics of each affected station and of each line, regardless of its direction
+    station_stats = [
+        compute_disruption_stats(
+            get_stats_rows(
+                affected_records[affected_offsets[station] : affected_offsets[station + 1]]
+            )
+        )
+        for station in range(len(affected_stations.values))
+    ]
+
+    line_records = {}
+    for record, line in enumerate(columns["line"]):
+        line_key = get_line_key(get_line_stations(lines.values[line]))
+        line_records.setdefault(line_key, []).append(record)
+
+    line_stats = {
+        line_key: compute_disruption_stats(get_stats_rows(records))
+        for line_key, records in line_records.items()
+    }
+
+    string_tables = {
+        "stations": stations.values,
+        "affected_stations": affected_stations.values,
+        "station_codes": station_codes,
+        "causes": causes.values,
+        "cause_groups": cause_groups.values,
+        "lines": lines.values,
+        "station_stats": station_stats,
+        "line_stats": line_stats,
+    }
+
+    return _serialize(len(columns["rdt_id"]), columns, string_tables)
+
+
+def _serialize(records_no, columns, string_tables):
+    """
+    Lays out the columns and the string tables after a header and a table of contents.
+
+    Parameters
+    ----------
+    records_no : int
+        The number of disruption records.
+    columns : dict of array
+        The integer columns and indexes of the store.
+    string_tables : dict of list or dict
+        The interned string tables and mappings of the store.
+
+    Returns
+    -------
+    bytes
+        The content of the binary store.
+    """
+
+    sections = []
+    for name, column in columns.items():
+        if sys.byteorder != "little":
+            column = array(column.typecode, column)
+            column.byteswap()
+        sections.append((name, column.typecode, len(column), column.tobytes()))
+
+    for name, values in string_tables.items():
+        sections.append((name, "json", len(values), json.dumps(values).encode("utf-8")))
+
+    # the section offsets are relative to the end of the table of contents
+    table_of_contents = {}
+    offset = 0
+    for name, typecode, length, content in sections:
+        table_of_contents[name] = {
+            "typecode": typecode,
+            "length": length,
+            "offset": offset,
+            "size": len(content),
+        }
+        offset = _align(offset + len(content))
+
+    toc_bytes = json.dumps({"records_no": records_no, "sections": table_of_contents}).encode(
+        "utf-8"
+    )
+    data_start = _align(HEADER.size + len(toc_bytes))
+
+    buffer = bytearray(data_start + offset)
+    HEADER.pack_into(buffer, 0, MAGIC, VERSION, len(toc_bytes))
+    buffer[HEADER.size : HEADER.size + len(toc_bytes)] = toc_bytes
+
+    for name, _, _, content in sections:
+        section_start = data_start + table_of_contents[name]["offset"]
+        buffer[section_start : section_start + len(content)] = content
+
+    return bytes(buffer)
+
+
+def _align(offset):
+    """Rounds an offset up to the alignment of the store sections."""
+
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_store(csv_path, store_path):
+    """
+    Compiles a disruptions CSV file into a binary store file.
+
+    Parameters
+    ----------
+    csv_path : str
+        The path of the disruptions CSV file.
+    store_path : str
+        The path where the binary store is written.
+
+    Returns
+    -------
+    str
+        The SHA-256 hash of the written store.
+    """
+
+    with open(csv_path, newline="", encoding="utf-8") as csv_file:
+        content = compile_disruptions(csv_file)
+
+    with open(store_path, "wb") as store_file:
+        store_file.write(content)
+
+    return hashlib.sha256(content).hexdigest()
+
+
+class DisruptionsStore:
+    """
+    A read-only view over a binary disruptions store. The columns are exposed as typed
+    memory views, so a record is decoded only when it is part of a query result.
+    """
+
+    def __init__(self, buffer, mapped_file=None):
+        """
+        Initialize the DisruptionsStore instance.
+
+        Parameters
+        ----------
+        buffer : bytes or mmap.mmap
+            The content of the binary store.
+        mapped_file : file object, optional
+            The file backing the memory map, closed together with the store (default is None).
+        """
+
+        self._buffer = buffer
+        self._mapped_file = mapped_file
+        self._view = memoryview(buffer)
+
+        magic, version, toc_size = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("The file is not a supported disruptions store.")
+
+        table_of_contents = json.loads(bytes(self._view[HEADER.size : HEADER.size + toc_size]))
+        self._data_start = _align(HEADER.size + toc_size)
+        self.records_no = table_of_contents["records_no"]
+        self._sections = table_of_contents["sections"]
+        self._columns = {}
+
+        self.stations = self.string_table("stations")
+        self.causes = self.string_table("causes")
+        self.lines = self.string_table("lines")
+        self.cause_groups = self.string_table("cause_groups")
+        # the statistics are decoded only when they are first requested
+        self._station_stats = None
+        self._line_stats = None
+        self.station_identifiers = {station: index for index, station in enumerate(self.stations)}
+        self.affected_stations = self.string_table("affected_stations")
+        self.station_codes = self.string_table("station_codes")
+        self.affected_identifiers = {
+            station: index for index, station in enumerate(self.affected_stations)
+        }
+
+    @classmethod
+    def open(cls, store_path):
+        """
+        Memory-maps a binary store file.
+
+        Parameters
+        ----------
+        store_path : str
+            The path of the binary store.
+
+        Returns
+        -------
+        DisruptionsStore
+            The store backed by the memory-mapped file.
+        """
+
+        store_file = open(store_path, "rb")
+        try:
+            mapped_store = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            store_file.close()
+            raise
+
+        return cls(mapped_store, store_file)
+
+    @classmethod
+    def from_csv(cls, csv_path):
+        """
+        Compiles a disruptions CSV file into an in-memory store.
+
+        Parameters
+        ----------
+        csv_path : str
+            The path of the disruptions CSV file.
+
+        Returns
+        -------
+        DisruptionsStore
+            The store backed by an in-memory buffer.
+        """
+
+        with open(csv_path, newline="", encoding="utf-8") as csv_file:
+            return cls(compile_disruptions(csv_file))
+
+    def close(self):
+        """Releases the views and the memory map of the store."""
+
+        for column in self._columns.values():
+            column.release()
+        self._columns = {}
+        self._view.release()
+
+        if self._mapped_file is not None:
+            try:
+                self._buffer.close()
+            except BufferError:
+                # views handed out by queries are still alive, so the map is released with them
+                pass
+            self._mapped_file.close()
+            self._mapped_file = None
+
+    def has_section(self, name):
+        """Returns whether the store contains a section with the given name."""
+
+        return name in self._sections
+
+    def column(self, name):
+        """
+        Returns an integer column or index of the store.
+
+        Parameters
+        ----------
+        name : str
+            The name of the section.
+
+        Returns
+        -------
+        memoryview
+            A typed view over the section, without copying it.
+        """
+
+        column = self._columns.get(name)
+
+        if column is None:
+            section = self._sections[name]
+            start = self._data_start + section["offset"]
+            column = self._view[start : start + section["size"]].cast(section["typecode"])
+            self._columns[name] = column
+
+        return column
+
+    def string_table(self, name):
+        """
+        Decodes an interned string table of the store.
+
+        Parameters
+        ----------
+        name : str
+            The name of the section.
+
+        Returns
+        -------
+        list of str
+            The strings, indexed by their identifier.
+        """
+
+        section = self._sections[name]
+        start = self._data_start + section["offset"]
+
+        return json.loads(bytes(self._view[start : start + section["size"]]))
+
+    def contains_rdt_id(self, rdt_id):
+        """
+        Checks whether the store contains a disruption, by binary search.
+
+        Parameters
+        ----------
+        rdt_id : int
+            The identifier of the disruption in the source data.
+
+        Returns
+        -------
+        bool
+            Whether the disruption is part of the store.
+        """
+
+        sorted_rdt_ids = self.column("sorted_rdt_ids")
+        position = bisect.bisect_left(sorted_rdt_ids, rdt_id)
+
+        return position < len(sorted_rdt_ids) and sorted_rdt_ids[position] == rdt_id
+
+    def get_stats_rows(self, records):
+        """
+        Yields the fields of the records needed by `compute_disruption_stats`.
+
+        Parameters
+        ----------
+        records : iterable of int
+            The identifiers of the records.
+
+        Yields
+        ------
+        tuple
+            The cause, cause group, start time and duration in minutes of each record.
+        """
+
+        cause_column = self.column("cause")
+        cause_group_column = self.column("cause_group")
+        start_time_column = self.column("start_time")
+        duration_column = self.column("duration_minutes")
+
+        for record in records:
+            yield (
+                self.causes[cause_column[record]],
+                self.cause_groups[cause_group_column[record]],
+                start_time_column[record],
+                duration_column[record],
+            )
+
+    def iter_rows(self):
+        """
+        Rebuilds the rows of all records in the format of the disruptions CSV file, which is
+        needed to compile several stores into one. The affected stations of a record include
+        the stations named by its line.
+
+        Yields
+        ------
+        dict
+            The columns of each record used by `compile_rows`.
+        """
+
+        affected_offsets = self.column("affected_offsets")
+        affected_records = self.column("affected_records")
+        station_codes = {station_name: code for code, station_name in self.station_codes.items()}
+
+        record_stations = [[] for _ in range(self.records_no)]
+        for station, station_name in enumerate(self.affected_stations):
+            for record in affected_records[affected_offsets[station] : affected_offsets[station + 1]]:
+                record_stations[record].append(station_name)
+
+        line_column = self.column("line")
+        cause_column = self.column("cause")
+        cause_group_column = self.column("cause_group")
+        start_time_column = self.column("start_time")
+        end_time_column = self.column("end_time")
+        duration_column = self.column("duration_minutes")
+
+        for record in range(self.records_no):
+            duration = duration_column[record]
+
+            yield {
+                "rdt_id": str(self.column("rdt_id")[record]),
+                "ns_lines": self.lines[line_column[record]],
+                "rdt_station_names": ",".join(record_stations[record]),
+                "rdt_station_codes": ",".join(
+                    station_codes.get(station_name, "") for station_name in record_stations[record]
+                ),
+                "statistical_cause_en": self.causes[cause_column[record]],
+                "cause_group": self.cause_groups[cause_group_column[record]],
+                "start_time": format_time(start_time_column[record]),
+                "end_time": format_time(end_time_column[record]),
+                "duration_minutes": "" if duration == MISSING else str(duration),
+            }
+
+    def get_station_stats(self, station_name):
+        """
+        Returns the precomputed disruption statistics of a station.
+
+        Parameters
+        ----------
+        station_name : str
+            The exact name or code of the station.
+
+        Returns
+        -------
+        dict or None
+            The statistics of the station, or None if the station is unknown.
+        """
+
+        station = self._resolve_station_identifier(station_name)
+        if station is None:
+            return None
+
+        if self._station_stats is None:
+            self._station_stats = self.string_table("station_stats")
+
+        return self._station_stats[station]
+
+    def get_line_stats(self, line_stations):
+        """
+        Returns the precomputed disruption statistics of a line.
+
+        Parameters
+        ----------
+        line_stations : list of str
+            The exact names of the stations of the line, in any order.
+
+        Returns
+        -------
+        dict or None
+            The statistics of the line, or None if there is no such line.
+        """
+
+        if self._line_stats is None:
+            self._line_stats = self.string_table("line_stats")
+
+        return self._line_stats.get(get_line_key(line_stations))
+
+    def records_from_station(self, station_name):
+        """
+        Returns the records of the disruptions which start from a station, in file order.
+
+        Parameters
+        ----------
+        station_name : str
+            The exact name of the start station.
+
+        Returns
+        -------
+        memoryview
+            The identifiers of the records, empty if the station has no disruptions.
+        """
+
+        station_records = self.column("station_records")
+        station = self.station_identifiers.get(station_name)
+
+        if station is None:
+            return station_records[0:0]
+
+        station_offsets = self.column("station_offsets")
+
+        return station_records[station_offsets[station] : station_offsets[station + 1]]
+
+    def _resolve_station_identifier(self, station_name):
+        """
+        Finds the identifier of the affected station with a given name or station code.
+
+        Parameters
+        ----------
+        station_name : str
+            The exact name of the station or its code, such as 'ASD'.
+
+        Returns
+        -------
+        int or None
+            The identifier of the affected station, or None if it is unknown.
+        """
+
+        station = self.affected_identifiers.get(station_name)
+
+        if station is None:
+            station_name = self.station_codes.get(station_name.strip().upper())
+            station = self.affected_identifiers.get(station_name)
+
+        return station
+
+    def resolve_station(self, station_name):
+        """
+        Finds the affected station with a given name or station code.
+
+        Parameters
+        ----------
+        station_name : str
+            The exact name of the station or its code, such as 'ASD'.
+
+        Returns
+        -------
+        str or None
+            The canonical name of the affected station, or None if it is unknown.
+        """
+
+        station = self._resolve_station_identifier(station_name)
+
+        return None if station is None else self.affected_stations[station]
+
+    def records_at_station(self, station_name):
+        """
+        Returns the records of the disruptions which affect a station anywhere on their line.
+
+        Parameters
+        ----------
+        station_name : str
+            The exact name of the station or its code.
+
+        Returns
+        -------
+        memoryview
+            The sorted identifiers of the records, empty if the station is not affected.
+        """
+
+        affected_records = self.column("affected_records")
+        station = self._resolve_station_identifier(station_name)
+
+        if station is None:
+            return affected_records[0:0]
+
+        affected_offsets = self.column("affected_offsets")
+
+        return affected_records[affected_offsets[station] : affected_offsets[station + 1]]
+
+    def records_on_route(self, first_station_name, second_station_name):
+        """
+        Returns the records of the disruptions which affect both stations of a route, by
+        intersecting their postings.
+
+        Parameters
+        ----------
+        first_station_name, second_station_name : str
+            The exact names or codes of the stations.
+
+        Returns
+        -------
+        list of int
+            The sorted identifiers of the records.
+        """
+
+        shorter_postings = self.records_at_station(first_station_name)
+        longer_postings = self.records_at_station(second_station_name)
+
+        if len(shorter_postings) > len(longer_postings):
+            shorter_postings, longer_postings = longer_postings, shorter_postings
+
+        # each record of the shorter postings is searched for in the longer ones
+        records = []
+        position = 0
+        for record in shorter_postings:
+            position = bisect.bisect_left(longer_postings, record, position)
+            if position == len(longer_postings):
+                break
+            if longer_postings[position] == record:
+                records.append(record)
+
+        return records
+
+    def records_in_window(self, window_start, window_end, station_name=None):
+        """
+        Returns the records of the disruptions which overlap a time window, in logarithmic
+        time plus the number of inspected candidates.
+
+        Parameters
+        ----------
+        window_start : int
+            The start of the window, in wall-clock seconds since the epoch.
+        window_end : int
+            The end of the window, equal to the start for a point-in-time query.
+        station_name : str, optional
+            The exact name or code of an affected station, if the search is limited to the
+            disruptions of one station (default is None).
+
+        Returns
+        -------
+        list of int
+            The identifiers of the records, sorted by start time.
+        """
+
+        if station_name is None:
+            prefix = "interval_"
+            lo, hi = 0, self.records_no
+        else:
+            station = self._resolve_station_identifier(station_name)
+            if station is None:
+                return []
+
+            prefix = "affected_interval_"
+            affected_offsets = self.column("affected_offsets")
+            lo, hi = affected_offsets[station], affected_offsets[station + 1]
+
+        start_times = self.column("start_time")
+        end_times = self.column("end_time")
+        candidates = _search_interval_index(
+            self.column(f"{prefix}records"),
+            self.column(f"{prefix}start_times"),
+            self.column(f"{prefix}max_end_times"),
+            lo,
+            hi,
+            (window_start, window_end),
+        )
+
+        return [
+            record
+            for record in candidates
+            if (start_times[record] if end_times[record] == MISSING else end_times[record])
+            >= window_start
+        ]
+
+    def record(self, record):
+        """
+        Decodes a single disruption record.
+
+        Parameters
+        ----------
+        record : int
+            The identifier of the record.
+
+        Returns
+        -------
+        dict
+            The decoded fields of the record.
+        """
+
+        start_station = self.column("start_station")[record]
+        destination_station = self.column("destination_station")[record]
+        duration = self.column("duration_minutes")[record]
+
+        return {
+            "rdt_id": self.column("rdt_id")[record],
+            "line": self.lines[self.column("line")[record]],
+            "start_station": None if start_station == MISSING else self.stations[start_station],
+            "destination_station": (
+                None if destination_station == MISSING else self.stations[destination_station]
+            ),
+            "cause": self.causes[self.column("cause")[record]],
+            "start_time": format_time(self.column("start_time")[record]),
+            "end_time": format_time(self.column("end_time")[record]),
+            "duration_minutes": None if duration == MISSING else duration,
+        }
+
+
+if __name__ == "__main__":
+    store_hash = write_store("./ns_trains_disruptions_2024.csv", "./ns_trains_disruptions_2024.nsds")
+    print(f"The disruptions store was compiled with the hash {store_hash}.")
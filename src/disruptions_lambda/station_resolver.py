@@ -0,0 +1,273 @@
+"""
+This module resolves the station names passed by the agent, which can differ in case, accents,
+spelling or be common aliases such as 'Den Bosch', to the canonical names of the disruptions
+store. It uses a precomputed character trigram index to find candidates and verifies them with
+a bounded edit distance.
+"""
+
+import re
+import time
+import heapq
+import unicodedata
+from collections import defaultdict
+
+# aliases used by passengers, mapped to the canonical name of the station
+STATION_ALIASES = {
+    "den bosch": "'s-Hertogenbosch",
+    "s hertogenbosch": "'s-Hertogenbosch",
+    "hertogenbosch": "'s-Hertogenbosch",
+    "the hague": "Den Haag",
+    "hague": "Den Haag",
+    "the hague central": "Den Haag Centraal",
+    "the hague hs": "Den Haag HS",
+    "schiphol": "Schiphol Airport",
+    "amsterdam airport": "Schiphol Airport",
+    "amsterdam central": "Amsterdam Centraal",
+    "rotterdam central": "Rotterdam Centraal",
+    "utrecht central": "Utrecht Centraal",
+    "cologne": "Köln",
+    "brussels": "Brussel",
+    "antwerp": "Antwerpen",
+    "liege": "Liège / Luik",
+}
+# words which do not help to identify a station
+IGNORED_WORDS = frozenset(("station", "train", "railway", "ns"))
+NON_ALPHANUMERIC = re.compile(r"[^0-9a-z]+")
+# one edit is allowed for every 5 characters, so short names such as codes only match exactly
+MAX_EDIT_DISTANCE = 3
+CHARACTERS_PER_EDIT = 5
+MAX_VERIFIED_CANDIDATES = 20
+
+
+def normalize_station_name(station_name, remove_ignored_words=True):
+    """
+    Normalizes a station name by removing accents, case, punctuation and ignored words.
+
+    Parameters
+    ----------
+    station_name : str
+        The station name to normalize.
+    remove_ignored_words : bool, optional
+        Whether words such as 'station' are removed, which is not done for station codes,
+        since the code 'NS' of Nunspeet is also an ignored word (default is True).
+
+    Returns
+    -------
+    str
+        The normalized station name, such as 's hertogenbosch' for "'s-Hertogenbosch".
+    """
+
+    decomposed_name = unicodedata.normalize("NFKD", station_name)
+    ascii_name = "".join(
+        character for character in decomposed_name if not unicodedata.combining(character)
+    )
+    words = NON_ALPHANUMERIC.sub(" ", ascii_name.casefold()).split()
+
+    if not remove_ignored_words:
+        return " ".join(words)
+
+    return " ".join(word for word in words if word not in IGNORED_WORDS)
+
+
+def get_trigrams(normalized_name):
+    """
+    Splits a normalized name into its character trigrams, padded at both ends.
+
+    Parameters
+    ----------
+    normalized_name : str
+        The normalized station name.
+
+    Returns
+    -------
+    set of str
+        The trigrams of the name.
+    """
+
+    padded_name = f"  {normalized_name} "
+
+    return {padded_name[index : index + 3] for index in range(len(padded_name) - 2)}
+
+
+def bounded_edit_distance(first, second, max_distance):
+    """
+    Computes the Levenshtein distance between two strings, stopping as soon as it exceeds
+    a bound.
+
+    Parameters
+    ----------
+    first, second : str
+        The strings to compare.
+    max_distance : int
+        The largest distance of interest.
+
+    Returns
+    -------
+    int
+        The edit distance, or `max_distance` + 1 if it is larger than the bound.
+    """
+
+    if abs(len(first) - len(second)) > max_distance:
+        return max_distance + 1
+
+    # only the cells at most `max_distance` away from the diagonal can stay within the bound
+    out_of_bound = max_distance + 1
+    previous_row = [
+        column if column <= max_distance else out_of_bound for column in range(len(second) + 1)
+    ]
+
+    for row, first_character in enumerate(first, start=1):
+        first_column = max(1, row - max_distance)
+        last_column = min(len(second), row + max_distance)
+        current_row = [out_of_bound] * (len(second) + 1)
+        current_row[0] = row if row <= max_distance else out_of_bound
+
+        for column in range(first_column, last_column + 1):
+            current_row[column] = min(
+                previous_row[column] + 1,
+                current_row[column - 1] + 1,
+                previous_row[column - 1] + (first_character != second[column - 1]),
+                out_of_bound,
+            )
+
+        # the distance can only grow from the smallest value of the row
+        if min(current_row[first_column - 1 : last_column + 1]) > max_distance:
+            return out_of_bound
+
+        previous_row = current_row
+
+    return previous_row[-1]
+
+
+class StationResolver:
+    """
+    Resolves station names, station codes and aliases to canonical station names.
+    """
+
+    def __init__(self, station_names, station_codes=None, aliases=None):
+        """
+        Initialize the StationResolver instance and build its indexes.
+
+        Parameters
+        ----------
+        station_names : iterable of str
+            The canonical station names.
+        station_codes : dict of str, optional
+            The station codes mapped to canonical station names (default is None).
+        aliases : dict of str, optional
+            Additional names mapped to canonical station names, which defaults to
+            `STATION_ALIASES` (default is None).
+        """
+
+        self.exact_names = {}
+        self.candidate_names = []
+        self.candidate_trigrams_no = []
+        self.trigram_index = defaultdict(list)
+
+        station_names = list(station_names)
+        known_names = set(station_names)
+        aliases = STATION_ALIASES if aliases is None else aliases
+
+        # canonical names take precedence over aliases, which take precedence over codes
+        for station_name in station_names:
+            self._add_name(normalize_station_name(station_name), station_name)
+
+        for alias, station_name in aliases.items():
+            if station_name in known_names:
+                self._add_name(normalize_station_name(alias), station_name)
+
+        for code, station_name in (station_codes or {}).items():
+            normalized_code = normalize_station_name(code, remove_ignored_words=False)
+            if normalized_code != "":
+                self.exact_names.setdefault(normalized_code, station_name)
+
+        for candidate, (normalized_name, _) in enumerate(self.candidate_names):
+            candidate_trigrams = get_trigrams(normalized_name)
+            self.candidate_trigrams_no.append(len(candidate_trigrams))
+
+            for trigram in candidate_trigrams:
+                self.trigram_index[trigram].append(candidate)
+
+    def _add_name(self, normalized_name, station_name):
+        """Registers a normalized name as an exact match and as a fuzzy candidate."""
+
+        if normalized_name == "" or normalized_name in self.exact_names:
+            return
+
+        self.exact_names[normalized_name] = station_name
+        self.candidate_names.append((normalized_name, station_name))
+
+    def resolve(self, station_name, time_budget=0.005):
+        """
+        Finds the canonical station which best matches a name.
+
+        Parameters
+        ----------
+        station_name : str
+            The station name, station code or alias to resolve.
+        time_budget : float, optional
+            The maximum number of seconds spent verifying candidates (default is 0.005).
+
+        Returns
+        -------
+        str or None
+            The canonical station name, or None if no station is close enough.
+        """
+
+        if station_name.strip() == "":
+            return None
+
+        normalized_name = normalize_station_name(station_name)
+        exact_match = self.exact_names.get(normalized_name)
+
+        # a code such as 'NS' consists only of ignored words, so it is looked up as it is
+        if exact_match is None:
+            exact_match = self.exact_names.get(
+                normalize_station_name(station_name, remove_ignored_words=False)
+            )
+
+        if exact_match is not None or len(normalized_name) == 0:
+            return exact_match
+
+        max_distance = min(MAX_EDIT_DISTANCE, len(normalized_name) // CHARACTERS_PER_EDIT)
+        if max_distance == 0:
+            return None
+
+        # count the shared trigrams of every candidate
+        trigrams = get_trigrams(normalized_name)
+        shared_trigrams = defaultdict(int)
+        for trigram in trigrams:
+            for candidate in self.trigram_index.get(trigram, ()):
+                shared_trigrams[candidate] += 1
+
+        # verify the candidates with the highest Dice coefficient first
+        ranked_candidates = heapq.nlargest(
+            MAX_VERIFIED_CANDIDATES,
+            shared_trigrams,
+            key=lambda candidate: 2
+            * shared_trigrams[candidate]
+            / (len(trigrams) + self.candidate_trigrams_no[candidate]),
+        )
+
+        deadline = time.perf_counter() + time_budget
+        best_match = None
+        best_distance = max_distance + 1
+
+        for candidate in ranked_candidates:
+            # every edit changes at most 3 trigrams, which bounds the distance from below
+            max_trigrams_no = max(len(trigrams), self.candidate_trigrams_no[candidate])
+            if shared_trigrams[candidate] < max_trigrams_no - 3 * (best_distance - 1):
+                continue
+
+            candidate_name, canonical_name = self.candidate_names[candidate]
+            distance = bounded_edit_distance(normalized_name, candidate_name, best_distance - 1)
+
+            if distance < best_distance:
+                best_match, best_distance = canonical_name, distance
+                if distance == 1:
+                    break
+
+            if time.perf_counter() > deadline:
+                break
+
+        return best_match
@@ -0,0 +1,381 @@
+"""
+This module ingests the PDF documents of the knowledge base into chunks with their document name
+and page number. The pages are extracted in parallel by a pool of processes, in small ranges of
+pages, and are chunked as they arrive, so a document is never held in memory as a whole. The
+chunks of every document are written to their own JSON Lines file, and a manifest records the
+content hash of every document, so a re-run only extracts the documents which were added or
+modified. The chunks can then be embedded into the local index of `retrievers` and indexed by
+the BM25 index of `lexical_index`.
+"""
+
+import os
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from pypdf import PdfReader
+
+from retrievers import build_local_index, create_embedder
+from lexical_index import build_lexical_index
+from config import (
+    DOCUMENTS_PATH,
+    CHUNKS_PATH,
+    CHUNK_WORDS,
+    CHUNK_OVERLAP_WORDS,
+    INGESTION_PAGES_PER_TASK,
+    INGESTION_WORKERS_NO,
+    LOCAL_INDEX_PATH,
+    LOCAL_INDEX_EMBEDDER,
+    LOCAL_INDEX_QUANTIZE,
+    LEXICAL_INDEX_PATH,
+)
+
+MANIFEST_FILE = "manifest.json"
+# the version of the extraction and chunking, which reprocesses all documents when it changes
+INGESTION_VERSION = 1
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def compute_file_hash(file_path):
+    """
+    Computes the SHA-256 hash of the content of a file, read in blocks.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the file.
+
+    Returns
+    -------
+    str
+        The hexadecimal hash.
+    """
+
+    file_hash = hashlib.sha256()
+
+    with open(file_path, "rb") as input_file:
+        for block in iter(lambda: input_file.read(HASH_BLOCK_SIZE), b""):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+def extract_pages(file_path, first_page, last_page):
+    """
+    Extracts the text of a range of pages of a PDF document. It runs in a worker process.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the PDF document.
+    first_page : int
+        The index of the first page, starting at 0.
+    last_page : int
+        The index after the last page.
+
+    Returns
+    -------
+    list of tuple
+        The page number, starting at 1, and the text of every page.
+    """
+
+    reader = PdfReader(file_path)
+
+    return [
+        (page_index + 1, reader.pages[page_index].extract_text() or "")
+        for page_index in range(first_page, last_page)
+    ]
+
+
+def chunk_pages(pages, chunk_words=CHUNK_WORDS, overlap_words=CHUNK_OVERLAP_WORDS):
+    """
+    Splits the words of a stream of pages into overlapping chunks. Every chunk keeps the page
+    of its first word and the page of its last word.
+
+    Parameters
+    ----------
+    pages : iterable of tuple
+        The page number and the text of every page, in order.
+    chunk_words : int, optional
+        The number of words of a chunk (default is `CHUNK_WORDS`).
+    overlap_words : int, optional
+        The number of words shared by consecutive chunks (default is `CHUNK_OVERLAP_WORDS`).
+
+    Yields
+    ------
+    dict
+        The 'page_number', 'last_page_number' and 'content' of every chunk.
+    """
+
+    stride = chunk_words - overlap_words
+    # the pending words, with the page number of each of them
+    words = []
+    page_numbers = []
+    # whether the pending words contain words which are not in a chunk yet
+    has_new_words = False
+
+    for page_number, text in pages:
+        page_words = text.split()
+        words.extend(page_words)
+        page_numbers.extend([page_number] * len(page_words))
+        has_new_words = has_new_words or len(page_words) != 0
+
+        while len(words) >= chunk_words:
+            yield {
+                "page_number": page_numbers[0],
+                "last_page_number": page_numbers[chunk_words - 1],
+                "content": " ".join(words[:chunk_words]),
+            }
+
+            del words[:stride]
+            del page_numbers[:stride]
+            has_new_words = len(words) > overlap_words
+
+    if has_new_words:
+        yield {
+            "page_number": page_numbers[0],
+            "last_page_number": page_numbers[-1],
+            "content": " ".join(words),
+        }
+
+
+def ingest_document(file_path, chunks_file_path, executor):
+    """
+    Extracts and chunks a PDF document, whose ranges of pages are extracted in parallel and
+    chunked in order as soon as they are extracted.
+
+    Parameters
+    ----------
+    file_path : str
+        The path of the PDF document.
+    chunks_file_path : str
+        The path of the JSON Lines file of the chunks.
+    executor : concurrent.futures.Executor
+        The pool of processes which extract the pages.
+
+    Returns
+    -------
+    tuple
+        The number of pages and the number of chunks of the document.
+    """
+
+    document_name = os.path.splitext(os.path.basename(file_path))[0]
+    pages_no = len(PdfReader(file_path).pages)
+
+    # the futures are consumed in order, so a range is chunked while the next ones are extracted
+    futures = [
+        executor.submit(
+            extract_pages,
+            file_path,
+            first_page,
+            min(first_page + INGESTION_PAGES_PER_TASK, pages_no),
+        )
+        for first_page in range(0, pages_no, INGESTION_PAGES_PER_TASK)
+    ]
+
+    def iterate_pages():
+        for future in futures:
+            yield from future.result()
+
+    chunks_no = 0
+    temporary_path = f"{chunks_file_path}.tmp"
+
+    with open(temporary_path, "w", encoding="utf-8") as chunks_file:
+        for chunk in chunk_pages(iterate_pages()):
+            chunks_file.write(json.dumps({"document_name": document_name, **chunk}) + "\n")
+            chunks_no += 1
+
+    os.replace(temporary_path, chunks_file_path)
+
+    return pages_no, chunks_no
+
+
+def load_manifest(chunks_path):
+    """
+    Loads the manifest of the ingested documents.
+
+    Parameters
+    ----------
+    chunks_path : str
+        The directory of the chunks.
+
+    Returns
+    -------
+    dict
+        The hash, number of pages and number of chunks of every document by its file name,
+        which is empty if the manifest does not exist or was written by another version.
+    """
+
+    try:
+        with open(os.path.join(chunks_path, MANIFEST_FILE), encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+
+    if manifest.get("version") != INGESTION_VERSION:
+        return {}
+
+    return manifest["documents"]
+
+
+def ingest_documents(
+    documents_path=DOCUMENTS_PATH, chunks_path=CHUNKS_PATH, workers_no=INGESTION_WORKERS_NO
+):
+    """
+    Ingests the PDF documents of a directory whose content changed since the last run, and
+    removes the chunks of the documents which no longer exist.
+
+    Parameters
+    ----------
+    documents_path : str, optional
+        The directory of the PDF documents (default is `DOCUMENTS_PATH`).
+    chunks_path : str, optional
+        The directory of the chunks and of the manifest (default is `CHUNKS_PATH`).
+    workers_no : int, optional
+        The number of worker processes (default is `INGESTION_WORKERS_NO`).
+
+    Returns
+    -------
+    dict
+        The statistics of the run, including the extracted pages per second.
+    """
+
+    os.makedirs(chunks_path, exist_ok=True)
+    previous_manifest = load_manifest(chunks_path)
+    manifest = {}
+    statistics = {"ingested_documents": 0, "skipped_documents": 0, "pages": 0, "chunks": 0}
+
+    file_names = sorted(
+        file_name for file_name in os.listdir(documents_path) if file_name.lower().endswith(".pdf")
+    )
+    start_time = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers_no) as executor:
+        for file_name in file_names:
+            file_path = os.path.join(documents_path, file_name)
+            chunks_file_path = os.path.join(chunks_path, f"{os.path.splitext(file_name)[0]}.jsonl")
+            file_hash = compute_file_hash(file_path)
+            previous_entry = previous_manifest.get(file_name)
+
+            if (
+                previous_entry is not None
+                and previous_entry["hash"] == file_hash
+                and os.path.exists(chunks_file_path)
+            ):
+                manifest[file_name] = previous_entry
+                statistics["skipped_documents"] += 1
+                continue
+
+            pages_no, chunks_no = ingest_document(file_path, chunks_file_path, executor)
+            manifest[file_name] = {"hash": file_hash, "pages": pages_no, "chunks": chunks_no}
+
+            statistics["ingested_documents"] += 1
+            statistics["pages"] += pages_no
+            statistics["chunks"] += chunks_no
+
+    duration = time.perf_counter() - start_time
+
+    # remove the chunks of the deleted documents
+    for file_name in previous_manifest.keys() - manifest.keys():
+        chunks_file_path = os.path.join(chunks_path, f"{os.path.splitext(file_name)[0]}.jsonl")
+        if os.path.exists(chunks_file_path):
+            os.remove(chunks_file_path)
+
+    temporary_path = os.path.join(chunks_path, f"{MANIFEST_FILE}.tmp")
+    with open(temporary_path, "w", encoding="utf-8") as manifest_file:
+        json.dump({"version": INGESTION_VERSION, "documents": manifest}, manifest_file, indent=4)
+    os.replace(temporary_path, os.path.join(chunks_path, MANIFEST_FILE))
+
+    statistics["duration_s"] = round(duration, 3)
+    statistics["pages_per_second"] = round(statistics["pages"] / duration, 1) if duration else 0.0
+
+    return statistics
+
+
+def load_chunks(chunks_path=CHUNKS_PATH):
+    """
+    Loads the chunks of all ingested documents, in the order of the manifest.
+
+    Parameters
+    ----------
+    chunks_path : str, optional
+        The directory of the chunks and of the manifest (default is `CHUNKS_PATH`).
+
+    Returns
+    -------
+    list of dict
+        The chunks with their 'document_name', 'page_number' and 'content'.
+    """
+
+    chunks = []
+
+    for file_name in load_manifest(chunks_path):
+        chunks_file_path = os.path.join(chunks_path, f"{os.path.splitext(file_name)[0]}.jsonl")
+
+        with open(chunks_file_path, encoding="utf-8") as chunks_file:
+            chunks.extend(json.loads(line) for line in chunks_file)
+
+    return chunks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents-path", default=DOCUMENTS_PATH, help="directory of the PDFs")
+    parser.add_argument("--chunks-path", default=CHUNKS_PATH, help="directory of the chunks")
+    parser.add_argument(
+        "--workers", type=int, default=INGESTION_WORKERS_NO, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--build-index",
+        action="store_true",
+        help="embed the chunks into the local index and build their BM25 index",
+    )
+    parser.add_argument("--index-path", default=LOCAL_INDEX_PATH, help="directory of the index")
+    parser.add_argument(
+        "--lexical-index-path", default=LEXICAL_INDEX_PATH, help="directory of the BM25 index"
+    )
+    parser.add_argument(
+        "--embedder",
+        choices=["bedrock", "hashing"],
+        default=LOCAL_INDEX_EMBEDDER,
+        help="embedder of the local index",
+    )
+    parser.add_argument(
+        "--quantize",
+        action=argparse.BooleanOptionalAction,
+        default=LOCAL_INDEX_QUANTIZE,
+        help="store the embeddings of the local index as int8",
+    )
+    arguments = parser.parse_args()
+
+    ingestion_statistics = ingest_documents(
+        arguments.documents_path, arguments.chunks_path, arguments.workers
+    )
+    print(
+        f"Ingested {ingestion_statistics['ingested_documents']} documents "
+        f"({ingestion_statistics['skipped_documents']} unchanged) into "
+        f"{ingestion_statistics['chunks']} chunks: {ingestion_statistics['pages']} pages in "
+        f"{ingestion_statistics['duration_s']} s, "
+        f"{ingestion_statistics['pages_per_second']} pages/s."
+    )
+
+    if arguments.build_index:
+        chunks = load_chunks(arguments.chunks_path)
+        lexical_index_metadata = build_lexical_index(chunks, arguments.lexical_index_path)
+        print(
+            f"The BM25 index of {len(lexical_index_metadata['terms'])} terms was built at "
+            f"{arguments.lexical_index_path}."
+        )
+
+        index_metadata = build_local_index(
+            chunks,
+            create_embedder(arguments.embedder),
+            arguments.index_path,
+            arguments.quantize,
+        )
+        print(
+            f"The local index of {index_metadata['chunks_no']} chunks was built at "
+            f"{arguments.index_path}."
+        )
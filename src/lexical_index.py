@@ -0,0 +1,413 @@
+"""
+This module provides the BM25 index of the document chunks, which finds the chunks containing
+the exact terms of a query, such as 'OV-chipkaart', 'Keuzedagen' or '7.50', that a vector
+search may miss. The inverted index is stored in a few files: the postings of every term are
+compressed as varints of the gaps between chunk ids, and the IDF of every term and the length
+normalization of every chunk are precomputed, so the index loads in a few milliseconds and a
+query only decodes and scores the postings of its own terms with NumPy.
+"""
+
+import os
+import re
+import json
+import math
+import threading
+from collections import Counter
+
+import numpy as np
+
+from caching import compute_directory_fingerprint
+from config import LEXICAL_INDEX_PATH, BM25_K1, BM25_B
+
+INDEX_METADATA_FILE = "index.json"
+IDF_FILE = "idf.npy"
+POSTINGS_FILE = "postings.bin"
+POSTINGS_OFFSETS_FILE = "postings_offsets.npy"
+LENGTH_NORMS_FILE = "length_norms.npy"
+CHUNKS_FILE = "chunks.jsonl"
+
+# numbers such as '7.50' or '7,50', and words, whose hyphenated compounds are kept whole
+TOKEN_PATTERN = re.compile(r"\d+(?:[.,]\d+)*|[^\W\d_]+(?:-[^\W\d_]+)*")
+STOP_WORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i if in is it its my of on or "
+    "the their there this to was what when where which who will with you your".split()
+)
+
+_lexical_indexes_lock = threading.Lock()
+# the loaded index of every directory, with the modification time of its metadata file
+_lexical_indexes = {}
+
+
+def tokenize(text):
+    """
+    Splits a text into its lowercase terms, without the stop words. Hyphenated compounds such
+    as 'ov-chipkaart' are kept along with their parts, and decimal commas are replaced with
+    points, so '€7,50' and '€ 7.50' both contain the term '7.50'.
+
+    Parameters
+    ----------
+    text : str
+        The text.
+
+    Returns
+    -------
+    list of str
+        The terms of the text.
+    """
+
+    terms = []
+
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token[0].isdigit():
+            terms.append(token.replace(",", "."))
+        elif token not in STOP_WORDS:
+            terms.append(token)
+
+            if "-" in token:
+                terms.extend(part for part in token.split("-") if part not in STOP_WORDS)
+
+    return terms
+
+
+def encode_varints(values):
+    """
+    Encodes non-negative integers as varints, with 7 bits per byte and the high bit set on all
+    bytes of an integer but its last one.
+
+    Parameters
+    ----------
+    values : iterable of int
+        The integers.
+
+    Returns
+    -------
+    bytearray
+        The encoded integers.
+    """
+
+    encoded_values = bytearray()
+
+    for value in values:
+        while value >= 0x80:
+            encoded_values.append((value & 0x7F) | 0x80)
+            value >>= 7
+        encoded_values.append(value)
+
+    return encoded_values
+
+
+def decode_varints(encoded_values):
+    """
+    Decodes varints with vectorized NumPy operations.
+
+    Parameters
+    ----------
+    encoded_values : numpy.ndarray
+        The uint8 bytes of the varints.
+
+    Returns
+    -------
+    numpy.ndarray
+        The int64 integers.
+    """
+
+    if len(encoded_values) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    end_positions = np.flatnonzero(encoded_values < 0x80)
+    start_positions = np.empty_like(end_positions)
+    start_positions[0] = 0
+    start_positions[1:] = end_positions[:-1] + 1
+
+    # the position of every byte within its varint gives the shift of its 7 bits
+    byte_positions = np.arange(len(encoded_values)) - np.repeat(
+        start_positions, end_positions - start_positions + 1
+    )
+    shifted_values = (encoded_values & 0x7F).astype(np.int64) << (7 * byte_positions)
+
+    return np.add.reduceat(shifted_values, start_positions)
+
+
+def _write_index_file(index_path, file_name, write_file):
+    """Writes a file of an index to a temporary path first, so it is replaced at once."""
+
+    temporary_path = os.path.join(index_path, f"tmp_{file_name}")
+    write_file(temporary_path)
+    os.replace(temporary_path, os.path.join(index_path, file_name))
+
+
+def build_lexical_index(chunks, index_path=LEXICAL_INDEX_PATH, k1=BM25_K1, b=BM25_B):
+    """
+    Builds the BM25 index of chunks. The metadata file is replaced last, so an index is never
+    loaded while it is partially written.
+
+    Parameters
+    ----------
+    chunks : list of dict
+        The chunks with their 'document_name', 'page_number' and 'content'.
+    index_path : str, optional
+        The directory of the index (default is `LEXICAL_INDEX_PATH`).
+    k1 : float, optional
+        The saturation of the term frequencies (default is `BM25_K1`).
+    b : float, optional
+        The strength of the chunk length normalization (default is `BM25_B`).
+
+    Returns
+    -------
+    dict
+        The metadata of the index.
+    """
+
+    os.makedirs(index_path, exist_ok=True)
+
+    chunk_lengths = []
+    # the chunk ids and term frequencies of every term, in increasing chunk id
+    term_postings = {}
+
+    for chunk_id, chunk in enumerate(chunks):
+        chunk_terms = tokenize(chunk["content"])
+        chunk_lengths.append(len(chunk_terms))
+
+        for term, term_frequency in Counter(chunk_terms).items():
+            term_postings.setdefault(term, []).append((chunk_id, term_frequency))
+
+    chunks_no = len(chunks)
+    average_length = sum(chunk_lengths) / chunks_no if chunks_no != 0 else 0.0
+    terms = sorted(term_postings)
+
+    postings = bytearray()
+    postings_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    idf = np.empty(len(terms), dtype=np.float32)
+
+    for term_index, term in enumerate(terms):
+        previous_chunk_id = 0
+
+        for chunk_id, term_frequency in term_postings[term]:
+            postings += encode_varints((chunk_id - previous_chunk_id, term_frequency))
+            previous_chunk_id = chunk_id
+
+        postings_offsets[term_index + 1] = len(postings)
+        documents_frequency = len(term_postings[term])
+        idf[term_index] = math.log(
+            1 + (chunks_no - documents_frequency + 0.5) / (documents_frequency + 0.5)
+        )
+
+    # the denominator of BM25 is the term frequency plus this norm of the chunk
+    length_norms = np.array(
+        [k1 * (1 - b + b * length / max(average_length, 1.0)) for length in chunk_lengths],
+        dtype=np.float32,
+    )
+
+    _write_index_file(index_path, IDF_FILE, lambda file_path: np.save(file_path, idf))
+    _write_index_file(
+        index_path, POSTINGS_OFFSETS_FILE, lambda file_path: np.save(file_path, postings_offsets)
+    )
+    _write_index_file(
+        index_path, LENGTH_NORMS_FILE, lambda file_path: np.save(file_path, length_norms)
+    )
+
+    def write_postings(file_path):
+        with open(file_path, "wb") as postings_file:
+            postings_file.write(postings)
+
+    def write_chunks(file_path):
+        with open(file_path, "w", encoding="utf-8") as chunks_file:
+            for chunk in chunks:
+                chunk_record = {
+                    "document_name": chunk["document_name"],
+                    "page_number": chunk["page_number"],
+                    "content": chunk["content"],
+                }
+                chunks_file.write(json.dumps(chunk_record, ensure_ascii=False) + "\n")
+
+    _write_index_file(index_path, POSTINGS_FILE, write_postings)
+    _write_index_file(index_path, CHUNKS_FILE, write_chunks)
+
+    metadata = {
+        "k1": k1,
+        "b": b,
+        "chunks_no": chunks_no,
+        "average_length": average_length,
+        "terms": terms,
+        # the previous metadata file is not replaced yet, so it is not part of the fingerprint
+        "fingerprint": compute_directory_fingerprint(index_path, (INDEX_METADATA_FILE,)),
+    }
+
+    def write_metadata(file_path):
+        with open(file_path, "w", encoding="utf-8") as index_file:
+            json.dump(metadata, index_file, ensure_ascii=False)
+
+    _write_index_file(index_path, INDEX_METADATA_FILE, write_metadata)
+
+    return metadata
+
+
+class LexicalIndex:
+    """
+    A BM25 index of the chunks, which is used as a retriever. The postings are memory-mapped and
+    only the postings of the terms of a query are decoded.
+    """
+
+    def __init__(self, index_path=LEXICAL_INDEX_PATH):
+        """
+        Initialize the LexicalIndex instance.
+
+        Parameters
+        ----------
+        index_path : str, optional
+            The directory of the index, written by `build_lexical_index`
+            (default is `LEXICAL_INDEX_PATH`).
+        """
+
+        with open(os.path.join(index_path, INDEX_METADATA_FILE), encoding="utf-8") as index_file:
+            self.metadata = json.load(index_file)
+
+        self.term_indexes = {term: index for index, term in enumerate(self.metadata["terms"])}
+        self.k1 = self.metadata["k1"]
+        self.idf = np.load(os.path.join(index_path, IDF_FILE))
+        self.postings_offsets = np.load(os.path.join(index_path, POSTINGS_OFFSETS_FILE))
+        self.length_norms = np.load(os.path.join(index_path, LENGTH_NORMS_FILE))
+        self.postings = (
+            np.memmap(os.path.join(index_path, POSTINGS_FILE), dtype=np.uint8, mode="r")
+            if self.postings_offsets[-1] != 0
+            else np.empty(0, dtype=np.uint8)
+        )
+
+        with open(os.path.join(index_path, CHUNKS_FILE), encoding="utf-8") as chunks_file:
+            self.chunks = [json.loads(line) for line in chunks_file]
+
+        # a rebuilt index has a new fingerprint, so the cached retrievals are not reused
+        self.cache_key = ("lexical", os.path.abspath(index_path), self.metadata["fingerprint"])
+
+    def get_postings(self, term_index):
+        """
+        Decodes the postings of a term.
+
+        Parameters
+        ----------
+        term_index : int
+            The index of the term.
+
+        Returns
+        -------
+        numpy.ndarray
+            The ids of the chunks which contain the term.
+        numpy.ndarray
+            The frequencies of the term in these chunks.
+        """
+
+        values = decode_varints(
+            self.postings[self.postings_offsets[term_index] : self.postings_offsets[term_index + 1]]
+        )
+
+        return np.cumsum(values[0::2]), values[1::2]
+
+    def search(self, query, documents_no):
+        """
+        Finds the chunks with the highest BM25 scores for a query.
+
+        Parameters
+        ----------
+        query : str
+            The query.
+        documents_no : int
+            The maximum number of chunks to find.
+
+        Returns
+        -------
+        numpy.ndarray
+            The indexes of the chunks which contain a term of the query, from the best one.
+        numpy.ndarray
+            Their BM25 scores.
+        """
+
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+
+        # a repeated term of the query counts once
+        for term in set(tokenize(query)):
+            term_index = self.term_indexes.get(term)
+
+            if term_index is None:
+                continue
+
+            chunk_ids, term_frequencies = self.get_postings(term_index)
+            scores[chunk_ids] += (
+                self.idf[term_index]
+                * term_frequencies
+                * (self.k1 + 1)
+                / (term_frequencies + self.length_norms[chunk_ids])
+            )
+
+        matching_indexes = np.flatnonzero(scores)
+        documents_no = min(documents_no, len(matching_indexes))
+
+        if documents_no == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        top_indexes = matching_indexes[
+            np.argpartition(-scores[matching_indexes], documents_no - 1)[:documents_no]
+        ]
+        top_indexes = top_indexes[np.argsort(-scores[top_indexes], kind="stable")]
+
+        return top_indexes, scores[top_indexes]
+
+    def retrieve(self, query, documents_no):
+        """
+        Retrieves the chunks with the highest BM25 scores for a query.
+
+        Parameters
+        ----------
+        query : str
+            The query.
+        documents_no : int
+            The maximum number of retrieved chunks.
+
+        Returns
+        -------
+        list of dict
+            The retrieved chunks with their 'document_name', 'page_number' and 'content'.
+        """
+
+        top_indexes, _ = self.search(query, documents_no)
+
+        return [
+            {
+                "document_name": self.chunks[chunk_index]["document_name"],
+                "page_number": self.chunks[chunk_index]["page_number"],
+                "content": self.chunks[chunk_index]["content"],
+            }
+            for chunk_index in top_indexes
+        ]
+
+
+def get_lexical_index(index_path=LEXICAL_INDEX_PATH):
+    """
+    Returns the lexical index of a directory, which is shared by all sessions and loaded again
+    once the index is rebuilt, as its metadata file is replaced last.
+
+    Parameters
+    ----------
+    index_path : str, optional
+        The directory of the index (default is `LEXICAL_INDEX_PATH`).
+
+    Returns
+    -------
+    LexicalIndex or None
+        The shared index, or None if the index was not built.
+    """
+
+    index_path = os.path.abspath(index_path)
+
+    try:
+        modification_time = os.stat(os.path.join(index_path, INDEX_METADATA_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    with _lexical_indexes_lock:
+        loaded_time, lexical_index = _lexical_indexes.get(index_path, (None, None))
+
+        if loaded_time != modification_time:
+            lexical_index = LexicalIndex(index_path)
+            _lexical_indexes[index_path] = (modification_time, lexical_index)
+
+    return lexical_index
@@ -2,10 +2,7 @@
 This module represents the base chatbot class that is inherited by the RAG and agent versions.
 """
 
-from boto3.session import Session
-
-
-from utils import load_env_variables
+from bedrock_clients import get_client
 
 
 class NSChatbot:
@@ -13,12 +10,18 @@ class NSChatbot:
     The base class of the NS chatbot that is inherited by the classes of RAG and Agent chatbots.
     """
 
-    def __init__(self):
-        # get the environment variables from the .env file and start a session
-        self.env_variables = load_env_variables()
-        self.session = Session(
-            profile_name=self.env_variables["profile_name"],
-            region_name=self.env_variables["region_name"],
-        )
-        # initialize the Bedrock Agent Runtime client needed for retrieval
-        self.agent_runtime_client = self.session.client("bedrock-agent-runtime")
+    def __init__(self, agent_runtime_client=None):
+        """
+        Initialize the NSChatbot instance.
+
+        Parameters
+        ----------
+        agent_runtime_client : object, optional
+            The Bedrock Agent Runtime client, such as a stub used to test the chatbot offline.
+            If None, the client shared by all chatbots is used (default is None).
+        """
+
+        # get the Bedrock Agent Runtime client needed for retrieval, shared by all sessions
+        if agent_runtime_client is None:
+            agent_runtime_client = get_client("bedrock-agent-runtime")
+        self.agent_runtime_client = agent_runtime_client
@@ -1,8 +1,12 @@
 import re
+import time
 import uuid
 
 from ns_chatbot import NSChatbot
-from config import AGENT_ID, AGENT_ALIAS_ID
+from async_utils import iterate_blocking
+from tracing import span
+from resilience import call_stream_with_resilience
+from config import AGENT_ID, AGENT_ALIAS_ID, AGENT_STREAM_FINAL_RESPONSE, INVOKE_AGENT_DEADLINE
 
 
 class NSChatbotAgent(NSChatbot):
@@ -11,7 +15,7 @@ class NSChatbotAgent(NSChatbot):
     which provides information about train disruptions at train stations in the Netherlands.
     """
 
-    def __init__(self, enable_trace=False):
+    def __init__(self, enable_trace=False, agent_runtime_client=None):
         """
         Initialize the NSChatbotAgent instance. Each instance of this class represents a new
         converation session with the chatbot.
@@ -20,27 +24,32 @@ class NSChatbotAgent(NSChatbot):
         ----------
         enable_trace : bool, optional
             Whether to collect trace events from the agent response (default is False).
+        agent_runtime_client : object, optional
+            The Bedrock Agent Runtime client, such as `StubAgentRuntimeClient` from
+            `bedrock_stubs` used to test the chatbot offline (default is None).
         """
 
-        super().__init__()
+        super().__init__(agent_runtime_client)
         self.session_id = str(uuid.uuid4())
         self.enable_trace = enable_trace
+        # the citations of the last answer, available once its stream is consumed
+        self.citations_text = ""
 
-    def ask_chatbot(self, query):
+    def ask_chatbot_stream(self, query):
         """
-        Send a query to the chatbot agent and receive the response with optional citations.
+        Send a query to the chatbot agent and yield the parts of its response as soon as they
+        arrive. The citations are collected along the way and stored in `citations_text` when
+        the stream finishes.
 
         Parameters
         ----------
         query : str
             The user input query to be sent to the agent.
 
-        Returns
-        -------
-        response_text : str
-            The textual response from the agent.
-        citations_text : str
-            A string of source document names and page numbers, if any citations are used.
+        Yields
+        ------
+        str
+            The parts of the textual response from the agent.
 
         Raises
         ------
@@ -48,69 +57,227 @@ class NSChatbotAgent(NSChatbot):
             Catches and prints any exception that occurs during the Bedrock retrieve API call.
         """
 
-        response_text = ""
-        citations_text = ""
+        self.citations_text = ""
+        response_text_length = 0
 
         try:
-            # call the agent
-            response = self.agent_runtime_client.invoke_agent(
-                agentId=AGENT_ID,
-                agentAliasId=AGENT_ALIAS_ID,
-                sessionId=self.session_id,
-                inputText=query,
-                enableTrace=self.enable_trace,
-            )
-
-            citations = set()
-            trace = []
-
-            # the response is a streaming response, so there's a need to iterate through chunks
-            for event in response["completion"]:
-                # get the agent trace
-                if self.enable_trace:
-                    trace.append(event["trace"])
-
-                # get the response of the agent
-                if "chunk" in event:
-                    response_text += event["chunk"]["bytes"].decode("utf-8")
-
-                """
-                In case the knowledge base is used, get the unique document name and page number
-                from where the information was taken.
-                """
-                try:
-                    for citation in event["chunk"]["attribution"]["citations"]:
-                        for reference in citation["retrievedReferences"]:
-                            metadata = reference["metadata"]
-                            citations.add(
-                                (
-                                    metadata["x-amz-bedrock-kb-source-uri"].split("/")[-1][:-4],
-                                    int(metadata["x-amz-bedrock-kb-document-page-number"]),
+            # the span also contains the time the consumer of the stream spends between chunks
+            with span("agent", prompt_bytes=len(query.encode("utf-8"))) as agent_span:
+                start_time = time.perf_counter()
+
+                # call the agent, which streams the final response instead of sending it at once
+                response = call_stream_with_resilience(
+                    "invoke_agent",
+                    self.agent_runtime_client.invoke_agent,
+                    INVOKE_AGENT_DEADLINE,
+                    "completion",
+                    agentId=AGENT_ID,
+                    agentAliasId=AGENT_ALIAS_ID,
+                    sessionId=self.session_id,
+                    inputText=query,
+                    enableTrace=self.enable_trace,
+                    streamingConfigurations={"streamFinalResponse": AGENT_STREAM_FINAL_RESPONSE},
+                )
+
+                citations = set()
+                trace = []
+                newlines_no = 0
+
+                # the response is a streaming response, so there's a need to iterate through
+                # chunks
+                for event in response["completion"]:
+                    # get the agent trace
+                    if self.enable_trace and "trace" in event:
+                        trace.append(event["trace"])
+
+                    # yield the response of the agent without more than one empty line in a row
+                    if "chunk" in event:
+                        response_chunk, newlines_no = collapse_newlines(
+                            event["chunk"]["bytes"].decode("utf-8"), newlines_no
+                        )
+
+                        if len(response_chunk) != 0:
+                            if response_text_length == 0:
+                                first_chunk_time = time.perf_counter()
+                                agent_span.record_duration(
+                                    "agent.time_to_first_token", first_chunk_time - start_time
+                                )
+
+                            response_text_length += len(response_chunk)
+                            yield response_chunk
+
+                    """
+                    In case the knowledge base is used, get the unique document name and page
+                    number from where the information was taken.
+                    """
+                    try:
+                        for citation in event["chunk"]["attribution"]["citations"]:
+                            for reference in citation["retrievedReferences"]:
+                                metadata = reference["metadata"]
+                                source_uri = metadata["x-amz-bedrock-kb-source-uri"]
+                                citations.add(
+                                    (
+                                        source_uri.split("/")[-1][:-4],
+                                        int(metadata["x-amz-bedrock-kb-document-page-number"]),
+                                    )
                                 )
-                            )
-                except KeyError:
-                    pass
+                    except KeyError:
+                        pass
+
+                if response_text_length != 0:
+                    agent_span.record_duration(
+                        "agent.generation", time.perf_counter() - first_chunk_time
+                    )
+
+                # the agent reports the token usage of its model invocations only in the trace
+                agent_span.set(**get_agent_token_usage(trace))
 
             # print the agent trace
             if self.enable_trace:
-                print("\n--- Agent Trace ---\n{trace}\n-------------------\n")
-
-            # format response and citations
-            if len(response_text) == 0:
-                response_text = "There was an error and the model could not answer."
-            else:
-                response_text = re.sub(r"\n{3,}", "\n\n", response_text)
+                print(f"\n--- Agent Trace ---\n{trace}\n-------------------\n")
 
+            # format citations
             if len(citations) != 0:
-                citations_text += "**Citations:**\n"
+                self.citations_text += "**Citations:**\n"
 
                 for citation in citations:
-                    citations_text += f"- {citation[0]}, page {citation[1]}\n"
+                    self.citations_text += f"- {citation[0]}, page {citation[1]}\n"
 
         except Exception as e:
             print(f"An error occurred: {e}")
 
-        return response_text, citations_text
+        if response_text_length == 0:
+            yield "There was an error and the model could not answer."
+
+    def ask_chatbot(self, query):
+        """
+        Send a query to the chatbot agent and receive the response with optional citations.
+
+        Parameters
+        ----------
+        query : str
+            The user input query to be sent to the agent.
+
+        Returns
+        -------
+        response_text : str
+            The textual response from the agent.
+        citations_text : str
+            A string of source document names and page numbers, if any citations are used.
+        """
+
+        response_text = "".join(self.ask_chatbot_stream(query))
+
+        return response_text, self.citations_text
+
+    async def aask_chatbot_stream(self, query):
+        """
+        The asynchronous counterpart of `ask_chatbot_stream`, which waits for every chunk of
+        the agent without blocking the event loop. The citations are stored in
+        `citations_text` when the stream finishes.
+
+        Parameters
+        ----------
+        query : str
+            The user input query to be sent to the agent.
+
+        Yields
+        ------
+        str
+            The parts of the textual response from the agent.
+        """
+
+        async for response_chunk in iterate_blocking(self.ask_chatbot_stream(query)):
+            yield response_chunk
+
+    async def aask_chatbot(self, query):
+        """
+        The asynchronous counterpart of `ask_chatbot`.
+
+        Parameters
+        ----------
+        query : str
+            The user input query to be sent to the agent.
+
+        Returns
+        -------
+        response_text : str
+            The textual response from the agent.
+        citations_text : str
+            A string of source document names and page numbers, if any citations are used.
+        """
+
+        response_chunks = [
+            response_chunk async for response_chunk in self.aask_chatbot_stream(query)
+        ]
+
+        return "".join(response_chunks), self.citations_text
+
+
+def get_agent_token_usage(trace):
+    """
+    Sums the token usage of the model invocations of the agent, reported in its trace.
+
+    Parameters
+    ----------
+    trace : list of dict
+        The trace events of the agent, which are collected only if the trace is enabled.
+
+    Returns
+    -------
+    dict
+        The input and output tokens, which are empty if the trace has no usage.
+    """
+
+    token_usage = {}
+
+    for trace_event in trace:
+        for step_trace in trace_event.get("trace", {}).values():
+            try:
+                usage = step_trace["modelInvocationOutput"]["metadata"]["usage"]
+            except (KeyError, TypeError):
+                continue
+
+            for token_type, usage_key in (
+                ("input_tokens", "inputTokens"),
+                ("output_tokens", "outputTokens"),
+            ):
+                token_usage[token_type] = token_usage.get(token_type, 0) + usage.get(usage_key, 0)
+
+    return token_usage
+
+
+def collapse_newlines(text, previous_newlines_no):
+    """
+    Replaces three or more newlines in a row by two, also when they are split across chunks.
+
+    Parameters
+    ----------
+    text : str
+        The text of the current chunk.
+    previous_newlines_no : int
+        The number of newlines which end the text of the previous chunks.
+
+    Returns
+    -------
+    str
+        The text with at most two newlines in a row.
+    int
+        The number of newlines which end the text of all chunks so far.
+    """
+
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    stripped_text = text.lstrip("\n")
+    leading_newlines_no = len(text) - len(stripped_text)
+
+    # the newlines which continue the ones of the previous chunks are limited as well
+    leading_newlines_no = min(leading_newlines_no, max(0, 2 - previous_newlines_no))
+    text = "\n" * leading_newlines_no + stripped_text
+
+    if len(stripped_text) == 0:
+        return text, previous_newlines_no + leading_newlines_no
+
+    return text, len(text) - len(text.rstrip("\n"))
 
 
 if __name__ == "__main__":
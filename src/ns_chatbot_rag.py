@@ -6,42 +6,165 @@ indexing and search, and a foundational LLM for answering questions.
 
 import sys
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append(".")
 
 from ns_chatbot import NSChatbot
+from bedrock_clients import get_client
+from async_utils import run_blocking, iterate_blocking
+from retrieval_utils import split_compound_query, fuse_rankings, format_documents_metadata
+from utils import estimate_tokens
+from tracing import span, get_token_usage
+from resilience import call_with_resilience, call_stream_with_resilience
+from retrievers import create_retriever
+from context_packing import pack_context
+from caching import ResponseCache, RetrievalCache
 from config import (
     LLM_ID,
     MAX_OUTPUT_TOKENS,
     LLM_TEMPERATURE,
     RETRIEVED_DOCUMENTS_NO,
     SYSTEM_PROMPT,
-    CONVERSATION_HISTORY_LENGTH,
-    KNOWLEDGE_BASE_ID,
+    SUMMARY_PROMPT,
+    SUMMARY_TRIGGER_TOKENS,
+    SUMMARY_MAX_OUTPUT_TOKENS,
+    SUMMARY_WORKERS_NO,
+    RECENT_TURNS_NO,
+    MAX_INPUT_TOKENS,
+    INVOKE_MODEL_DEADLINE,
+    MULTI_QUERY_RETRIEVAL,
+    MAX_SUB_QUERIES,
+    RETRIEVAL_WORKERS_NO,
+    RRF_K,
+    CONTEXT_PACKING,
+    DOCUMENTS_PATH,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_SIMILARITY_THRESHOLD,
+    RETRIEVAL_CACHE_MAX_ENTRIES,
+    RETRIEVAL_CACHE_MAX_BYTES,
+    RETRIEVAL_CACHE_TTL,
 )
 
 
+def build_user_prompt(query, retrieved_documents):
+    """
+    Builds the prompt of a user query which contains the retrieved documents as context.
+
+    Parameters
+    ----------
+    query : str
+        The user's query.
+    retrieved_documents : list
+        A list of dictionaries, where each dictionary is a retrieved document.
+
+    Returns
+    -------
+    str
+        The full prompt of the user.
+    """
+
+    context = ""
+
+    if len(retrieved_documents) != 0:
+        # build the context string from retrieved documents
+        context = "\n\n**Here is some relevant information:**\n"
+        for document_index, document in enumerate(retrieved_documents):
+            context += (
+                f'<document id="{document_index+1}">\n'
+                f"<source>{document["document_name"]} page {document["page_number"]}</source>\n"
+                f"<content>\n{document["content"]}\n</content>\n"
+                f"</document>\n"
+            )
+        context += "\n"
+
+    # construct the full prompt including context
+    return f"{context}{query}"
+
+
 class NSChatbotRAG(NSChatbot):
     """
     A RAG (Retrieval Augmented Generation) chatbot with built-in memory for NS (Dutch Railways)
     which answers questions based on k retrieved documents from the knowledge base.
     """
 
-    def __init__(self):
+    FALLBACK_MESSAGE = (
+        "I apologize, but I'm having trouble processing your request right now."
+        "Please try again later."
+    )
+    # the answers to first-turn queries are shared by all instances, so by all sessions
+    response_cache = ResponseCache(
+        RESPONSE_CACHE_MAX_ENTRIES,
+        RESPONSE_CACHE_MAX_BYTES,
+        RESPONSE_CACHE_TTL,
+        RESPONSE_CACHE_SIMILARITY_THRESHOLD,
+        DOCUMENTS_PATH,
+    )
+    # the retrieved documents are shared as well and reused on every turn
+    retrieval_cache = RetrievalCache(
+        RETRIEVAL_CACHE_MAX_ENTRIES, RETRIEVAL_CACHE_MAX_BYTES, RETRIEVAL_CACHE_TTL, DOCUMENTS_PATH
+    )
+    # the sub-queries of compound queries are retrieved concurrently by shared threads
+    retrieval_executor = ThreadPoolExecutor(
+        max_workers=RETRIEVAL_WORKERS_NO, thread_name_prefix="multi_query_retrieval"
+    )
+    # the summaries of all sessions are computed by a few shared background threads
+    summary_executor = ThreadPoolExecutor(
+        max_workers=SUMMARY_WORKERS_NO, thread_name_prefix="conversation_summary"
+    )
+
+    def __init__(self, runtime_client=None, agent_runtime_client=None, retriever=None):
         """
         Initialize the NSChatbotRAG instance.
+
+        Parameters
+        ----------
+        runtime_client : object, optional
+            The Bedrock Runtime client, such as `StubRuntimeClient` from `bedrock_stubs` used to
+            test the chatbot offline. If None, the client shared by all chatbots is used
+            (default is None).
+        agent_runtime_client : object, optional
+            The Bedrock Agent Runtime client needed for retrieval (default is None).
+        retriever : object, optional
+            The retriever of the documents, such as `LocalVectorRetriever` from `retrievers`.
+            If None, the retriever of `RETRIEVER_BACKEND` is used (default is None).
         """
 
-        super().__init__()
-        # initialize the Bedrock Runtime client needed to call the LLM
-        self.runtime_client = self.session.client("bedrock-runtime")
+        super().__init__(agent_runtime_client)
+        if retriever is None:
+            retriever = create_retriever(self.agent_runtime_client)
+        self.retriever = retriever
+        # get the Bedrock Runtime client needed to call the LLM, shared by all sessions
+        if runtime_client is None:
+            runtime_client = get_client("bedrock-runtime")
+        self.runtime_client = runtime_client
         # initialize conversation history
         self.conversation_history = []
-
-    def retrieve_top_k_documents(self, query, verbose=False):
+        # the documents retrieved for the current turn, which are not kept in the history
+        self.current_documents = []
+        # the estimated number of input tokens of the last request
+        self.last_input_tokens = 0
+        # the running summary of the turns removed from the history and its pending update
+        self.conversation_summary = ""
+        self._summary_future = None
+        # the names and pages of the documents used for the last answer of `answer_stream`
+        self.documents_metadata = ""
+        # the documents used for the last answer of `answer_stream`, which a follow-up reuses
+        self.last_documents = []
+
+    def retrieve_top_k_documents(
+        self, query, verbose=False, use_cache=True, multi_query=None, pack=None
+    ):
         """
-        Retrieves the top-k most similar documents from the AWS knowledge base configured with
-        vector store. The similarity search is performed using Embed English V3 embeddings.
+        Retrieves the top-k most relevant documents for a query. A compound query, such as
+        'Are there disruptions in Amsterdam and can I bring my bike?', is split into its
+        sub-queries, which are retrieved concurrently together with the whole query and merged
+        with reciprocal rank fusion, keeping a single document per document and page. The
+        documents are then packed into the context: the near duplicates are removed, the others
+        are reordered for diversity and only those within the token budget are kept.
 
         Parameters
         ----------
@@ -49,13 +172,94 @@ class NSChatbotRAG(NSChatbot):
             The user's query string used to search the knowledge base.
         verbose : bool, optional
             If True, prints the retrieved documents to the console. Defaults to False.
+        use_cache : bool, optional
+            If True, the cached documents are reused. Defaults to True.
+        multi_query : bool, optional
+            If True, compound queries are split into sub-queries. Defaults to
+            `MULTI_QUERY_RETRIEVAL`.
+        pack : bool, optional
+            If True, the documents are packed into the context. Defaults to `CONTEXT_PACKING`.
 
         Returns
         -------
         list
             A list of dictionaries, where each dictionary represents a retrieved document
             and contains 'document_name', 'page_number', and 'content'.
-            Returns an empty list if an error occurs during retrieval.
+            Returns an empty list and an empty string if an error occurs during retrieval.
+        str
+            A string which contains the name and page of the retrieved document, needed to be
+            displayed to the user.
+        """
+
+        if multi_query is None:
+            multi_query = MULTI_QUERY_RETRIEVAL
+        if pack is None:
+            pack = CONTEXT_PACKING
+
+        with span("retrieve") as retrieve_span:
+            sub_queries = split_compound_query(query, MAX_SUB_QUERIES) if multi_query else [query]
+
+            if len(sub_queries) == 1:
+                retrieved_documents, retrieved_documents_metadata = (
+                    self._retrieve_query_documents(query, verbose, use_cache)
+                )
+            else:
+                # the whole query is retrieved as well, so the context shared by its parts is
+                # not lost
+                retrievals = [
+                    self.retrieval_executor.submit(
+                        self._retrieve_query_documents, retrieval_query, verbose, use_cache
+                    )
+                    for retrieval_query in [query, *sub_queries]
+                ]
+                rankings = [retrieval.result()[0] for retrieval in retrievals]
+                retrieved_documents = fuse_rankings(rankings, RETRIEVED_DOCUMENTS_NO, RRF_K)
+                retrieved_documents_metadata = (
+                    format_documents_metadata(retrieved_documents)
+                    if len(retrieved_documents) != 0
+                    else ""
+                )
+
+            retrieve_span.set(
+                sub_queries_no=len(sub_queries), documents_no=len(retrieved_documents)
+            )
+
+        if pack and len(retrieved_documents) != 0:
+            with span("pack_context") as pack_span:
+                retrieved_documents, packing_statistics = pack_context(retrieved_documents)
+                # only the documents sent to the LLM are displayed to the user
+                retrieved_documents_metadata = (
+                    format_documents_metadata(retrieved_documents)
+                    if len(retrieved_documents) != 0
+                    else ""
+                )
+
+                pack_span.set(documents_no=len(retrieved_documents), **packing_statistics)
+
+        return retrieved_documents, retrieved_documents_metadata
+
+    def _retrieve_query_documents(self, query, verbose=False, use_cache=True):
+        """
+        Retrieves the top-k most similar documents with the retriever of the chatbot, by default
+        the AWS knowledge base configured with vector store, where the similarity search is
+        performed using Embed English V3 embeddings. The documents retrieved for a query are
+        cached for all sessions and reused for the same normalized query.
+
+        Parameters
+        ----------
+        query : str
+            The query string used to search the documents.
+        verbose : bool, optional
+            If True, prints the retrieved documents to the console. Defaults to False.
+        use_cache : bool, optional
+            If True, the cached documents are reused. Defaults to True.
+
+        Returns
+        -------
+        list
+            A list of dictionaries, where each dictionary represents a retrieved document
+            and contains 'document_name', 'page_number', and 'content'.
+            Returns an empty list and an empty string if an error occurs during retrieval.
         str
             A string which contains the name and page of the retrieved document, needed to be
             displayed to the user.
@@ -63,67 +267,287 @@ class NSChatbotRAG(NSChatbot):
         Raises
         ------
         Exception
-            Catches and prints any exception that occurs during the Bedrock retrieve API call.
+            Catches and prints any exception that occurs during the retrieval.
         """
 
-        # call the retrieve API
+        retrieval_parameters = (*self.retriever.cache_key, RETRIEVED_DOCUMENTS_NO)
+
+        if use_cache:
+            cached_retrieval = self.retrieval_cache.get(query, retrieval_parameters)
+
+            if cached_retrieval is not None:
+                if verbose:
+                    print(f"\nThe documents were retrieved from the cache:\n{cached_retrieval[1]}")
+                return cached_retrieval
+
+        start_time = time.perf_counter()
+
         try:
-            response = self.agent_runtime_client.retrieve(
-                knowledgeBaseId=KNOWLEDGE_BASE_ID,
-                retrievalQuery={"text": query},
-                retrievalConfiguration={
-                    "vectorSearchConfiguration": {"numberOfResults": RETRIEVED_DOCUMENTS_NO}
-                },
-            )
+            retrieved_documents = self.retriever.retrieve(query, RETRIEVED_DOCUMENTS_NO)
         except Exception as e:
             print(f"Error during document retrieval: {e}")
-            return []
-
-        retrieved_documents = []
+            return [], ""
 
-        # process and print the retrieved documents
+        # print the retrieved documents
         if verbose:
             print(f"\nTop {RETRIEVED_DOCUMENTS_NO} most similar documents:\n")
-        for document in response["retrievalResults"]:
-            content = document["content"]["text"]
-            page_number = int(document["metadata"]["x-amz-bedrock-kb-document-page-number"])
-            document_name = document["metadata"]["x-amz-bedrock-kb-source-uri"].split("/")[-1][:-4]
-
-            retrieved_documents.append(
-                {
-                    "document_name": document_name,
-                    "page_number": page_number,
-                    "content": content,
-                }
+            for document in retrieved_documents:
+                print(
+                    f"{document['content']}\nFrom: {document['document_name']}"
+                    f" at page {document['page_number']}\n"
+                )
+
+        retrieved_documents_metadata = format_documents_metadata(retrieved_documents)
+
+        if use_cache:
+            self.retrieval_cache.put(
+                query,
+                retrieved_documents,
+                retrieved_documents_metadata,
+                time.perf_counter() - start_time,
+                retrieval_parameters,
             )
 
-            if verbose:
-                print(f"{content}\nFrom: {document_name} at page {page_number}\n")
+        return retrieved_documents, retrieved_documents_metadata
+
+    def _append_query(self, query, retrieved_documents=None):
+        """
+        Adds the query to the conversation history and keeps the retrieved documents for the
+        current turn only.
+
+        Parameters
+        ----------
+        query : str
+            The current user's query or message.
+        retrieved_documents : list, optional
+            A list of dictionaries, where each dictionary is a retrieved document. If provided,
+            these documents are added to the prompt as context for the LLM. Defaults to None.
+        """
 
-        retrieved_documents_metadata = "**Retrieved documents:**\n"
-        included_documents = set()
+        # a query whose answer was not received is replaced, so the roles keep alternating
+        if len(self.conversation_history) != 0 and self.conversation_history[-1]["role"] == "user":
+            self.conversation_history.pop()
 
-        # include only unique document name - page number pairs
-        for retrieved_document in retrieved_documents:
-            if (
-                retrieved_document["document_name"],
-                retrieved_document["page_number"],
-            ) in included_documents:
-                continue
+        self.conversation_history.append(
+            {"role": "user", "content": [{"type": "text", "text": query}]}
+        )
+        self.current_documents = list(retrieved_documents or [])
 
-            retrieved_documents_metadata += f"- {retrieved_document['document_name']}"
-            retrieved_documents_metadata += f", page {retrieved_document['page_number']}\n"
-            included_documents.add(
-                (retrieved_document["document_name"], retrieved_document["page_number"])
+    def _build_messages(self):
+        """
+        Builds the messages sent to the LLM within the `MAX_INPUT_TOKENS` budget. Only the
+        current query is sent with its retrieved documents, since the answers of the past turns
+        already contain what was used from theirs. If the budget is exceeded, the lowest ranked
+        documents of the current turn are dropped first and then the oldest turns, which are
+        also removed from the conversation history.
+
+        Returns
+        -------
+        list of dict
+            The messages of the request.
+        """
+
+        self._apply_summary()
+
+        query = self.conversation_history[-1]["content"][0]["text"]
+        documents = list(self.current_documents)
+        tokens_budget = MAX_INPUT_TOKENS - estimate_tokens(self._build_system_prompt())
+
+        full_user_prompt = build_user_prompt(query, documents)
+        while len(documents) != 0 and estimate_tokens(full_user_prompt) > tokens_budget:
+            documents.pop()
+            full_user_prompt = build_user_prompt(query, documents)
+
+        tokens_budget -= estimate_tokens(full_user_prompt)
+
+        # the past turns are kept from the newest one, as pairs of user and assistant messages
+        past_messages = self.conversation_history[:-1]
+        first_kept_message = len(past_messages)
+
+        for message_index in range(len(past_messages) - 2, -1, -2):
+            turn_tokens = sum(
+                estimate_tokens(message["content"][0]["text"])
+                for message in past_messages[message_index : message_index + 2]
             )
+            if turn_tokens > tokens_budget:
+                break
 
-        return retrieved_documents, retrieved_documents_metadata
+            tokens_budget -= turn_tokens
+            first_kept_message = message_index
+
+        self.conversation_history = self.conversation_history[first_kept_message:]
+        self.last_input_tokens = MAX_INPUT_TOKENS - tokens_budget
+
+        return self.conversation_history[:-1] + [
+            {"role": "user", "content": [{"type": "text", "text": full_user_prompt}]}
+        ]
+
+    def _build_system_prompt(self):
+        """Builds the system prompt, which includes the summary of the earlier conversation."""
+
+        if len(self.conversation_summary) == 0:
+            return SYSTEM_PROMPT
+
+        return (
+            f"{SYSTEM_PROMPT}\n**Summary of the earlier conversation:**\n"
+            f"{self.conversation_summary}\n"
+        )
+
+    def _build_request_body(self):
+        """Builds the body of the request sent to the LLM from the conversation history."""
+
+        messages = self._build_messages()
+
+        return json.dumps(
+            {
+                "anthropic_version": "bedrock-2023-05-31",
+                "system": self._build_system_prompt(),
+                "messages": messages,
+                "max_tokens": MAX_OUTPUT_TOKENS,
+                "temperature": LLM_TEMPERATURE,
+            }
+        )
+
+    def _build_prompt(self, query, retrieved_documents=None):
+        """
+        Adds the query to the conversation history and builds the body of the request sent to
+        the LLM, which is traced as the prompt construction stage.
+
+        Parameters
+        ----------
+        query : str
+            The current user's query or message.
+        retrieved_documents : list, optional
+            The retrieved documents added to the prompt as context. Defaults to None.
+
+        Returns
+        -------
+        str
+            The JSON body of the request.
+        """
+
+        with span("build_prompt") as prompt_span:
+            self._append_query(query, retrieved_documents)
+            body = self._build_request_body()
+
+            # the body is ASCII-only JSON, so its length is also its size in bytes
+            prompt_span.set(prompt_bytes=len(body), estimated_input_tokens=self.last_input_tokens)
+
+        return body
+
+    def _append_response(self, response_text):
+        """Appends the LLM's response to the conversation history."""
+
+        self.conversation_history.append(
+            {"role": "assistant", "content": [{"type": "text", "text": response_text}]}
+        )
+        self.current_documents = []
+        self._schedule_summary()
+
+    def _schedule_summary(self):
+        """
+        Starts summarizing the turns before the `RECENT_TURNS_NO` most recent ones in the
+        background, once they exceed `SUMMARY_TRIGGER_TOKENS`. It is called after an answer
+        is delivered, so the summary never delays the current turn.
+        """
+
+        if self._summary_future is not None:
+            return
+
+        old_messages = self.conversation_history[: -2 * RECENT_TURNS_NO]
+        old_tokens = sum(estimate_tokens(message["content"][0]["text"]) for message in old_messages)
+
+        if old_tokens >= SUMMARY_TRIGGER_TOKENS:
+            self._summary_future = self.summary_executor.submit(
+                self._summarize, self.conversation_summary, old_messages
+            )
+
+    def _summarize(self, conversation_summary, messages):
+        """
+        Summarizes turns of the conversation together with the previous summary. It runs in
+        a background thread, so it only uses its arguments and the runtime client.
+
+        Parameters
+        ----------
+        conversation_summary : str
+            The summary of the turns before the summarized ones.
+        messages : list of dict
+            The summarized messages.
+
+        Returns
+        -------
+        str or None
+            The new summary, or None if an error occurs during LLM invocation.
+        list of dict
+            The summarized messages.
+        """
+
+        transcript = "\n\n".join(
+            f"{message['role'].capitalize()}: {message['content'][0]['text']}"
+            for message in messages
+        )
+        if len(conversation_summary) != 0:
+            transcript = f"Previous summary: {conversation_summary}\n\n{transcript}"
+
+        body = json.dumps(
+            {
+                "anthropic_version": "bedrock-2023-05-31",
+                "system": SUMMARY_PROMPT,
+                "messages": [{"role": "user", "content": [{"type": "text", "text": transcript}]}],
+                "max_tokens": SUMMARY_MAX_OUTPUT_TOKENS,
+                "temperature": 0,
+            }
+        )
+
+        try:
+            response = call_with_resilience(
+                "invoke_model",
+                self.runtime_client.invoke_model,
+                INVOKE_MODEL_DEADLINE,
+                body=body,
+                modelId=LLM_ID,
+                accept="application/json",
+                contentType="application/json",
+            )
+            summary = json.loads(response.get("body").read())["content"][0]["text"].strip()
+
+            return summary, messages
+
+        except Exception as e:
+            print(f"Error during conversation summarization: {e}")
+            return None, messages
+
+    def _apply_summary(self):
+        """
+        Replaces the summarized turns by the new summary, if it is ready. The turns added
+        while the summary was computed are kept.
+        """
+
+        if self._summary_future is None or not self._summary_future.done():
+            return
+
+        summary_future, self._summary_future = self._summary_future, None
+        conversation_summary, summarized_messages = summary_future.result()
+
+        # the turns are kept if the summarization failed, until the token budget drops them
+        if conversation_summary is None:
+            return
+
+        last_summarized_message = summarized_messages[-1]
+        for message_index, message in enumerate(self.conversation_history):
+            if message is last_summarized_message:
+                self.conversation_history = self.conversation_history[message_index + 1 :]
+                break
+
+        self.conversation_summary = conversation_summary
 
     def ask_chatbot(self, query, retrieved_documents=None):
         """
         Invokes the LLM (by default Claude 3.5 Haiku) with a given query, incorporating retrieved
-        documents as context and maintaining conversation history. The conversation history is
-        truncated based on `CONVERSATION_HISTORY_LENGTH` to avoid exceeding the LLM's context size.
+        documents as context and maintaining conversation history. The prompt is kept within
+        `MAX_INPUT_TOKENS`, which bounds the latency and cost of every turn. The answer is
+        always generated, as the answers are only cached by `answer_stream`, which also
+        retrieves the documents.
 
         Parameters
         ----------
@@ -145,71 +569,286 @@ class NSChatbotRAG(NSChatbot):
             Catches and prints any exception that occurs during the Bedrock invoke_model API call.
         """
 
-        context = ""
+        body = self._build_prompt(query, retrieved_documents)
 
-        if retrieved_documents is not None and len(retrieved_documents) != 0:
-            # build the context string from retrieved documents
-            context = "\n\n**Here is some relevant information:**\n"
-            for document_index, document in enumerate(retrieved_documents):
-                context += (
-                    f'<document id="{document_index+1}">\n'
-                    f"<source>{document["document_name"]} page {document["page_number"]}</source>\n"
-                    f"<content>\n{document["content"]}\n</content>\n"
-                    f"</document>\n"
+        try:
+            with span("llm", stream=False) as llm_span:
+                response = call_with_resilience(
+                    "invoke_model",
+                    self.runtime_client.invoke_model,
+                    INVOKE_MODEL_DEADLINE,
+                    body=body,
+                    modelId=LLM_ID,
+                    accept="application/json",
+                    contentType="application/json",
                 )
-            context += "\n"
 
-        # construct the full prompt including context
-        full_user_prompt = f"{context}{query}"
+                response_body = json.loads(response.get("body").read())
+                response_text = response_body["content"][0]["text"]
+                llm_span.set(**get_token_usage(response_body.get("usage", {})))
 
-        """Keep only the last 100 messages (50 from user and 50 from chatbot) to avoid exceeding
-        the maximum context length of 200k tokens. Computed considering that a conversation turn
-        has about 3.6k tokens (5 * 100 for documents, 100 for question and 1,000 for answer)."""
-        self.conversation_history = self.conversation_history[-CONVERSATION_HISTORY_LENGTH:]
+            # append the LLM's response to the conversation history
+            self._append_response(response_text)
+            return response_text
 
-        self.conversation_history.append(
-            {"role": "user", "content": [{"type": "text", "text": full_user_prompt}]}
-        )
+        except Exception as e:
+            print(f"Error during LLM invocation: {e}")
+            self._append_response(self.FALLBACK_MESSAGE)
 
-        body = json.dumps(
-            {
-                "anthropic_version": "bedrock-2023-05-31",
-                "system": SYSTEM_PROMPT,
-                "messages": self.conversation_history,
-                "max_tokens": MAX_OUTPUT_TOKENS,
-                "temperature": LLM_TEMPERATURE,
-            }
-        )
+            return self.FALLBACK_MESSAGE
 
-        try:
-            response = self.runtime_client.invoke_model(
-                body=body, modelId=LLM_ID, accept="application/json", contentType="application/json"
-            )
+    def ask_chatbot_stream(self, query, retrieved_documents=None):
+        """
+        Invokes the LLM like `ask_chatbot`, but yields the text of the answer as soon as it is
+        generated, so the first words can be displayed before the full answer is ready. The
+        complete answer is appended to the conversation history when the stream finishes.
 
-            response_text = json.loads(response.get("body").read())["content"][0]["text"]
+        Parameters
+        ----------
+        query : str
+            The current user's query or message.
+        retrieved_documents : list, optional
+            A list of dictionaries, where each dictionary is a retrieved document. If provided,
+            these documents are added to the prompt as context for the LLM. Defaults to None.
 
-            # append the LLM's response to the conversation history
-            self.conversation_history.append(
-                {"role": "assistant", "content": [{"type": "text", "text": response_text}]}
-            )
-            return response_text
+        Yields
+        ------
+        str
+            The text deltas generated by the LLM, or a fallback message if an error occurs
+            during LLM invocation.
+
+        Raises
+        ------
+        Exception
+            Catches and prints any exception that occurs during the Bedrock
+            invoke_model_with_response_stream API call.
+        """
+
+        body = self._build_prompt(query, retrieved_documents)
+        response_deltas = []
+
+        try:
+            # the span also contains the time the consumer of the stream spends between deltas
+            with span("llm", stream=True) as llm_span:
+                start_time = time.perf_counter()
+                response = call_stream_with_resilience(
+                    "invoke_model",
+                    self.runtime_client.invoke_model_with_response_stream,
+                    INVOKE_MODEL_DEADLINE,
+                    "body",
+                    body=body,
+                    modelId=LLM_ID,
+                    accept="application/json",
+                    contentType="application/json",
+                )
+
+                # the stream contains the message events, of which the text deltas are
+                # displayed, while the first and last messages carry the token usage
+                for event in response.get("body"):
+                    if "chunk" not in event:
+                        continue
+
+                    message_event = json.loads(event["chunk"]["bytes"])
+                    if (
+                        message_event["type"] == "content_block_delta"
+                        and message_event["delta"]["type"] == "text_delta"
+                    ):
+                        if len(response_deltas) == 0:
+                            first_token_time = time.perf_counter()
+                            llm_span.record_duration(
+                                "llm.time_to_first_token", first_token_time - start_time
+                            )
+
+                        response_deltas.append(message_event["delta"]["text"])
+                        yield message_event["delta"]["text"]
+                    elif message_event["type"] == "message_start":
+                        llm_span.set(
+                            **get_token_usage(message_event["message"].get("usage", {}))
+                        )
+                    elif message_event["type"] == "message_delta":
+                        llm_span.set(**get_token_usage(message_event.get("usage", {})))
+
+                if len(response_deltas) != 0:
+                    llm_span.record_duration(
+                        "llm.generation", time.perf_counter() - first_token_time
+                    )
 
         except Exception as e:
             print(f"Error during LLM invocation: {e}")
-            fallback_message = (
-                "I apologize, but I'm having trouble processing your request right now."
-                "Please try again later."
+            # the part of the answer which was already displayed is kept in the history
+            fallback_message = self.FALLBACK_MESSAGE
+            if len(response_deltas) != 0:
+                fallback_message = f"\n\n{fallback_message}"
+
+            response_deltas.append(fallback_message)
+            yield fallback_message
+
+        self._append_response("".join(response_deltas))
+
+    async def aretrieve_top_k_documents(self, query, verbose=False, use_cache=True):
+        """
+        The asynchronous counterpart of `retrieve_top_k_documents`, which waits for the
+        knowledge base without blocking the event loop.
+
+        Parameters
+        ----------
+        query : str
+            The user's query string used to search the knowledge base.
+        verbose : bool, optional
+            If True, prints the retrieved documents to the console. Defaults to False.
+        use_cache : bool, optional
+            If True, the cached documents are reused. Defaults to True.
+
+        Returns
+        -------
+        list
+            The retrieved documents.
+        str
+            The names and pages of the retrieved documents.
+        """
+
+        return await run_blocking(self.retrieve_top_k_documents, query, verbose, use_cache)
+
+    async def aask_chatbot(self, query, retrieved_documents=None):
+        """
+        The asynchronous counterpart of `ask_chatbot`, which waits for the LLM without
+        blocking the event loop.
+
+        Parameters
+        ----------
+        query : str
+            The current user's query or message.
+        retrieved_documents : list, optional
+            The retrieved documents added to the prompt as context. Defaults to None.
+
+        Returns
+        -------
+        str
+            The text response generated by the LLM or a fallback message.
+        """
+
+        return await run_blocking(self.ask_chatbot, query, retrieved_documents)
+
+    async def aask_chatbot_stream(self, query, retrieved_documents=None):
+        """
+        The asynchronous counterpart of `ask_chatbot_stream`, which waits for every text delta
+        without blocking the event loop.
+
+        Parameters
+        ----------
+        query : str
+            The current user's query or message.
+        retrieved_documents : list, optional
+            The retrieved documents added to the prompt as context. Defaults to None.
+
+        Yields
+        ------
+        str
+            The text deltas generated by the LLM or a fallback message.
+        """
+
+        async for response_delta in iterate_blocking(
+            self.ask_chatbot_stream(query, retrieved_documents)
+        ):
+            yield response_delta
+
+    def answer_stream(self, query, use_cache=True, reuse_documents=False):
+        """
+        Retrieves the documents relevant to a query and streams the answer of the LLM. The
+        answers to first-turn queries, which do not depend on a previous conversation, are
+        cached and reused for the same normalized queries, without any retrieval or LLM
+        invocation. Unlike `ask_chatbot`, whose caller retrieves the documents, it is the
+        cached path of the chatbot. The names and pages of the used documents are stored in
+        `documents_metadata`.
+
+        Parameters
+        ----------
+        query : str
+            The current user's query or message.
+        use_cache : bool, optional
+            Whether the answers to first-turn queries and the retrieved documents are cached
+            (default is True).
+        reuse_documents : bool, optional
+            Whether the documents of the previous answer are reused instead of retrieved, such
+            as for a follow-up query. Ignored if there are no previous documents (default is
+            False).
+
+        Yields
+        ------
+        str
+            The text deltas of the answer.
+        """
+
+        is_first_turn = use_cache and len(self.conversation_history) == 0
+
+        if is_first_turn:
+            cached_response = self.response_cache.get(query)
+
+            if cached_response is not None:
+                # the conversation continues as if the answer was generated
+                self._append_query(query, cached_response["retrieved_documents"])
+                self._append_response(cached_response["response_text"])
+                self.documents_metadata = cached_response["documents_metadata"]
+                self.last_documents = cached_response["retrieved_documents"]
+
+                yield cached_response["response_text"]
+                return
+
+        # the metadata of the reused documents is kept for the display
+        if reuse_documents and len(self.last_documents) != 0:
+            retrieved_documents = self.last_documents
+        else:
+            retrieved_documents, self.documents_metadata = self.retrieve_top_k_documents(
+                query, use_cache=use_cache
             )
-            self.conversation_history.append(
-                {"role": "assistant", "content": [{"type": "text", "text": fallback_message}]}
+            self.last_documents = retrieved_documents
+
+        response_deltas = []
+        for response_delta in self.ask_chatbot_stream(query, retrieved_documents):
+            response_deltas.append(response_delta)
+            yield response_delta
+
+        response_text = "".join(response_deltas)
+
+        # answers without documents or with errors are not reused
+        if (
+            is_first_turn
+            and len(retrieved_documents) != 0
+            and not response_text.endswith(self.FALLBACK_MESSAGE)
+        ):
+            self.response_cache.put(
+                query, response_text, retrieved_documents, self.documents_metadata
             )
 
-            return fallback_message
+    def add_turn(self, query, response_text):
+        """
+        Adds a turn answered by another chatbot, such as a question about disruptions answered
+        by the agent, to the conversation history, so the next turns can refer to it. Its
+        documents are unknown, so a follow-up retrieves new ones.
+
+        Parameters
+        ----------
+        query : str
+            The user's query.
+        response_text : str
+            The answer of the other chatbot.
+        """
+
+        self._append_query(query)
+        self._append_response(response_text)
+        self.last_documents = []
+        self.documents_metadata = ""
 
     def reset_conversation(self):
         """Clears the conversation history to start a new chat session."""
 
         self.conversation_history = []
+        self.current_documents = []
+        self.last_documents = []
+        self.documents_metadata = ""
+        self.conversation_summary = ""
+        # a pending summary of the previous conversation is ignored
+        self._summary_future = None
 
 
 if __name__ == "__main__":
@@ -0,0 +1,302 @@
+"""
+This module routes every turn of the RAG chatbot without any remote call. A query either needs
+new documents, is a follow-up such as 'Can you tell me more about that?' which is answered with
+the documents of the previous turn, or asks about train disruptions, which only the agent can
+answer with its disruptions tool. Clear cases are decided by rules, and the others by a tiny
+nearest-centroid classifier over the word and trigram features of the queries. A compound query
+goes to the agent only if all its parts ask about disruptions, as the others are retrieved part
+by part. Every decision is traced with its reason, so the retrievals which were skipped can be
+counted.
+"""
+
+import re
+import time
+import threading
+
+from tracing import span, record_value
+from lexical_index import tokenize
+from caching import normalize_query, get_query_features
+from retrieval_utils import split_compound_query
+from config import ROUTER_FOLLOW_UP_MAX_WORDS, ROUTER_MIN_MARGIN, MAX_SUB_QUERIES
+
+ROUTE_RETRIEVE = "retrieve"
+ROUTE_REUSE = "reuse"
+ROUTE_AGENT = "agent"
+
+# the queries about disruptions, unless they ask about the refunds for a delay
+DISRUPTION_PATTERN = re.compile(
+    r"\b(disruptions?|storing(en)?|outages?|breakdowns?|cancell?ed|cancellations?|"
+    r"not running|engineering works?|maintenance works?|malfunctions?)\b"
+)
+REFUND_PATTERN = re.compile(r"\b(refunds?|compensation|money back|reimburs\w*|claims?)\b")
+# the short queries which refer to the previous turn
+FOLLOW_UP_PATTERN = re.compile(
+    r"^(and|but|so|also|then|what about|how about|why|really|ok|okay)\b|"
+    r"\b(that|this|it|its|them|those|these|they|more|else|elaborate|explain|example|"
+    r"meant|mean|previous|above)\b"
+)
+# the words of the follow-up queries which do not refer to a new topic
+CONVERSATION_WORDS = frozenset(
+    "about again also answer any anything but could detail details else example examples explain "
+    "give know me mean meant more much many please previous really should so summarize tell "
+    "that then these they them those true what why would".split()
+)
+
+# the labelled queries from which the centroid of every route is computed. They do not name any
+# station, whose trigrams would otherwise send every query about a station to the agent
+EXAMPLE_QUERIES = {
+    ROUTE_RETRIEVE: (
+        "What is NS?",
+        "Can I take my bike on the train?",
+        "How do I check in with my OV-chipkaart?",
+        "What does an off-peak bicycle ticket cost?",
+        "Where can I buy a train ticket at the station?",
+        "Can I bring my dog on the train?",
+        "What is the difference between a Sprinter and an Intercity?",
+        "How do I get assistance at the station?",
+        "What happens if I forget to check out?",
+        "Which season tickets does NS offer?",
+        "What are Keuzedagen?",
+        "How do I get my money back after a delay?",
+    ),
+    ROUTE_REUSE: (
+        "Can you tell me more about that?",
+        "What do you mean?",
+        "Can you explain it in more detail?",
+        "And how much does it cost?",
+        "Why is that?",
+        "Can you give me an example?",
+        "What else should I know?",
+        "Could you summarize your answer?",
+        "Is that also true on weekends?",
+        "And what is their main goal?",
+    ),
+    ROUTE_AGENT: (
+        "Were there disruptions at the station yesterday?",
+        "Was there a disruption on my route this morning?",
+        "Are the trains running on my line right now?",
+        "Which trains were cancelled last week?",
+        "How long did the outage last?",
+        "What caused the delays this morning?",
+        "Is there a storing on the line today?",
+        "Were there engineering works on the track last month?",
+    ),
+}
+
+_statistics_lock = threading.Lock()
+_statistics = {}
+
+
+def add_features(features, added_features):
+    """Adds sparse features to others, in place."""
+
+    for feature, weight in added_features.items():
+        features[feature] = features.get(feature, 0.0) + weight
+
+
+def compute_similarity(features, other_features):
+    """Computes the dot product of two sparse feature vectors."""
+
+    if len(features) > len(other_features):
+        features, other_features = other_features, features
+
+    return sum(weight * other_features.get(feature, 0.0) for feature, weight in features.items())
+
+
+def compute_centroid(queries):
+    """
+    Computes the unit-length centroid of the features of queries.
+
+    Parameters
+    ----------
+    queries : iterable of str
+        The queries.
+
+    Returns
+    -------
+    dict of float
+        The weight of every word and trigram of the centroid.
+    """
+
+    centroid = {}
+
+    for query in queries:
+        add_features(centroid, get_query_features(normalize_query(query)))
+
+    norm = compute_similarity(centroid, centroid) ** 0.5
+
+    return {feature: weight / norm for feature, weight in centroid.items()}
+
+
+_CENTROIDS = {route: compute_centroid(queries) for route, queries in EXAMPLE_QUERIES.items()}
+
+
+def classify_query(normalized_query):
+    """
+    Classifies a query by the route of its most similar centroid.
+
+    Parameters
+    ----------
+    normalized_query : str
+        The normalized query.
+
+    Returns
+    -------
+    str
+        The route of the most similar centroid.
+    float
+        The margin of its similarity over the similarity of the second most similar centroid.
+    """
+
+    features = get_query_features(normalized_query)
+    similarities = sorted(
+        ((compute_similarity(features, centroid), route) for route, centroid in _CENTROIDS.items()),
+        reverse=True,
+    )
+
+    return similarities[0][1], similarities[0][0] - similarities[1][0]
+
+
+def is_disruption_query(normalized_query):
+    """Checks whether a normalized query asks about disruptions, but not about their refunds."""
+
+    return DISRUPTION_PATTERN.search(normalized_query) is not None and (
+        REFUND_PATTERN.search(normalized_query) is None
+    )
+
+
+def get_new_terms(query, previous_documents):
+    """
+    Finds the terms of a query which are neither conversational words nor in the previous
+    documents, such as 'dogs' in 'What about dogs?' after a question about bikes.
+
+    Parameters
+    ----------
+    query : str
+        The user's query.
+    previous_documents : list of dict
+        The documents of the previous turn.
+
+    Returns
+    -------
+    set of str
+        The new terms of the query.
+    """
+
+    query_terms = set(tokenize(query)) - CONVERSATION_WORDS
+    if len(query_terms) == 0:
+        return query_terms
+
+    previous_terms = set()
+    for document in previous_documents:
+        previous_terms.update(tokenize(document["content"]))
+
+    return query_terms - previous_terms
+
+
+def decide_route(query, previous_documents=None):
+    """
+    Decides the route of a query, first with the rules and then with the classifier, where an
+    uncertain decision falls back to a retrieval. A compound query whose parts do not all ask
+    about disruptions is retrieved, so each of its parts gets its own documents.
+
+    Parameters
+    ----------
+    query : str
+        The user's query.
+    previous_documents : list of dict, optional
+        The documents of the previous turn, which can be reused (default is None).
+
+    Returns
+    -------
+    str
+        The route: 'retrieve', 'reuse' or 'agent'.
+    str
+        The reason of the decision.
+    float
+        The margin of the classifier, or 1.0 for the rules.
+    """
+
+    normalized_query = normalize_query(query)
+    has_previous_documents = previous_documents is not None and len(previous_documents) != 0
+
+    sub_queries = split_compound_query(query, MAX_SUB_QUERIES)
+    disruption_parts_no = sum(
+        is_disruption_query(normalize_query(sub_query)) for sub_query in sub_queries
+    )
+
+    if disruption_parts_no != 0:
+        if disruption_parts_no == len(sub_queries):
+            return ROUTE_AGENT, "disruption_rule", 1.0
+
+        return ROUTE_RETRIEVE, "compound_query", 1.0
+
+    if (
+        has_previous_documents
+        and len(normalized_query.split()) <= ROUTER_FOLLOW_UP_MAX_WORDS
+        and FOLLOW_UP_PATTERN.search(normalized_query)
+        and len(get_new_terms(query, previous_documents)) == 0
+    ):
+        return ROUTE_REUSE, "follow_up_rule", 1.0
+
+    route, margin = classify_query(normalized_query)
+
+    if route == ROUTE_REUSE and not has_previous_documents:
+        return ROUTE_RETRIEVE, "no_previous_documents", margin
+    if margin < ROUTER_MIN_MARGIN:
+        return ROUTE_RETRIEVE, "low_confidence", margin
+
+    return route, "classifier", margin
+
+
+def route_query(query, previous_documents=None):
+    """
+    Routes a query and traces the decision, whose count by route is also kept, so the share
+    of the turns which skip the retrieval can be measured.
+
+    Parameters
+    ----------
+    query : str
+        The user's query.
+    previous_documents : list of dict, optional
+        The documents of the previous turn, which can be reused (default is None).
+
+    Returns
+    -------
+    str
+        The route: 'retrieve', 'reuse' or 'agent'.
+    """
+
+    with span("route") as route_span:
+        start_time = time.perf_counter()
+        route, reason, margin = decide_route(query, previous_documents)
+
+        route_span.set(
+            route=route,
+            reason=reason,
+            margin=round(margin, 3),
+            decision_us=round((time.perf_counter() - start_time) * 1e6, 1),
+        )
+
+    # the count of the histogram of every route is its number of decisions
+    record_value(f"route.{route}", margin)
+
+    with _statistics_lock:
+        route_statistics = _statistics.setdefault(route, {})
+        route_statistics[reason] = route_statistics.get(reason, 0) + 1
+
+    return route
+
+
+def get_statistics():
+    """
+    Returns the number of decisions of every route by their reason.
+
+    Returns
+    -------
+    dict
+        The number of decisions by reason of every route.
+    """
+
+    with _statistics_lock:
+        return {route: dict(route_statistics) for route, route_statistics in _statistics.items()}
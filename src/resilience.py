@@ -0,0 +1,551 @@
+"""
+This module makes the Bedrock calls resilient to a slow or unhealthy backend. Every call has a
+deadline, throttled and transient errors are retried with a jittered exponential backoff,
+idempotent calls such as the retrievals can be hedged by a duplicate request once they are
+slower than usual, and a circuit breaker per operation fails fast while the backend keeps
+failing, so the users get the fallback answer immediately instead of after a timeout.
+"""
+
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from botocore.exceptions import (
+    ClientError,
+    ConnectionError as BotocoreConnectionError,
+    ConnectTimeoutError,
+    ReadTimeoutError,
+    HTTPClientError,
+)
+
+from config import (
+    RESILIENCE_WORKERS_NO,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    HEDGE_PERCENTILE,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_DEFAULT_DELAY,
+    LATENCY_WINDOW_SIZE,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT,
+)
+
+# the error codes of the AWS services which are worth retrying after a backoff
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+    "InternalServerException",
+}
+# the errors of the HTTP client which are transient, such as the connect and read timeouts of a
+# slow backend and the connections closed while a response is read
+TRANSIENT_ERRORS = (BotocoreConnectionError, ConnectTimeoutError, ReadTimeoutError, HTTPClientError)
+
+# the attempts run in these threads, so the callers can stop waiting for them at the deadline,
+# while a call which exceeded its deadline ends in the background at the read timeout
+_executor = ThreadPoolExecutor(max_workers=RESILIENCE_WORKERS_NO, thread_name_prefix="resilience")
+# the attempts which were submitted and did not end yet, including the abandoned ones, so the
+# hedged requests are only sent while a thread is free
+_in_flight_lock = threading.Lock()
+_in_flight_attempts_no = 0
+_registry_lock = threading.Lock()
+_circuit_breakers = {}
+_latency_trackers = {}
+_statistics = {}
+# marks a stream which ended before its first event
+_END_OF_STREAM = object()
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when a call does not finish before its deadline."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the backend while the circuit of an operation is open."""
+
+
+class LatencyTracker:
+    """
+    Keeps the latencies of the most recent successful calls of an operation, from which the
+    delay of the hedged requests is estimated.
+    """
+
+    def __init__(self, window_size=LATENCY_WINDOW_SIZE):
+        """
+        Initialize the LatencyTracker instance.
+
+        Parameters
+        ----------
+        window_size : int, optional
+            The number of most recent latencies kept (default is `LATENCY_WINDOW_SIZE`).
+        """
+
+        self.latencies = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        """Adds the latency of a successful call."""
+
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def get_percentile(self, percentile, default):
+        """
+        Returns a percentile of the recent latencies.
+
+        Parameters
+        ----------
+        percentile : float
+            The percentile, between 0 and 100.
+        default : float
+            The value returned while there are fewer than `HEDGE_MIN_SAMPLES` latencies.
+
+        Returns
+        -------
+        float
+            The percentile, in seconds.
+        """
+
+        with self._lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return default
+
+            latencies = sorted(self.latencies)
+
+        return latencies[min(int(percentile / 100 * len(latencies)), len(latencies) - 1)]
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker which opens after `failure_threshold` consecutive failures of the backend
+    and then rejects the calls for `reset_timeout` seconds. Afterwards, a single trial call is
+    let through, which closes the circuit if it succeeds or opens it again if it fails.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT
+    ):
+        """
+        Initialize the CircuitBreaker instance.
+
+        Parameters
+        ----------
+        failure_threshold : int, optional
+            The number of consecutive failures which open the circuit
+            (default is `CIRCUIT_FAILURE_THRESHOLD`).
+        reset_timeout : float, optional
+            The seconds during which an open circuit rejects the calls
+            (default is `CIRCUIT_RESET_TIMEOUT`).
+        """
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures_no = 0
+        self.opened_time = None
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """
+        Returns whether a call may be sent to the backend. Once the reset timeout of an open
+        circuit has passed, only the first caller is let through as the trial call.
+
+        Returns
+        -------
+        bool
+            Whether the call may be sent.
+        """
+
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            if (
+                self.state == self.OPEN
+                and time.monotonic() - self.opened_time >= self.reset_timeout
+            ):
+                self.state = self.HALF_OPEN
+                return True
+
+            return False
+
+    def record_success(self):
+        """Closes the circuit after a call which reached a healthy backend."""
+
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures_no = 0
+
+    def record_failure(self):
+        """Counts a failure of the backend, which may open the circuit."""
+
+        with self._lock:
+            self.failures_no += 1
+
+            if self.state == self.HALF_OPEN or self.failures_no >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_time = time.monotonic()
+
+
+def _get_registered(registry, operation, create):
+    """Returns the object of an operation from a registry, created on its first use."""
+
+    registered = registry.get(operation)
+
+    if registered is None:
+        with _registry_lock:
+            registered = registry.setdefault(operation, create())
+
+    return registered
+
+
+def get_circuit_breaker(operation):
+    """Returns the circuit breaker of an operation, such as 'retrieve'."""
+
+    return _get_registered(_circuit_breakers, operation, CircuitBreaker)
+
+
+def get_latency_tracker(operation):
+    """Returns the tracker of the latencies of an operation, such as 'retrieve'."""
+
+    return _get_registered(_latency_trackers, operation, LatencyTracker)
+
+
+def _count(operation, event):
+    """Counts an event of an operation, such as a retry or a hedged request."""
+
+    with _registry_lock:
+        operation_statistics = _statistics.setdefault(operation, {})
+        operation_statistics[event] = operation_statistics.get(event, 0) + 1
+
+
+def get_statistics():
+    """
+    Returns the number of calls, retries, hedged requests, exceeded deadlines and rejections by
+    open circuits of every operation, together with the state of its circuit.
+
+    Returns
+    -------
+    dict
+        The statistics of every operation.
+    """
+
+    with _registry_lock:
+        statistics = {
+            operation: dict(operation_statistics)
+            for operation, operation_statistics in _statistics.items()
+        }
+
+    for operation, circuit_breaker in list(_circuit_breakers.items()):
+        statistics.setdefault(operation, {})["circuit_state"] = circuit_breaker.state
+
+    return statistics
+
+
+def is_retryable(error):
+    """
+    Returns whether an error is transient, such as throttling, so the call can be retried.
+
+    Parameters
+    ----------
+    error : Exception
+        The error raised by the call.
+
+    Returns
+    -------
+    bool
+        Whether the call can be retried.
+    """
+
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in RETRYABLE_ERROR_CODES
+
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+def is_backend_failure(error):
+    """
+    Returns whether an error shows that the backend is unhealthy, unlike the errors caused by
+    an invalid request.
+
+    Parameters
+    ----------
+    error : Exception
+        The error raised by the call.
+
+    Returns
+    -------
+    bool
+        Whether the error counts as a failure of the circuit breaker.
+    """
+
+    if isinstance(error, ClientError):
+        status_code = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        return is_retryable(error) or status_code >= 500
+
+    return isinstance(error, (DeadlineExceededError, *TRANSIENT_ERRORS))
+
+
+def get_backoff_delay(attempt):
+    """
+    Returns the delay before a retry, drawn uniformly up to an exponentially growing bound, so
+    the retries of concurrent callers are spread out.
+
+    Parameters
+    ----------
+    attempt : int
+        The number of failed attempts, starting from 1.
+
+    Returns
+    -------
+    float
+        The delay, in seconds.
+    """
+
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+
+def _run_attempt(function, kwargs):
+    """Runs an attempt of a call and returns its result with its latency."""
+
+    start_time = time.perf_counter()
+    result = function(**kwargs)
+
+    return result, time.perf_counter() - start_time
+
+
+def _end_attempt(_):
+    """Counts an attempt which ended, whether it succeeded, failed or was cancelled."""
+
+    global _in_flight_attempts_no
+
+    with _in_flight_lock:
+        _in_flight_attempts_no -= 1
+
+
+def _submit_attempt(function, kwargs, max_in_flight=None):
+    """
+    Submits an attempt of a call to the shared threads.
+
+    Parameters
+    ----------
+    function : callable
+        The function of the call.
+    kwargs : dict
+        The arguments of the function.
+    max_in_flight : int, optional
+        The number of attempts in flight from which the attempt is not submitted. If None,
+        the attempt is always submitted (default is None).
+
+    Returns
+    -------
+    concurrent.futures.Future or None
+        The future of the attempt, or None if too many attempts are in flight.
+    """
+
+    global _in_flight_attempts_no
+
+    with _in_flight_lock:
+        if max_in_flight is not None and _in_flight_attempts_no >= max_in_flight:
+            return None
+
+        _in_flight_attempts_no += 1
+
+    attempt = _executor.submit(_run_attempt, function, kwargs)
+    attempt.add_done_callback(_end_attempt)
+
+    return attempt
+
+
+def _call_once(operation, function, kwargs, end_time, hedge):
+    """
+    Runs an attempt of a call, hedged by a duplicate request if it is slower than the
+    `HEDGE_PERCENTILE` percentile of the recent calls while a thread is free, and returns the
+    first result. The attempts which are still queued when the call ends are cancelled.
+    """
+
+    attempts = {_submit_attempt(function, kwargs)}
+
+    try:
+        if hedge:
+            hedge_delay = get_latency_tracker(operation).get_percentile(
+                HEDGE_PERCENTILE, HEDGE_DEFAULT_DELAY
+            )
+            done, _ = wait(attempts, timeout=min(hedge_delay, max(end_time - time.monotonic(), 0)))
+
+            if len(done) == 0 and time.monotonic() < end_time:
+                # the abandoned attempts may hold the threads, which the duplicate would wait for
+                hedged_attempt = _submit_attempt(function, kwargs, RESILIENCE_WORKERS_NO)
+
+                if hedged_attempt is None:
+                    _count(operation, "skipped_hedges")
+                else:
+                    _count(operation, "hedged_requests")
+                    attempts.add(hedged_attempt)
+
+        error = None
+
+        # the first successful attempt wins, while a failed one waits for its duplicate. Only
+        # the latency of the winner is recorded, so the slow attempts replaced by their
+        # duplicates do not raise the delay of the next hedged requests
+        while len(attempts) != 0:
+            done, attempts = wait(
+                attempts, timeout=max(end_time - time.monotonic(), 0), return_when=FIRST_COMPLETED
+            )
+
+            if len(done) == 0:
+                raise DeadlineExceededError(f"The {operation} call exceeded its deadline.")
+
+            for attempt in done:
+                if attempt.exception() is None:
+                    result, latency = attempt.result()
+                    get_latency_tracker(operation).record(latency)
+
+                    return result
+
+                error = attempt.exception()
+
+        raise error
+
+    finally:
+        # an attempt which did not start yet never runs, and one which runs ends in the
+        # background at the read timeout of the client, so it is counted as abandoned
+        for attempt in attempts:
+            if not attempt.cancel() and not attempt.done():
+                _count(operation, "abandoned_attempts")
+
+
+def call_with_resilience(operation, function, deadline, hedge=False, **kwargs):
+    """
+    Calls a backend function within a deadline, retrying transient errors with a jittered
+    exponential backoff while the deadline allows it, through the circuit breaker of the
+    operation.
+
+    Parameters
+    ----------
+    operation : str
+        The name of the operation, such as 'retrieve', which has its own circuit breaker and
+        latency statistics.
+    function : callable
+        The function, such as the `retrieve` method of a client.
+    deadline : float
+        The seconds within which the call must succeed, including the retries.
+    hedge : bool, optional
+        Whether a duplicate request is sent if the call is slower than usual, which is only
+        safe for idempotent calls (default is False).
+    **kwargs
+        The arguments of the function.
+
+    Returns
+    -------
+    object
+        The result of the function.
+
+    Raises
+    ------
+    CircuitOpenError
+        If the circuit of the operation is open.
+    DeadlineExceededError
+        If the call does not succeed before its deadline.
+    Exception
+        The error of the last attempt, if it is not retryable or no attempts are left.
+    """
+
+    circuit_breaker = get_circuit_breaker(operation)
+
+    if not circuit_breaker.allow_request():
+        _count(operation, "circuit_rejections")
+        raise CircuitOpenError(f"The circuit of {operation} is open after repeated failures.")
+
+    _count(operation, "calls")
+    end_time = time.monotonic() + deadline
+    attempt = 0
+
+    while True:
+        try:
+            result = _call_once(operation, function, kwargs, end_time, hedge)
+        except Exception as error:
+            attempt += 1
+            backoff_delay = get_backoff_delay(attempt)
+
+            if (
+                not is_retryable(error)
+                or attempt >= RETRY_MAX_ATTEMPTS
+                or time.monotonic() + backoff_delay >= end_time
+            ):
+                if isinstance(error, DeadlineExceededError):
+                    _count(operation, "deadlines_exceeded")
+
+                # the errors of invalid requests show that the backend answers
+                if is_backend_failure(error):
+                    circuit_breaker.record_failure()
+                else:
+                    circuit_breaker.record_success()
+
+                raise
+
+            _count(operation, "retries")
+            time.sleep(backoff_delay)
+        else:
+            circuit_breaker.record_success()
+            return result
+
+
+def call_stream_with_resilience(operation, function, deadline, stream_key, **kwargs):
+    """
+    Opens a streaming call like `call_with_resilience`, where the deadline also covers the
+    first event of the stream, so a model which is slow to answer is cut short.
+
+    Parameters
+    ----------
+    operation : str
+        The name of the operation, such as 'invoke_agent'.
+    function : callable
+        The function which opens the stream, such as the `invoke_agent` method of a client.
+    deadline : float
+        The seconds within which the first event must arrive, including the retries.
+    stream_key : str
+        The key of the stream of events in the response, such as 'completion'.
+    **kwargs
+        The arguments of the function.
+
+    Returns
+    -------
+    dict
+        The response, whose stream yields all events, including the first one.
+    """
+
+    def open_stream(**kwargs):
+        response = function(**kwargs)
+        events = iter(response[stream_key])
+
+        return response, events, next(events, _END_OF_STREAM)
+
+    response, events, first_event = call_with_resilience(
+        operation, open_stream, deadline, **kwargs
+    )
+
+    def generate_events():
+        if first_event is not _END_OF_STREAM:
+            yield first_event
+        yield from events
+
+    return {**response, stream_key: generate_events()}
+
+
+def reset():
+    """Closes all circuits and forgets the latencies and statistics, such as between tests."""
+
+    with _registry_lock:
+        _circuit_breakers.clear()
+        _latency_trackers.clear()
+        _statistics.clear()
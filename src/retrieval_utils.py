@@ -0,0 +1,132 @@
+"""
+This module provides the helpers of the multi-query retrieval. Compound questions, such as
+'Are there disruptions in Amsterdam and can I bring my bike?', are split into sub-queries whose
+retrievals are merged with reciprocal rank fusion, so every part of the question gets its own
+relevant documents.
+"""
+
+import re
+
+# the words which start a new question inside a compound question
+QUESTION_WORDS = (
+    "am|are|can|could|do|does|did|how|is|may|must|should|what|when|where|which|who|why|will|"
+    "would|was|were"
+)
+SENTENCE_SEPARATOR = re.compile(r"(?<=[?!.;])\s+")
+QUESTION_SEPARATOR = re.compile(rf",?\s+(?:and|also|plus)\s+(?=(?:{QUESTION_WORDS})\b)", re.I)
+MIN_SUB_QUERY_WORDS = 3
+
+
+def split_compound_query(query, max_sub_queries):
+    """
+    Splits a compound question into its sub-questions, at sentence boundaries and at
+    conjunctions followed by a question word.
+
+    Parameters
+    ----------
+    query : str
+        The user's query.
+    max_sub_queries : int
+        The maximum number of sub-queries, where the last ones are merged if there are more.
+
+    Returns
+    -------
+    list of str
+        The sub-queries, which contain only the query if it is not compound.
+    """
+
+    sub_queries = []
+
+    for sentence in SENTENCE_SEPARATOR.split(query.strip()):
+        for sub_query in QUESTION_SEPARATOR.split(sentence):
+            sub_query = sub_query.strip(" ?!.;,")
+
+            # short fragments such as 'if so' belong to the previous sub-query
+            if len(sub_query.split()) < MIN_SUB_QUERY_WORDS and len(sub_queries) != 0:
+                sub_queries[-1] = f"{sub_queries[-1]} {sub_query}"
+            elif len(sub_query) != 0:
+                sub_queries.append(sub_query)
+
+    if len(sub_queries) > max_sub_queries:
+        sub_queries[max_sub_queries - 1 :] = [" ".join(sub_queries[max_sub_queries - 1 :])]
+
+    return sub_queries if len(sub_queries) > 1 else [query]
+
+
+def get_document_key(document):
+    """Returns the key which identifies a retrieved document, its name and page."""
+
+    return document["document_name"], document["page_number"]
+
+
+def fuse_rankings(rankings, documents_no, rrf_k=60):
+    """
+    Merges rankings of documents with reciprocal rank fusion, where every document scores
+    1 / (`rrf_k` + rank) in every ranking which contains it, and removes the duplicates of
+    the same document and page.
+
+    Parameters
+    ----------
+    rankings : list of list of dict
+        The retrieved documents of every query, from the most relevant one.
+    documents_no : int
+        The number of fused documents.
+    rrf_k : int, optional
+        The constant which dampens the weight of the first ranks (default is 60).
+
+    Returns
+    -------
+    list of dict
+        The fused documents, from the most relevant one.
+    """
+
+    scores = {}
+    documents = {}
+
+    for ranking in rankings:
+        ranked_keys = set()
+
+        for rank, document in enumerate(ranking, start=1):
+            document_key = get_document_key(document)
+
+            # a page is counted once per ranking, at its best rank
+            if document_key in ranked_keys:
+                continue
+
+            ranked_keys.add(document_key)
+            documents.setdefault(document_key, document)
+            scores[document_key] = scores.get(document_key, 0.0) + 1 / (rrf_k + rank)
+
+    fused_keys = sorted(scores, key=scores.get, reverse=True)[:documents_no]
+
+    return [documents[document_key] for document_key in fused_keys]
+
+
+def format_documents_metadata(retrieved_documents):
+    """
+    Builds the list of the names and pages of the retrieved documents displayed to the user.
+
+    Parameters
+    ----------
+    retrieved_documents : list of dict
+        The retrieved documents.
+
+    Returns
+    -------
+    str
+        The unique document name - page number pairs, formatted as Markdown.
+    """
+
+    retrieved_documents_metadata = "**Retrieved documents:**\n"
+    included_documents = set()
+
+    # include only unique document name - page number pairs
+    for retrieved_document in retrieved_documents:
+        if get_document_key(retrieved_document) in included_documents:
+            continue
+
+        retrieved_documents_metadata += f"- {retrieved_document['document_name']}"
+        retrieved_documents_metadata += f", page {retrieved_document['page_number']}\n"
+        included_documents.add(get_document_key(retrieved_document))
+
+    return retrieved_documents_metadata
@@ -0,0 +1,613 @@
+"""
+This module provides the retrievers of the RAG chatbot, which return the most relevant chunks of
+the NS documents for a query. The knowledge base retriever calls the Bedrock knowledge base,
+while the local retriever searches the chunk embeddings stored in a memory-mapped NumPy matrix,
+optionally quantized to int8, without any network call. The embedders of the local index are
+pluggable, so the index can also be built and queried offline with a deterministic embedder.
+The hybrid retriever fuses the results of either retriever with those of the BM25 index.
+"""
+
+import os
+import json
+import zlib
+import threading
+
+import numpy as np
+
+from bedrock_clients import get_client
+from resilience import call_with_resilience
+from retrieval_utils import fuse_rankings
+from lexical_index import get_lexical_index
+from caching import normalize_query, get_query_features, compute_directory_fingerprint
+from config import (
+    KNOWLEDGE_BASE_ID,
+    RETRIEVE_DEADLINE,
+    HEDGED_RETRIEVAL,
+    RETRIEVER_BACKEND,
+    LOCAL_INDEX_PATH,
+    LOCAL_INDEX_EMBEDDER,
+    LOCAL_INDEX_QUANTIZE,
+    EMBEDDING_MODEL_ID,
+    EMBEDDING_DEADLINE,
+    HASHING_EMBEDDING_DIMENSIONS,
+    HYBRID_RETRIEVAL,
+    HYBRID_CANDIDATES_NO,
+    RRF_K,
+)
+
+INDEX_METADATA_FILE = "index.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+SCALES_FILE = "scales.npy"
+CHUNKS_FILE = "chunks.jsonl"
+# the rows of the int8 matrix converted to float at once, which bounds the temporary memory
+SEARCH_BLOCK_ROWS = 16384
+# the maximum number of texts embedded by a single Bedrock request
+EMBEDDING_BATCH_SIZE = 96
+
+# the local indexes are loaded once and shared by all sessions, like the AWS clients
+_local_retrievers_lock = threading.Lock()
+# the loaded retriever of every index, with the modification time of its metadata file
+_local_retrievers = {}
+
+
+def normalize_rows(matrix):
+    """
+    Scales the rows of a matrix to unit length, so their dot products are cosine similarities.
+
+    Parameters
+    ----------
+    matrix : numpy.ndarray
+        The matrix, with a vector per row.
+
+    Returns
+    -------
+    numpy.ndarray
+        The float32 matrix with unit-length rows, where the zero rows are kept.
+    """
+
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    return matrix / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+class HashingEmbedder:
+    """
+    A deterministic local embedder which hashes the words and character trigrams of a text into
+    a fixed number of dimensions. It needs no model, so tests and offline runs are reproducible,
+    while its quality is that of a lexical search.
+    """
+
+    def __init__(self, dimensions=HASHING_EMBEDDING_DIMENSIONS):
+        """
+        Initialize the HashingEmbedder instance.
+
+        Parameters
+        ----------
+        dimensions : int, optional
+            The number of dimensions of the embeddings
+            (default is `HASHING_EMBEDDING_DIMENSIONS`).
+        """
+
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}"
+
+    def embed(self, texts, input_type="search_document"):
+        """
+        Embeds texts, where the queries and the documents are embedded in the same way.
+
+        Parameters
+        ----------
+        texts : list of str
+            The texts to embed.
+        input_type : str, optional
+            Either 'search_query' or 'search_document', ignored by this embedder
+            (default is 'search_document').
+
+        Returns
+        -------
+        numpy.ndarray
+            The float32 unit-length embeddings, with a row per text.
+        """
+
+        embeddings = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+
+        for text_index, text in enumerate(texts):
+            for feature, weight in get_query_features(normalize_query(text)).items():
+                feature_hash = zlib.crc32(feature.encode("utf-8"))
+                # the sign bit spreads the collisions of the features around zero
+                sign = 1.0 if feature_hash & 0x80000000 else -1.0
+                embeddings[text_index, feature_hash % self.dimensions] += sign * weight
+
+        return normalize_rows(embeddings)
+
+
+class BedrockEmbedder:
+    """
+    An embedder which calls an embedding model of Bedrock, by default Cohere Embed English V3
+    like the knowledge base.
+    """
+
+    def __init__(self, runtime_client=None, model_id=EMBEDDING_MODEL_ID):
+        """
+        Initialize the BedrockEmbedder instance.
+
+        Parameters
+        ----------
+        runtime_client : object, optional
+            The Bedrock Runtime client. If None, the client shared by all chatbots is used
+            (default is None).
+        model_id : str, optional
+            The identifier of the embedding model (default is `EMBEDDING_MODEL_ID`).
+        """
+
+        if runtime_client is None:
+            runtime_client = get_client("bedrock-runtime")
+        self.runtime_client = runtime_client
+        self.name = model_id
+
+    def embed(self, texts, input_type="search_document"):
+        """
+        Embeds texts in batches.
+
+        Parameters
+        ----------
+        texts : list of str
+            The texts to embed.
+        input_type : str, optional
+            Either 'search_query' or 'search_document' (default is 'search_document').
+
+        Returns
+        -------
+        numpy.ndarray
+            The float32 unit-length embeddings, with a row per text.
+        """
+
+        embeddings = []
+
+        for batch_start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            response = call_with_resilience(
+                "embed",
+                self.runtime_client.invoke_model,
+                EMBEDDING_DEADLINE,
+                body=json.dumps(
+                    {
+                        "texts": texts[batch_start : batch_start + EMBEDDING_BATCH_SIZE],
+                        "input_type": input_type,
+                        "truncate": "END",
+                    }
+                ),
+                modelId=self.name,
+                accept="application/json",
+                contentType="application/json",
+            )
+            embeddings.extend(json.loads(response.get("body").read())["embeddings"])
+
+        return normalize_rows(np.array(embeddings, dtype=np.float32).reshape(len(texts), -1))
+
+
+def create_embedder(embedder_name=LOCAL_INDEX_EMBEDDER, runtime_client=None):
+    """
+    Creates an embedder from its name.
+
+    Parameters
+    ----------
+    embedder_name : str, optional
+        Either 'hashing' or 'bedrock' (default is `LOCAL_INDEX_EMBEDDER`).
+    runtime_client : object, optional
+        The Bedrock Runtime client of the Bedrock embedder (default is None).
+
+    Returns
+    -------
+    HashingEmbedder or BedrockEmbedder
+        The embedder.
+    """
+
+    if embedder_name == "hashing":
+        return HashingEmbedder()
+
+    if embedder_name == "bedrock":
+        return BedrockEmbedder(runtime_client)
+
+    raise ValueError(f"Unknown embedder '{embedder_name}', use 'hashing' or 'bedrock'.")
+
+
+class KnowledgeBaseRetriever:
+    """
+    A retriever which searches the Bedrock knowledge base, configured with a vector store
+    indexed with Embed English V3 embeddings.
+    """
+
+    def __init__(self, agent_runtime_client, knowledge_base_id=KNOWLEDGE_BASE_ID):
+        """
+        Initialize the KnowledgeBaseRetriever instance.
+
+        Parameters
+        ----------
+        agent_runtime_client : object
+            The Bedrock Agent Runtime client.
+        knowledge_base_id : str, optional
+            The identifier of the knowledge base (default is `KNOWLEDGE_BASE_ID`).
+        """
+
+        self.agent_runtime_client = agent_runtime_client
+        self.knowledge_base_id = knowledge_base_id
+        # identifies the retrieved documents in the retrieval cache
+        self.cache_key = ("knowledge_base", knowledge_base_id)
+
+    def retrieve(self, query, documents_no):
+        """
+        Retrieves the most similar chunks from the knowledge base.
+
+        Parameters
+        ----------
+        query : str
+            The query.
+        documents_no : int
+            The number of retrieved chunks.
+
+        Returns
+        -------
+        list of dict
+            The retrieved chunks with their 'document_name', 'page_number' and 'content'.
+        """
+
+        # the retrieve API is idempotent, so it can be hedged
+        response = call_with_resilience(
+            "retrieve",
+            self.agent_runtime_client.retrieve,
+            RETRIEVE_DEADLINE,
+            hedge=HEDGED_RETRIEVAL,
+            knowledgeBaseId=self.knowledge_base_id,
+            retrievalQuery={"text": query},
+            retrievalConfiguration={"vectorSearchConfiguration": {"numberOfResults": documents_no}},
+        )
+
+        retrieved_documents = []
+
+        for document in response["retrievalResults"]:
+            metadata = document["metadata"]
+            retrieved_documents.append(
+                {
+                    "document_name": metadata["x-amz-bedrock-kb-source-uri"].split("/")[-1][:-4],
+                    "page_number": int(metadata["x-amz-bedrock-kb-document-page-number"]),
+                    "content": document["content"]["text"],
+                }
+            )
+
+        return retrieved_documents
+
+
+class LocalVectorRetriever:
+    """
+    A retriever which searches the chunk embeddings of a local index with a vectorized dot
+    product. The embeddings are memory-mapped, so the index loads instantly and its pages are
+    shared by all processes, and int8 embeddings take a quarter of the memory of float32 ones.
+    """
+
+    def __init__(self, index_path=LOCAL_INDEX_PATH, embedder=None):
+        """
+        Initialize the LocalVectorRetriever instance.
+
+        Parameters
+        ----------
+        index_path : str, optional
+            The directory of the index, written by `build_local_index`
+            (default is `LOCAL_INDEX_PATH`).
+        embedder : object, optional
+            The embedder of the queries, which must be the one which built the index. If None,
+            the embedder is created from the name stored in the index (default is None).
+        """
+
+        with open(os.path.join(index_path, INDEX_METADATA_FILE), encoding="utf-8") as index_file:
+            self.metadata = json.load(index_file)
+
+        if embedder is None:
+            if self.metadata["embedder_type"] == "hashing":
+                embedder = HashingEmbedder(self.metadata["dimensions"])
+            else:
+                embedder = BedrockEmbedder(model_id=self.metadata["embedder"])
+        if embedder.name != self.metadata["embedder"]:
+            raise ValueError(
+                f"The index was built with the '{self.metadata['embedder']}' embedder,"
+                f" not with '{embedder.name}'."
+            )
+
+        self.index_path = index_path
+        self.embedder = embedder
+        self.embeddings = np.load(os.path.join(index_path, EMBEDDINGS_FILE), mmap_mode="r")
+        self.scales = (
+            np.load(os.path.join(index_path, SCALES_FILE))
+            if self.metadata["dtype"] == "int8"
+            else None
+        )
+
+        with open(os.path.join(index_path, CHUNKS_FILE), encoding="utf-8") as chunks_file:
+            self.chunks = [json.loads(line) for line in chunks_file]
+
+        # a rebuilt index has a new fingerprint, so the cached retrievals are not reused
+        self.cache_key = ("local", os.path.abspath(index_path), self.metadata["fingerprint"])
+
+    def search(self, query_embedding, documents_no):
+        """
+        Finds the chunks whose embeddings are the most similar to a query embedding.
+
+        Parameters
+        ----------
+        query_embedding : numpy.ndarray
+            The unit-length embedding of the query.
+        documents_no : int
+            The number of chunks to find.
+
+        Returns
+        -------
+        numpy.ndarray
+            The indexes of the chunks, from the most similar one.
+        numpy.ndarray
+            Their cosine similarities with the query.
+        """
+
+        chunks_no = self.embeddings.shape[0]
+        documents_no = min(documents_no, chunks_no)
+
+        if documents_no == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        if self.scales is None:
+            scores = self.embeddings @ query_embedding
+        else:
+            scores = np.empty(chunks_no, dtype=np.float32)
+
+            for block_start in range(0, chunks_no, SEARCH_BLOCK_ROWS):
+                block_end = block_start + SEARCH_BLOCK_ROWS
+                scores[block_start:block_end] = (
+                    self.embeddings[block_start:block_end].astype(np.float32) @ query_embedding
+                ) * self.scales[block_start:block_end]
+
+        # select the top chunks in linear time and sort only them
+        top_indexes = np.argpartition(-scores, documents_no - 1)[:documents_no]
+        top_indexes = top_indexes[np.argsort(-scores[top_indexes])]
+
+        return top_indexes, scores[top_indexes]
+
+    def retrieve(self, query, documents_no):
+        """
+        Retrieves the most similar chunks from the local index.
+
+        Parameters
+        ----------
+        query : str
+            The query.
+        documents_no : int
+            The number of retrieved chunks.
+
+        Returns
+        -------
+        list of dict
+            The retrieved chunks with their 'document_name', 'page_number' and 'content'.
+        """
+
+        query_embedding = self.embedder.embed([query], input_type="search_query")[0]
+        top_indexes, _ = self.search(query_embedding, documents_no)
+
+        return [
+            {
+                "document_name": self.chunks[chunk_index]["document_name"],
+                "page_number": self.chunks[chunk_index]["page_number"],
+                "content": self.chunks[chunk_index]["content"],
+            }
+            for chunk_index in top_indexes
+        ]
+
+
+class HybridRetriever:
+    """
+    A retriever which fuses the results of a vector retriever with those of the BM25 index
+    with reciprocal rank fusion, so the chunks containing the exact terms of a query, such as
+    'OV-chipkaart' or '7.50', are retrieved even when their embeddings are not the closest.
+    """
+
+    def __init__(self, retriever, lexical_index, candidates_no=HYBRID_CANDIDATES_NO):
+        """
+        Initialize the HybridRetriever instance.
+
+        Parameters
+        ----------
+        retriever : object
+            The vector retriever, such as `KnowledgeBaseRetriever`.
+        lexical_index : LexicalIndex
+            The BM25 index.
+        candidates_no : int, optional
+            The number of chunks retrieved by each of them before the fusion
+            (default is `HYBRID_CANDIDATES_NO`).
+        """
+
+        self.retriever = retriever
+        self.lexical_index = lexical_index
+        self.candidates_no = candidates_no
+        self.cache_key = ("hybrid", *retriever.cache_key, *lexical_index.cache_key)
+
+    def retrieve(self, query, documents_no):
+        """
+        Retrieves the chunks with the best fused ranks.
+
+        Parameters
+        ----------
+        query : str
+            The query.
+        documents_no : int
+            The number of retrieved chunks.
+
+        Returns
+        -------
+        list of dict
+            The retrieved chunks with their 'document_name', 'page_number' and 'content'.
+        """
+
+        candidates_no = max(documents_no, self.candidates_no)
+        rankings = [
+            self.retriever.retrieve(query, candidates_no),
+            self.lexical_index.retrieve(query, candidates_no),
+        ]
+
+        return fuse_rankings(rankings, documents_no, RRF_K)
+
+
+def quantize_embeddings(embeddings):
+    """
+    Quantizes embeddings to int8 with a scale per row, so every row keeps the full int8 range.
+
+    Parameters
+    ----------
+    embeddings : numpy.ndarray
+        The float32 embeddings.
+
+    Returns
+    -------
+    numpy.ndarray
+        The int8 embeddings.
+    numpy.ndarray
+        The float32 scales, where a row is approximately its int8 values times its scale.
+    """
+
+    scales = np.abs(embeddings).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    quantized_embeddings = np.round(embeddings / scales[:, np.newaxis]).astype(np.int8)
+
+    return quantized_embeddings, scales.astype(np.float32)
+
+
+def _write_index_file(index_path, file_name, write_file):
+    """Writes a file of an index to a temporary path first, so it is replaced at once."""
+
+    temporary_path = os.path.join(index_path, f"tmp_{file_name}")
+    write_file(temporary_path)
+    os.replace(temporary_path, os.path.join(index_path, file_name))
+
+
+def build_local_index(chunks, embedder, index_path=LOCAL_INDEX_PATH, quantize=LOCAL_INDEX_QUANTIZE):
+    """
+    Embeds chunks and writes them as a local index. The metadata file is replaced last, so a
+    retriever never loads a partially written index.
+
+    Parameters
+    ----------
+    chunks : list of dict
+        The chunks with their 'document_name', 'page_number' and 'content'.
+    embedder : object
+        The embedder of the chunks, such as `HashingEmbedder`.
+    index_path : str, optional
+        The directory of the index (default is `LOCAL_INDEX_PATH`).
+    quantize : bool, optional
+        Whether the embeddings are stored as int8 (default is `LOCAL_INDEX_QUANTIZE`).
+
+    Returns
+    -------
+    dict
+        The metadata of the index.
+    """
+
+    os.makedirs(index_path, exist_ok=True)
+    embeddings = embedder.embed([chunk["content"] for chunk in chunks])
+
+    if quantize:
+        embeddings, scales = quantize_embeddings(embeddings)
+        _write_index_file(index_path, SCALES_FILE, lambda file_path: np.save(file_path, scales))
+
+    _write_index_file(
+        index_path, EMBEDDINGS_FILE, lambda file_path: np.save(file_path, embeddings)
+    )
+
+    def write_chunks(file_path):
+        with open(file_path, "w", encoding="utf-8") as chunks_file:
+            for chunk in chunks:
+                chunk_record = {
+                    "document_name": chunk["document_name"],
+                    "page_number": chunk["page_number"],
+                    "content": chunk["content"],
+                }
+                chunks_file.write(json.dumps(chunk_record, ensure_ascii=False) + "\n")
+
+    _write_index_file(index_path, CHUNKS_FILE, write_chunks)
+
+    metadata = {
+        "embedder": embedder.name,
+        "embedder_type": "hashing" if isinstance(embedder, HashingEmbedder) else "bedrock",
+        "dimensions": int(embeddings.shape[1]),
+        "dtype": str(embeddings.dtype),
+        "chunks_no": len(chunks),
+        # the previous metadata file is not replaced yet, so it is not part of the fingerprint
+        "fingerprint": compute_directory_fingerprint(index_path, (INDEX_METADATA_FILE,)),
+    }
+
+    def write_metadata(file_path):
+        with open(file_path, "w", encoding="utf-8") as index_file:
+            json.dump(metadata, index_file, indent=4)
+
+    _write_index_file(index_path, INDEX_METADATA_FILE, write_metadata)
+
+    return metadata
+
+
+def get_local_retriever(index_path=LOCAL_INDEX_PATH):
+    """
+    Returns the local retriever of an index, which is shared by all sessions and loaded again
+    once the index is rebuilt, as its metadata file is replaced last.
+
+    Parameters
+    ----------
+    index_path : str, optional
+        The directory of the index (default is `LOCAL_INDEX_PATH`).
+
+    Returns
+    -------
+    LocalVectorRetriever
+        The shared retriever.
+    """
+
+    index_path = os.path.abspath(index_path)
+    modification_time = os.stat(os.path.join(index_path, INDEX_METADATA_FILE)).st_mtime_ns
+
+    with _local_retrievers_lock:
+        loaded_time, retriever = _local_retrievers.get(index_path, (None, None))
+
+        if loaded_time != modification_time:
+            retriever = LocalVectorRetriever(index_path)
+            _local_retrievers[index_path] = (modification_time, retriever)
+
+    return retriever
+
+
+def create_retriever(agent_runtime_client, backend=RETRIEVER_BACKEND, hybrid=HYBRID_RETRIEVAL):
+    """
+    Creates the retriever of the RAG chatbot, which is hybrid if the BM25 index was built.
+
+    Parameters
+    ----------
+    agent_runtime_client : object
+        The Bedrock Agent Runtime client of the knowledge base retriever.
+    backend : str, optional
+        Either 'knowledge_base' or 'local' (default is `RETRIEVER_BACKEND`).
+    hybrid : bool, optional
+        Whether the results are fused with those of the BM25 index (default is
+        `HYBRID_RETRIEVAL`).
+
+    Returns
+    -------
+    KnowledgeBaseRetriever, LocalVectorRetriever or HybridRetriever
+        The retriever.
+    """
+
+    if backend == "knowledge_base":
+        retriever = KnowledgeBaseRetriever(agent_runtime_client)
+    elif backend == "local":
+        retriever = get_local_retriever()
+    else:
+        raise ValueError(f"Unknown retriever '{backend}', use 'knowledge_base' or 'local'.")
+
+    lexical_index = get_lexical_index() if hybrid else None
+
+    if lexical_index is None:
+        return retriever
+
+    return HybridRetriever(retriever, lexical_index)
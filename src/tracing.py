@@ -0,0 +1,367 @@
+"""
+This module provides a lightweight tracing of the chatbot pipeline. Every stage of a turn, such
+as the retrieval, the prompt construction, the time to the first token or the generation, is
+timed by a span, which is emitted as a JSON log and aggregated into in-process histograms.
+When tracing is disabled, every span is the same object whose methods do nothing, so the
+instrumented code only pays a function call.
+"""
+
+import json
+import time
+import uuid
+import bisect
+import logging
+import threading
+import contextvars
+
+from utils import load_env_variables
+
+# the upper bounds of the histogram buckets, from 1 to 1,000,000 in steps of 1, 2 and 5
+HISTOGRAM_BOUNDS = [
+    multiplier * 10**exponent for exponent in range(7) for multiplier in (1, 2, 5)
+][:-2]
+
+logger = logging.getLogger("ns_chatbot.tracing")
+
+_enabled = False
+# the span of the current stage, whose trace and id are inherited by the nested spans
+_current_span = contextvars.ContextVar("current_span", default=None)
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+class Histogram:
+    """
+    A histogram with fixed buckets, whose memory does not grow with the number of values.
+    """
+
+    def __init__(self, bounds=HISTOGRAM_BOUNDS):
+        """
+        Initialize the Histogram instance.
+
+        Parameters
+        ----------
+        bounds : list of float, optional
+            The sorted upper bounds of the buckets, with a last bucket for the larger values
+            (default is `HISTOGRAM_BOUNDS`).
+        """
+
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self._lock = threading.Lock()
+
+    def record(self, value):
+        """Adds a value to its bucket."""
+
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.count += 1
+            self.total += value
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+
+    def get_percentile(self, percentile):
+        """
+        Estimates a percentile as the upper bound of the bucket which contains it, within the
+        range of the recorded values.
+
+        Parameters
+        ----------
+        percentile : float
+            The percentile, between 0 and 100.
+
+        Returns
+        -------
+        float or None
+            The estimated percentile, or None if no values were recorded.
+        """
+
+        with self._lock:
+            if self.count == 0:
+                return None
+
+            rank = percentile / 100 * self.count
+            cumulative_count = 0
+
+            for bucket_index, bucket_count in enumerate(self.counts):
+                cumulative_count += bucket_count
+
+                if cumulative_count >= rank and bucket_count != 0:
+                    upper_bound = (
+                        self.bounds[bucket_index] if bucket_index < len(self.bounds) else self.max
+                    )
+                    return min(max(upper_bound, self.min), self.max)
+
+            return self.max
+
+    def get_summary(self):
+        """
+        Returns the number of values, their mean, their extremes and their main percentiles.
+
+        Returns
+        -------
+        dict
+            The summary of the histogram.
+        """
+
+        with self._lock:
+            count, total, minimum, maximum = self.count, self.total, self.min, self.max
+
+        return {
+            "count": count,
+            "mean": total / count if count != 0 else None,
+            "min": minimum if count != 0 else None,
+            "p50": self.get_percentile(50),
+            "p95": self.get_percentile(95),
+            "p99": self.get_percentile(99),
+            "max": maximum if count != 0 else None,
+        }
+
+
+class Span:
+    """
+    The timing of a stage of the pipeline, used as a context manager. Its attributes, such as
+    the token usage of the model, can be set while the stage runs.
+    """
+
+    def __init__(self, name, attributes):
+        """
+        Initialize the Span instance.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage, such as 'retrieve'.
+        attributes : dict
+            The attributes of the stage.
+        """
+
+        self.name = name
+        self.attributes = attributes
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent = None
+        self.trace_id = None
+        self.start_time = None
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self.trace_id = self.parent.trace_id if self.parent is not None else uuid.uuid4().hex
+        _current_span.set(self)
+
+        self.start_time = time.perf_counter()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.start_time
+
+        # the parent is restored explicitly rather than with a token, as a generator which is
+        # not exhausted may be closed by the garbage collector from another context
+        _current_span.set(self.parent)
+
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+
+        _emit(self.name, duration, self.trace_id, self.span_id, self.parent, self.attributes)
+
+        return False
+
+    def set(self, **attributes):
+        """Sets attributes of the span."""
+
+        self.attributes.update(attributes)
+
+    def record_duration(self, name, seconds, **attributes):
+        """
+        Records a stage which was timed without a span, such as the time to the first token,
+        as a child of this span.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage.
+        seconds : float
+            The duration of the stage.
+        **attributes
+            The attributes of the stage.
+        """
+
+        _emit(name, seconds, self.trace_id, uuid.uuid4().hex[:16], self, attributes)
+
+
+class DisabledSpan:
+    """The span used when tracing is disabled, which records nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **attributes):
+        """Ignores the attributes."""
+
+    def record_duration(self, name, seconds, **attributes):
+        """Ignores the stage."""
+
+
+_DISABLED_SPAN = DisabledSpan()
+
+
+def _emit(name, duration, trace_id, span_id, parent, attributes):
+    """Logs a finished span as JSON and records its duration and numeric attributes."""
+
+    duration_ms = duration * 1000
+
+    logger.info(
+        json.dumps(
+            {
+                "type": "span",
+                "name": name,
+                "trace_id": trace_id,
+                "span_id": span_id,
+                "parent_id": parent.span_id if parent is not None else None,
+                "timestamp": time.time() - duration,
+                "duration_ms": round(duration_ms, 3),
+                **attributes,
+            },
+            default=str,
+        )
+    )
+
+    record_value(f"{name}.duration_ms", duration_ms)
+    for attribute_name, attribute_value in attributes.items():
+        if isinstance(attribute_value, (int, float)) and not isinstance(attribute_value, bool):
+            record_value(f"{name}.{attribute_name}", attribute_value)
+
+
+def set_enabled(enabled, log_path=None):
+    """
+    Enables or disables tracing. The spans are logged to the given file or to the standard
+    error, unless a handler was already added to the `ns_chatbot.tracing` logger.
+
+    Parameters
+    ----------
+    enabled : bool
+        Whether the spans are recorded.
+    log_path : str, optional
+        The path of the file to which the spans are appended (default is None).
+    """
+
+    global _enabled
+
+    if enabled and len(logger.handlers) == 0:
+        handler = logging.FileHandler(log_path) if log_path else logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+    _enabled = enabled
+
+
+def is_enabled():
+    """Returns whether tracing is enabled."""
+
+    return _enabled
+
+
+def span(name, **attributes):
+    """
+    Creates the span of a stage, to be used as a context manager.
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage, such as 'retrieve'.
+    **attributes
+        The attributes of the stage.
+
+    Returns
+    -------
+    Span or DisabledSpan
+        The span, which does nothing when tracing is disabled.
+    """
+
+    if not _enabled:
+        return _DISABLED_SPAN
+
+    return Span(name, attributes)
+
+
+def record_value(name, value):
+    """
+    Adds a value to the histogram of the given name, which is created on its first value.
+
+    Parameters
+    ----------
+    name : str
+        The name of the histogram, such as 'llm.duration_ms'.
+    value : float
+        The value.
+    """
+
+    if not _enabled:
+        return
+
+    histogram = _histograms.get(name)
+
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(name, Histogram())
+
+    histogram.record(value)
+
+
+def get_token_usage(usage):
+    """
+    Gets the token usage reported by an Anthropic model, such as in its response or in the
+    events of its stream.
+
+    Parameters
+    ----------
+    usage : dict
+        The usage of the response or event.
+
+    Returns
+    -------
+    dict
+        The input and output tokens, when reported.
+    """
+
+    return {
+        token_type: usage[token_type]
+        for token_type in ("input_tokens", "output_tokens")
+        if token_type in usage
+    }
+
+
+def get_histograms():
+    """
+    Returns the summaries of all histograms.
+
+    Returns
+    -------
+    dict
+        The summary of every histogram by its name, sorted by name.
+    """
+
+    with _histograms_lock:
+        histograms = dict(_histograms)
+
+    return {name: histograms[name].get_summary() for name in sorted(histograms)}
+
+
+def reset_histograms():
+    """Removes all histograms."""
+
+    with _histograms_lock:
+        _histograms.clear()
+
+
+_env_variables = load_env_variables()
+set_enabled(_env_variables["enable_tracing"], _env_variables["tracing_log_path"])
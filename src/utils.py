@@ -3,10 +3,12 @@ This module provides utility functions such as loading AWS-related environment v
 """
 
 import os
+import math
+import zipfile
 import boto3
 from dotenv import load_dotenv
 
-from config import BUCKET_NAME, S3_KEY, ZIP_PATH
+from config import BUCKET_NAME, S3_KEY, ZIP_PATH, CHARACTERS_PER_TOKEN
 
 
 def load_env_variables():
@@ -17,7 +19,8 @@ def load_env_variables():
     -------
     dict of str
         A dictionary containing the following environment variables: AWS profile name,
-        AWS region name and the Bedrock Knowledge Base ID.
+        AWS region name, whether the stubbed Bedrock clients are used, whether tracing is
+        enabled and the optional file of the traced spans.
     """
 
     # load env variables from the .evn file
@@ -27,15 +30,85 @@ def load_env_variables():
 
     env_variables["profile_name"] = os.getenv("AWS_PROFILE_NAME", None)
     env_variables["region_name"] = os.getenv("AWS_REGION_NAME", None)
+    env_variables["use_bedrock_stubs"] = os.getenv("USE_BEDROCK_STUBS", "false").lower() == "true"
+    env_variables["enable_tracing"] = os.getenv("ENABLE_TRACING", "false").lower() == "true"
+    env_variables["tracing_log_path"] = os.getenv("TRACING_LOG_PATH", None)
 
     return env_variables
 
 
+def estimate_tokens(text):
+    """
+    Estimates the number of tokens of a text from its length, which is accurate enough to
+    budget the prompt without calling a tokenizer.
+
+    Parameters
+    ----------
+    text : str
+        The text whose tokens are counted.
+
+    Returns
+    -------
+    int
+        The estimated number of tokens.
+    """
+
+    return math.ceil(len(text) / CHARACTERS_PER_TOKEN)
+
+
+def get_stale_lambda_files(zip_path=ZIP_PATH):
+    """
+    Finds the source files of the Lambda function whose copy in its zip file differs from the
+    file next to the zip file, which means the zip file has to be rebuilt by `build_lambda.py`.
+
+    Parameters
+    ----------
+    zip_path : str, optional
+        The path of the zip file of the Lambda function (default is `ZIP_PATH`).
+
+    Returns
+    -------
+    list of str
+        The names of the stale source files.
+    """
+
+    source_directory = os.path.dirname(zip_path)
+    stale_files = []
+
+    with zipfile.ZipFile(zip_path) as lambda_zip:
+        for file_name in lambda_zip.namelist():
+            if not file_name.endswith(".py"):
+                continue
+
+            source_path = os.path.join(source_directory, file_name)
+            if not os.path.exists(source_path):
+                stale_files.append(file_name)
+                continue
+
+            with open(source_path, "rb") as source_file:
+                if source_file.read() != lambda_zip.read(file_name):
+                    stale_files.append(file_name)
+
+    return stale_files
+
+
 def load_lambda_zip():
     """
     Loads the zip file with the Lambda function to S3.
+
+    Raises
+    ------
+    ValueError
+        If the zip file is stale, so an outdated Lambda function is never deployed.
     """
 
+    stale_files = get_stale_lambda_files()
+    if len(stale_files) != 0:
+        raise ValueError(
+            f"The zip of the Lambda function is stale ({', '.join(stale_files)}), rebuild it"
+            " with build_lambda.py."
+        )
+
     # get the s3 client
     env_variables = load_env_variables()
     session = boto3.Session(